@@ -0,0 +1,189 @@
+"""
+Admission control for call surges.
+
+Watches the emergency queue and the recent latency and error rates of the LLM
+and TTS backends, and steps the voice server down through degraded modes while
+they are under pressure:
+
+    1 static_prompts     fixed prompts are played from cache, every other line
+                         is spoken by Twilio's own voice instead of Minimax
+    2 small_model        turns are analysed by the smaller, faster model
+    3 deferred_analysis  calls that are already classified get their next
+                         question at once; their turns are analysed once the
+                         pressure drops
+
+Each mode includes the ones before it. The controller steps up as soon as a
+signal crosses its threshold, and back down one mode at a time after the
+signals have been calm for a while, so a recovering backend is probed
+gradually rather than hit with the full load at once.
+
+Environment:
+    ADMISSION_MAX_MODE          highest mode the controller may enter (0 disables it)
+    ADMISSION_WINDOW_SECONDS    how far back latency and error rates are measured
+    ADMISSION_RECOVERY_SECONDS  calm time before stepping down one mode
+    TTS_SLOW_SECONDS            TTS p95 that switches to static prompts
+    LLM_SLOW_SECONDS            LLM p95 that switches to the small model
+    LLM_STALLED_SECONDS         LLM p95 that defers analysis
+    BACKEND_ERROR_RATE          LLM or TTS error rate that counts as a slow backend
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from agents.metrics import registry
+
+MODES = ('normal', 'static_prompts', 'small_model', 'deferred_analysis')
+NORMAL, STATIC_PROMPTS, SMALL_MODEL, DEFERRED_ANALYSIS = range(len(MODES))
+
+# Fewer observations than this in the window say nothing about a backend
+MIN_SAMPLES = 5
+
+
+class AdmissionController:
+    def __init__(self, queue, interval=1.0):
+        self.queue = queue
+        self.interval = interval
+        self.max_level = min(int(os.getenv('ADMISSION_MAX_MODE', str(DEFERRED_ANALYSIS))), DEFERRED_ANALYSIS)
+        self.window = float(os.getenv('ADMISSION_WINDOW_SECONDS', '30'))
+        self.recovery = float(os.getenv('ADMISSION_RECOVERY_SECONDS', '30'))
+        self.tts_slow = float(os.getenv('TTS_SLOW_SECONDS', '2'))
+        self.llm_slow = float(os.getenv('LLM_SLOW_SECONDS', '4'))
+        self.llm_stalled = float(os.getenv('LLM_STALLED_SECONDS', '8'))
+        self.error_rate = float(os.getenv('BACKEND_ERROR_RATE', '0.2'))
+
+        self.level = NORMAL
+        self.reasons = []
+        self._calm_since = None
+        self._listeners = []
+        self._task = None
+
+        # Signals, as recorded by the LLM and TTS clients
+        self._llm = registry.histogram('stage_duration_seconds', stage='process_emergency_call')
+        self._llm_errors = registry.counter('stage_errors_total', stage='process_emergency_call')
+        self._tts = registry.histogram('stage_duration_seconds', stage='generate_speech')
+        self._tts_failures = registry.counter('tts_failures_total')
+
+        registry.gauge('admission_level', fn=lambda: self.level)
+        self._steps = {mode: registry.counter('admission_steps_total', mode=mode) for mode in MODES}
+        self._degraded = {mode: registry.counter('degraded_total', mode=mode) for mode in MODES[1:]}
+
+    @property
+    def mode(self):
+        return MODES[self.level]
+
+    @property
+    def static_prompts(self):
+        return self.level >= STATIC_PROMPTS
+
+    @property
+    def small_model(self):
+        return self.level >= SMALL_MODEL
+
+    @property
+    def deferred_analysis(self):
+        return self.level >= DEFERRED_ANALYSIS
+
+    def on_change(self, listener):
+        """Register `listener(level, previous)`, called on every mode change; usable as a decorator"""
+        self._listeners.append(listener)
+        return listener
+
+    def record(self, mode):
+        """Count one line, call or turn served in a degraded mode"""
+        self._degraded[mode].inc()
+
+    def _p95(self, histogram):
+        if histogram.recent_count(self.window) < MIN_SAMPLES:
+            return None
+        return histogram.recent_percentile(0.95, self.window)
+
+    def _failure_rate(self, failures, histogram):
+        calls = histogram.recent_count(self.window)
+        if calls < MIN_SAMPLES:
+            return 0.0
+        return failures.recent(self.window) / calls
+
+    def pressure(self):
+        """The mode the current signals call for, and why"""
+        needs = []
+        fill = self.queue.depth() / self.queue.maxsize
+        if self.queue.saturated:
+            needs.append((DEFERRED_ANALYSIS, f"emergency queue {fill:.0%} full"))
+        elif fill >= 0.5:
+            needs.append((SMALL_MODEL, f"emergency queue {fill:.0%} full"))
+
+        llm_p95 = self._p95(self._llm)
+        if llm_p95 is not None and llm_p95 >= self.llm_stalled:
+            needs.append((DEFERRED_ANALYSIS, f"LLM p95 {llm_p95:.1f}s"))
+        elif llm_p95 is not None and llm_p95 >= self.llm_slow:
+            needs.append((SMALL_MODEL, f"LLM p95 {llm_p95:.1f}s"))
+        llm_errors = self._failure_rate(self._llm_errors, self._llm)
+        if llm_errors >= self.error_rate:
+            needs.append((SMALL_MODEL, f"LLM errors {llm_errors:.0%}"))
+
+        tts_p95 = self._p95(self._tts)
+        if tts_p95 is not None and tts_p95 >= self.tts_slow:
+            needs.append((STATIC_PROMPTS, f"TTS p95 {tts_p95:.1f}s"))
+        tts_errors = self._failure_rate(self._tts_failures, self._tts)
+        if tts_errors >= self.error_rate:
+            needs.append((STATIC_PROMPTS, f"TTS errors {tts_errors:.0%}"))
+
+        level = min(max((need for need, _ in needs), default=NORMAL), self.max_level)
+        return level, [reason for _, reason in needs]
+
+    def evaluate(self, now=None):
+        """Move to the mode the signals call for; returns the current level"""
+        now = now if now is not None else time.monotonic()
+        target, reasons = self.pressure()
+        if target > self.level:
+            self.reasons = reasons
+            self._step(target)
+            self._calm_since = None
+        elif target < self.level:
+            # Only step down once the signals have stayed below this mode for a while
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.recovery:
+                self.reasons = reasons
+                self._step(self.level - 1)
+                self._calm_since = now
+        else:
+            self._calm_since = None
+        return self.level
+
+    def _step(self, level):
+        previous, self.level = self.level, level
+        self._steps[self.mode].inc()
+        if level > previous:
+            logging.warning("Admission control: %s -> %s (%s)", MODES[previous], self.mode, ", ".join(self.reasons))
+        else:
+            logging.info("Admission control: %s -> %s", MODES[previous], self.mode)
+        for listener in self._listeners:
+            try:
+                listener(level, previous)
+            except Exception as e:
+                logging.error("Error in admission listener: %s", e)
+
+    def start(self):
+        """Evaluate the signals every `interval` seconds on the running loop"""
+        if self._task is None and self.max_level > NORMAL:
+            self._task = asyncio.create_task(self._run(), name="admission-controller")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.evaluate()
+            except Exception as e:
+                logging.error("Error evaluating admission signals: %s", e)
+
+    def to_dict(self):
+        return {'mode': self.mode, 'level': self.level, 'reasons': self.reasons}
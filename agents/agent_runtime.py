@@ -0,0 +1,134 @@
+"""
+In-process runtime for the uAgents behind the voice server.
+
+Agents are hosted on the caller's running event loop, normally the web
+server's, rather than each owning a loop in its own thread. A message between
+two agents hosted here is handed to the destination's handler as the model
+object itself: no JSON round trip, no envelope, no queue or thread hop. Any
+other destination goes out through the regular uAgents resolver and envelope
+transport, and one ASGI endpoint accepts envelopes from remote agents.
+
+Agents can be given as a factory instead, so that building them (which
+queries the Almanac contract over the network) happens when the runtime
+starts, in a worker thread, rather than when their module is imported.
+"""
+
+import asyncio
+import logging
+import uuid
+
+from uagents import Model
+from uagents.asgi import ASGIServer
+from uagents_core.types import DeliveryStatus, MsgStatus
+
+
+class AgentRuntime:
+    def __init__(self, agents=(), factory=None):
+        """`factory(loop)` returns further agents to host, built when the runtime starts"""
+        self._agents = {}
+        self._queries = {}
+        self._factory = factory
+        self._server = None
+        self._server_task = None
+        self._tasks = set()
+        self._started = False
+        for agent in agents:
+            self.add(agent)
+
+    def add(self, agent):
+        self._agents[agent.address] = agent
+
+    def hosts(self, address):
+        return address in self._agents
+
+    def agent(self, name):
+        """The hosted agent called `name`"""
+        for agent in self._agents.values():
+            if agent.name == name:
+                return agent
+        raise KeyError(name)
+
+    @property
+    def agents(self):
+        return list(self._agents.values())
+
+    def background(self, coro):
+        """Run a coroutine alongside the agents; it is cancelled when the runtime stops"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def start(self, port=None):
+        """Start the hosted agents' background tasks on the running loop, serving remote envelopes on `port`"""
+        if self._started:
+            return
+        loop = asyncio.get_running_loop()
+        if self._factory is not None:
+            for agent in await asyncio.to_thread(self._factory, loop):
+                self.add(agent)
+            self._factory = None
+        for agent in self._agents.values():
+            agent.update_loop(loop)
+            agent.update_queries(self._queries)
+            agent.setup()
+
+        if port:
+            self._server = ASGIServer(port=port, loop=loop, queries=self._queries, logger=logging.getLogger("agents"))
+            self._server_task = loop.create_task(self._server.serve())
+        self._started = True
+
+    async def stop(self):
+        """Run the agents' shutdown handlers and close the envelope endpoint"""
+        if not self._started:
+            return
+        for agent in self._agents.values():
+            for handler in agent._on_shutdown:
+                try:
+                    await handler(agent._build_context())
+                except Exception as e:
+                    logging.error("Error in %s shutdown handler: %s", agent.name, e)
+        self._started = False
+
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self._server_task is not None:
+            if self._server._server is not None:
+                self._server._server.should_exit = True
+            await asyncio.wait([self._server_task], timeout=5)
+            self._server_task = None
+
+    async def serve(self, port):
+        """Host the agents on their own until cancelled"""
+        await self.start(port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    async def send(self, sender, destination, message: Model):
+        """Send a message from a hosted agent, in memory when the destination is hosted here too"""
+        agent = self._agents.get(destination)
+        if agent is None:
+            return await sender._build_context().send(destination, message)
+
+        schema_digest = Model.build_schema_digest(message)
+        handler = (agent._unsigned_message_handlers.get(schema_digest)
+                   or agent._signed_message_handlers.get(schema_digest))
+        if handler is None:
+            logging.warning("Agent %s has no handler for %s", agent.name, type(message).__name__)
+            return MsgStatus(status=DeliveryStatus.FAILED, detail="No handler for message",
+                             destination=destination, endpoint="", session=uuid.uuid4())
+
+        ctx = agent._build_context()
+        try:
+            await handler(ctx, sender.address, message)
+        except Exception as e:
+            # Reported like an undeliverable envelope, so the sender can retry the message
+            logging.error("Agent %s failed to handle %s: %s", agent.name, type(message).__name__, e)
+            return MsgStatus(status=DeliveryStatus.FAILED, detail=f"Handler failed: {e}",
+                             destination=destination, endpoint="", session=ctx.session)
+        return MsgStatus(status=DeliveryStatus.DELIVERED, detail="Delivered in process",
+                         destination=destination, endpoint="", session=ctx.session)
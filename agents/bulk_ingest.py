@@ -0,0 +1,140 @@
+"""
+Streaming reader for bulk case uploads.
+
+POST /webhook/bulk takes newline-delimited JSON, one case record per line,
+gzip-compressed when sent with Content-Encoding: gzip:
+
+    {"category": "fire", "case_number": "F-1001", "location": "12 Oak St", "situation": "...", "open_status": "yes", "stack_rank": 1}
+
+The body is decompressed and split into lines as it arrives, and the server
+files the records a batch at a time, so an upload of any size is held in
+memory one batch at a time. Each record is validated on its own: a bad record
+is reported by line number and the rest of the upload still goes in.
+"""
+
+import json
+import zlib
+
+from agents.case_store import CATEGORIES
+
+# Longest record accepted; longer lines are rejected without being buffered whole
+MAX_RECORD_BYTES = 64 * 1024
+# Decompressed bytes produced per step, so a small compressed chunk cannot expand all at once
+INFLATE_CHUNK = 256 * 1024
+
+TEXT_FIELDS = ('location', 'dispatch', 'situation', 'transcript')
+NUMBER_FIELDS = ('created_at', 'reported_at', 'closed_at', 'latitude', 'longitude')
+
+
+class Inflater:
+    """Gzip decompression of a body fed in chunks; concatenated gzip members are read one after another"""
+
+    def __init__(self):
+        self._inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def feed(self, data):
+        """Yield the decompressed bytes of the next chunk of the body"""
+        while data:
+            if self._inflater.eof:
+                self._inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            out = self._inflater.decompress(data, INFLATE_CHUNK)
+            if out:
+                yield out
+            data = self._inflater.unused_data if self._inflater.eof else self._inflater.unconsumed_tail
+
+    def finish(self):
+        """Whatever output is still held back; raises ValueError if the body ends mid-member"""
+        rest = self._inflater.flush()
+        if not self._inflater.eof:
+            raise ValueError("gzip stream ends mid-member")
+        return rest
+
+
+class LineSplitter:
+    """Splits a byte stream fed in chunks into numbered lines of at most `limit` bytes"""
+
+    def __init__(self, limit=MAX_RECORD_BYTES):
+        self.limit = limit
+        self.number = 0
+        self._partial = []
+        self._size = 0
+
+    def _line(self, tail):
+        self.number += 1
+        too_long = self._size + len(tail) > self.limit
+        line = None if too_long else b''.join(self._partial) + tail
+        self._partial, self._size = [], 0
+        return self.number, line
+
+    def feed(self, data):
+        """Yield (line number, line) for each line the chunk completes; the line is None if it is too long"""
+        start = 0
+        while True:
+            end = data.find(b'\n', start)
+            if end < 0:
+                break
+            yield self._line(data[start:end])
+            start = end + 1
+        rest = data[start:]
+        if rest:
+            # An overlong line is only counted from here on, not kept
+            if self._size + len(rest) <= self.limit:
+                self._partial.append(rest)
+            self._size += len(rest)
+
+    def finish(self):
+        """The last line, if the stream does not end with a newline"""
+        if self._size:
+            yield self._line(b'')
+
+
+def _nonblank(lines):
+    return ((number, line) for number, line in lines if line is None or line.strip())
+
+
+async def read_lines(chunks, compressed=False, limit=MAX_RECORD_BYTES):
+    """Yield (line number, line) from an async iterator of body chunks; blank lines are skipped"""
+    inflater = Inflater() if compressed else None
+    splitter = LineSplitter(limit)
+    async for chunk in chunks:
+        for data in (inflater.feed(chunk) if inflater else (chunk,)):
+            for numbered in _nonblank(splitter.feed(data)):
+                yield numbered
+    rest = inflater.finish() if inflater else b''
+    for numbered in _nonblank([*splitter.feed(rest), *splitter.finish()]):
+        yield numbered
+
+
+def parse_record(line):
+    """(category, case) of one line of an upload; raises ValueError saying what is wrong with it"""
+    if line is None:
+        raise ValueError(f"record longer than {MAX_RECORD_BYTES} bytes")
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise ValueError("record is not a JSON object")
+
+    case = dict(record)
+    category = case.pop('category', None)
+    if category not in CATEGORIES:
+        raise ValueError(f"unknown category {category!r}")
+    number = case.get('case_number')
+    if isinstance(number, bool) or not isinstance(number, (str, int)) or not str(number).strip():
+        raise ValueError("case_number must be a non-empty string or integer")
+    for field in TEXT_FIELDS:
+        if not isinstance(case.get(field, ''), (str, type(None))):
+            raise ValueError(f"{field} must be a string")
+    for field in NUMBER_FIELDS:
+        value = case.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{field} must be a number")
+    if str(case.get('open_status', 'yes')).lower() not in ('yes', 'no'):
+        raise ValueError("open_status must be yes or no")
+    if 'stack_rank' in case:
+        try:
+            int(case['stack_rank'])
+        except (TypeError, ValueError):
+            raise ValueError("stack_rank must be an integer")
+    return category, case
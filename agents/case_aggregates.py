@@ -0,0 +1,69 @@
+"""
+Incrementally maintained case counts for the dashboard charts.
+
+The case store calls update() whenever a case moves between index buckets, so
+the counts never need a pass over the full case list.
+"""
+
+import time
+from collections import Counter
+
+
+def _label(value):
+    return "unknown" if value is None else str(value)
+
+
+class CaseAggregates:
+    def __init__(self, bucket_seconds=60, window_buckets=60):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.by_category = Counter()
+        self.by_status = Counter()
+        self.by_priority = Counter()
+        self.by_category_priority = Counter()
+        self.by_category_status = Counter()
+        self._arrivals = {}  # bucket start -> new cases in that bucket
+
+    def update(self, old, new):
+        """Move one case from its old (category, status, priority) to the new one"""
+        for delta, values in ((-1, old), (1, new)):
+            if values is None:
+                continue
+            category, status, priority = values
+            self.by_category[category] += delta
+            self.by_status[status] += delta
+            self.by_priority[_label(priority)] += delta
+            self.by_category_priority[(category, _label(priority))] += delta
+            self.by_category_status[(category, status)] += delta
+
+    def open_count(self, category):
+        """Number of open cases in a category"""
+        return self.by_category_status[(category, 'yes')]
+
+    def record_arrival(self, ts):
+        """Count a new case in its time bucket, dropping buckets outside the window"""
+        bucket = int(ts // self.bucket_seconds) * self.bucket_seconds
+        oldest = int(time.time() // self.bucket_seconds - self.window_buckets + 1) * self.bucket_seconds
+        if bucket < oldest:
+            return
+        self._arrivals[bucket] = self._arrivals.get(bucket, 0) + 1
+        for stale in [b for b in self._arrivals if b < oldest]:
+            del self._arrivals[stale]
+
+    def to_dict(self):
+        """Return the aggregates in the JSON layout read by the dashboard"""
+        return {
+            'by_category': {k: v for k, v in self.by_category.items() if v},
+            'by_status': {k: v for k, v in self.by_status.items() if v},
+            'by_priority': {k: v for k, v in self.by_priority.items() if v},
+            'by_category_priority': [
+                {'category': category, 'priority': priority, 'count': count}
+                for (category, priority), count in self.by_category_priority.items() if count
+            ],
+            'arrivals': [
+                {'bucket': bucket, 'count': count}
+                for bucket, count in sorted(self._arrivals.items())
+            ],
+            'bucket_seconds': self.bucket_seconds,
+            'updated_at': time.time(),
+        }
@@ -0,0 +1,193 @@
+"""
+Cold tier of the case store.
+
+Closed cases older than the retention window move out of data.json into
+gzip-compressed NDJSON segments, one per day the call came in. An archival run
+appends one gzip member per day it touches, so a segment is only ever appended
+to. An SQLite index maps each archived case number to the member holding it,
+and the index on call time serves date range queries, so either kind of
+lookup decompresses only the members it needs, however many years are held.
+
+A member is written and synced before its cases are indexed; a member cut
+short by a crash is never indexed and its cases are archived again from the
+hot tier.
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from agents.metrics import registry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_number TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cases_created_at ON cases (created_at);
+"""
+
+# Case numbers looked up per query
+QUERY_BATCH = 500
+
+
+def day_of(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def created_at(case):
+    """When a case came in; cases stored without timestamps fall back to when they closed, or now"""
+    return case.get('created_at') or case.get('closed_at') or time.time()
+
+
+class CaseArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # Connected on first use, so opening the case store touches no archive files until it archives
+        self._conn = None
+        self._archived = registry.counter('archived_cases_total')
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.db')
+
+    @property
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def segment_path(self, day):
+        return os.path.join(self.directory, f"cases-{day}.jsonl.gz")
+
+    def append(self, cases):
+        """Archive (category, case) pairs"""
+        by_day = {}
+        for category, case in cases:
+            record = dict(case, category=category, created_at=created_at(case))
+            by_day.setdefault(day_of(record['created_at']), []).append(record)
+
+        os.makedirs(self.directory, exist_ok=True)
+        rows = []
+        for day, records in sorted(by_day.items()):
+            member = gzip.compress(b''.join(json.dumps(record).encode() + b'\n' for record in records))
+            with open(self.segment_path(day), 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(member)
+                f.flush()
+                os.fsync(f.fileno())
+            rows.extend(
+                (str(record['case_number']), record['category'], record['created_at'], day, offset, len(member))
+                for record in records
+            )
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        self._archived.inc(len(rows))
+        logging.info("Archived %d closed cases into %d segments", len(rows), len(by_day))
+
+    def _empty(self):
+        # Nothing was ever archived; reads must not create the archive
+        return self._conn is None and not os.path.exists(self.index_path)
+
+    def __contains__(self, case_number):
+        return bool(self.known([case_number]))
+
+    def known(self, case_numbers):
+        """The given case numbers that are archived"""
+        keys = [str(case_number) for case_number in case_numbers]
+        if not keys or self._empty():
+            return set()
+        found = set()
+        with self._lock:
+            # Bounded batches stay under SQLite's limit on query parameters
+            for start in range(0, len(keys), QUERY_BATCH):
+                batch = keys[start:start + QUERY_BATCH]
+                found.update(row[0] for row in self._db.execute(
+                    f"SELECT case_number FROM cases WHERE case_number IN ({','.join('?' * len(batch))})", batch
+                ))
+        return found
+
+    def _read(self, rows):
+        """The archived cases of index rows (case_number, day, offset, length), in row order"""
+        members = {}
+        for _, day, offset, length in rows:
+            if (day, offset) in members:
+                continue
+            with open(self.segment_path(day), 'rb') as f:
+                f.seek(offset)
+                lines = gzip.decompress(f.read(length)).splitlines()
+            members[(day, offset)] = {str(record['case_number']): record for record in map(json.loads, lines)}
+        return [members[(day, offset)][case_number] for case_number, day, offset, _ in rows]
+
+    def get(self, case_number):
+        """An archived case with its category, or None"""
+        return self.get_many([case_number]).get(str(case_number))
+
+    def get_many(self, case_numbers):
+        """Archived cases by case number; numbers not in the archive are left out"""
+        keys = [str(case_number) for case_number in case_numbers]
+        if not keys or self._empty():
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT case_number, day, offset, length FROM cases WHERE case_number IN ({','.join('?' * len(keys))})",
+                keys
+            ).fetchall()
+        return {row[0]: case for row, case in zip(rows, self._read(rows))}
+
+    def between(self, start, end, category=None, limit=1000):
+        """Archived cases that came in from `start` up to `end` (epoch seconds), oldest first"""
+        if self._empty():
+            return []
+        query = "SELECT case_number, day, offset, length FROM cases WHERE created_at >= ? AND created_at < ?"
+        params = [start, end]
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+        query += " ORDER BY created_at"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return self._read(rows)
+
+    def scan(self, start, end, page=1000):
+        """Yield every archived case that came in from `start` up to `end`, a page of rows at a time"""
+        if self._empty():
+            return
+        after = (start, '')
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT case_number, day, offset, length, created_at FROM cases "
+                    "WHERE (created_at, case_number) > (?, ?) AND created_at < ? "
+                    "ORDER BY created_at, case_number LIMIT ?",
+                    (*after, end, page)
+                ).fetchall()
+            if not rows:
+                return
+            yield from self._read([row[:4] for row in rows])
+            after = (rows[-1][4], rows[-1][0])
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,813 @@
+"""
+Case store backing the dispatcher dashboard.
+
+Each case is keyed by its case id (the Twilio CallSid for live calls) and is
+updated in place as the call progresses. Every update is appended to a
+turn-level delta log, while the full snapshot in data.json is rewritten at most
+once per flush interval. Each snapshot starts a fresh log, and the log before
+it is deleted once the snapshot is synced to disk, so the log only ever holds
+the changes since the last snapshot and restarts replay just those.
+
+Besides the primary index by case id, the store keeps secondary indexes by
+category, open status and priority so reclassifying, closing and listing cases
+never scans the full case list.
+
+When pyarrow is installed, every flush also writes a typed columnar snapshot
+(Arrow IPC) that the dashboard memory-maps instead of rebuilding a DataFrame,
+alongside a small JSON file of chart aggregates kept up to date incrementally.
+
+Cases filed through file() are correlated into incidents (see incidents.py):
+a caller reporting an open incident is added to that incident's callers
+instead of getting a case of their own. The incident stays open until the
+last of its callers hangs up.
+
+A writable store also keeps a full-text index over the location, situation
+and transcript of every case (see search_index.py), updated with each change.
+
+The store holds open and recently closed cases only. Cases closed for longer
+than the retention window move to the archive (see case_archive.py) as the
+store flushes, so the snapshot, the dashboard and every index stay bounded by
+recent activity rather than by the years of calls held.
+
+Environment:
+    INCIDENT_CORRELATION  0 to give every caller a case of their own
+    CASE_RETENTION_DAYS   how long closed cases stay in the store before they are archived
+    CASE_ARCHIVE_DIR      directory of the archive (default data.archive next to data.json)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import pyarrow as pa
+except ImportError:  # Columnar snapshots are optional
+    pa = None
+
+from agents.case_aggregates import CaseAggregates
+from agents.case_archive import CaseArchive
+from agents.incidents import IncidentIndex
+from agents.metrics import registry
+from agents.search_index import SearchIndex
+
+CATEGORIES = ["wildlife", "police", "water", "fire", "medical"]
+
+# Loaded cases indexed for search and as incidents per hold of the store lock
+INDEX_BATCH = 200
+
+# Closed cases past retention are looked for this often, and archived this many per flush
+ARCHIVE_INTERVAL = 60
+ARCHIVE_BATCH = 1000
+
+# Columns of the columnar snapshot, in the order the dashboard expects them
+SNAPSHOT_COLUMNS = ['case_number', 'location', 'dispatch', 'situation', 'open_status', 'stack_rank', 'category',
+                    'caller_count']
+
+if pa is not None:
+    SNAPSHOT_SCHEMA = pa.schema([
+        ('case_number', pa.string()),
+        ('location', pa.string()),
+        ('dispatch', pa.string()),
+        ('situation', pa.string()),
+        ('open_status', pa.dictionary(pa.int8(), pa.string())),
+        ('stack_rank', pa.int64()),
+        ('category', pa.dictionary(pa.int8(), pa.string())),
+        ('caller_count', pa.int64()),
+    ])
+
+
+def case_from_analysis(transcript, analysis):
+    """Map a Groq call analysis onto the fields the dashboard displays"""
+    details = analysis.get('analysis', {})
+    known_info = details.get('current_known_info', {})
+    if not isinstance(known_info, dict):
+        known_info = {}
+    conversation = analysis.get('conversation', {})
+
+    return {
+        'location': known_info.get('location', ''),
+        'dispatch': details.get('category', ''),
+        'situation': known_info.get('type', transcript),
+        'open_status': 'yes',
+        'stack_rank': details.get('priority', 5),
+        'transcript': transcript,
+        'next_question': conversation.get('next_question', ''),
+    }
+
+
+def _status_of(case):
+    return str(case.get('open_status', 'yes')).lower()
+
+
+def _priority_of(case):
+    try:
+        return int(case.get('stack_rank'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _expired(case, cutoff):
+    """Whether a closed case was closed, or came in, before a retention cutoff"""
+    return (case.get('closed_at') or case.get('created_at') or 0) < cutoff
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+def _fsync_dir(path):
+    """Make a rename into the directory of `path` durable"""
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def columnar_path(snapshot_path):
+    """Path of the Arrow snapshot written next to a JSON snapshot"""
+    return f"{os.path.splitext(snapshot_path)[0]}.arrow"
+
+
+def stats_path(snapshot_path):
+    """Path of the chart aggregates written next to a JSON snapshot"""
+    return f"{os.path.splitext(snapshot_path)[0]}.stats.json"
+
+
+def archive_path(snapshot_path):
+    """Directory of the case archive kept next to a JSON snapshot"""
+    return f"{os.path.splitext(snapshot_path)[0]}.archive"
+
+
+class CaseStore:
+    def __init__(self, snapshot_path="data.json", delta_log_path=None, flush_interval_ms=None, read_only=False, load=True):
+        """With load=False nothing is read or written until open() is called"""
+        if flush_interval_ms is None:
+            flush_interval_ms = int(os.getenv('CASE_FLUSH_INTERVAL_MS', '500'))
+
+        self.snapshot_path = snapshot_path
+        self.delta_log_path = delta_log_path or f"{os.path.splitext(snapshot_path)[0]}.deltas.jsonl"
+        # The log rotated out by a snapshot being written, deleted once the snapshot is durable
+        self.flushing_log_path = f"{self.delta_log_path}.flushing"
+        self.columnar_path = columnar_path(snapshot_path)
+        self.stats_path = stats_path(snapshot_path)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.read_only = read_only
+        self.correlate = not read_only and os.getenv('INCIDENT_CORRELATION', '1') != '0'
+        self._merged = registry.counter('incident_reports_merged_total')
+        self.retention = float(os.getenv('CASE_RETENTION_DAYS', '7')) * 86400
+        self.archive = None if read_only else CaseArchive(os.getenv('CASE_ARCHIVE_DIR') or archive_path(snapshot_path))
+        self._next_archive = 0.0
+
+        self._lock = threading.RLock()
+        # Held while a snapshot is written, outside the store lock
+        self._flush_lock = threading.Lock()
+        self._reset_indexes()
+        self._seq = 0
+        self._dirty = False
+        self._flush_timer = None
+        self._delta_log = None
+        self._opened = False
+        if load:
+            self.open()
+
+    def open(self):
+        """Open the delta log and load the stored cases"""
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+            if not self.read_only:
+                self._delta_log = open(self.delta_log_path, 'a')
+                # The first archival pass waits until startup is over
+                self._next_archive = time.time() + ARCHIVE_INTERVAL
+            self._load()
+
+    def _load(self):
+        """Load the last snapshot and replay any deltas written after it"""
+        if not os.path.exists(self.snapshot_path) and not self.read_only:
+            self._write_snapshot(*self._capture())
+            logging.info(f"Initialized data file at {self.snapshot_path} with empty categories.")
+
+        self._load_snapshot()
+        if self.read_only:
+            return
+        if not os.path.exists(self.stats_path) or (pa is not None and not os.path.exists(self.columnar_path)):
+            self._write_derived(*self._capture())
+
+        # Deltas after the last flush marker's seq never made it into the snapshot. A
+        # rotated log is left over if the process stopped before its snapshot was synced
+        pending = []
+        for path in (self.flushing_log_path, self.delta_log_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"Skipping corrupt delta log line in {path}")
+                        continue
+                    self._seq = max(self._seq, entry.get('seq', 0))
+                    if 'flushed' in entry:
+                        # Deltas logged while the snapshot was written have a later seq than the marker
+                        pending = [p for p in pending if p.get('seq', 0) > entry['seq']]
+                    else:
+                        pending.append(entry)
+
+        for entry in pending:
+            if entry.get('deleted'):
+                self._remove(entry['case_id'])
+                continue
+            if 'archived' in entry:
+                for key in entry['archived']:
+                    self._remove(key, searchable=True)
+                continue
+            self._apply(entry['case_id'], entry['category'], entry['fields'], entry.get('turn'), entry.get('ts'))
+        if pending:
+            logging.info(f"Replayed {len(pending)} unflushed case deltas from {self.delta_log_path}")
+            self._dirty = True
+            self.flush()
+
+        # Loaded cases are indexed in the background so a large store does not delay startup
+        if self.text_index is not None:
+            threading.Thread(target=self._index_loaded, name='case-index', daemon=True).start()
+
+    def _load_snapshot(self):
+        with open(self.snapshot_path, 'r') as f:
+            data = json.load(f)
+
+        for category, cases in data.items():
+            for case in cases:
+                key = str(case['case_number'])
+                self._cases[key] = case
+                self._index(key, category)
+                if 'created_at' in case:
+                    self.aggregates.record_arrival(case['created_at'])
+                self._alias_callers(key, case)
+                if self.text_index is not None:
+                    self._unindexed.append(key)
+
+    def _reset_indexes(self):
+        self._cases = {}  # case id -> case fields
+        self._indexed = {}  # case id -> (category, status, priority) it is indexed under
+        # Secondary indexes map a value to an insertion-ordered set of case ids
+        self._by_category = {category: {} for category in CATEGORIES}
+        self._by_status = {}
+        self._by_priority = {}
+        self.aggregates = CaseAggregates()
+        # Open incidents new reports are matched against, and each merged caller's incident
+        self.incidents = IncidentIndex() if self.correlate else None
+        self._aliases = {}
+        # Full-text index for search; only the writer serves searches
+        self.text_index = None if self.read_only else SearchIndex()
+        self._unindexed = []  # loaded cases not yet indexed for search and incidents
+
+    def reload(self):
+        """Re-read the snapshot from disk (used by read-only consumers)"""
+        with self._lock:
+            self._reset_indexes()
+            self._load_snapshot()
+
+    def _index(self, key, category):
+        """Move a case to the index buckets matching its current fields"""
+        case = self._cases[key]
+        new = (category, _status_of(case), _priority_of(case))
+        old = self._indexed.get(key)
+        if old == new:
+            return
+
+        for index, old_value, new_value in zip(
+            (self._by_category, self._by_status, self._by_priority), old or (None,) * 3, new
+        ):
+            if old is not None and old_value != new_value:
+                index[old_value].pop(key, None)
+                if not index[old_value] and index is not self._by_category:
+                    del index[old_value]
+            if old is None or old_value != new_value:
+                index.setdefault(new_value, {})[key] = None
+        self._indexed[key] = new
+        self.aggregates.update(old, new)
+
+    def _apply(self, key, category, fields, turn=None, ts=None):
+        case = self._cases.get(key)
+        if case is None:
+            ts = ts or time.time()
+            case = self._cases[key] = {'case_number': key, 'created_at': ts}
+            self.aggregates.record_arrival(ts)
+        case.update(fields)
+        if turn is not None:
+            case['turns'] = max(case.get('turns', 0), turn)
+        self._index(key, category)
+        if self.text_index is not None:
+            self.text_index.add(key, category, case, ts or time.time())
+        self._track_incident(key, category, case, max(case.get('reported_at', 0), ts or case['created_at']))
+        return case
+
+    def _alias_callers(self, key, case):
+        for caller in case.get('callers', ()):
+            if caller != key:
+                self._aliases[caller] = key
+
+    def _track_incident(self, key, category, case, reported_at):
+        self._alias_callers(key, case)
+        if self.incidents is None:
+            return
+        if _status_of(case) != 'yes' or not reported_at or time.time() - reported_at > self.incidents.window:
+            self.incidents.remove(key)
+        else:
+            self.incidents.add(key, category, case, reported_at)
+
+    def _index_loaded(self):
+        """Index the cases loaded at startup, a batch at a time between requests"""
+        while True:
+            with self._lock:
+                batch = self._unindexed[-INDEX_BATCH:]
+                del self._unindexed[-INDEX_BATCH:]
+                for key in batch:
+                    case = self._cases.get(key)
+                    # Cases updated since loading were indexed then
+                    if case is None or key in self.text_index:
+                        continue
+                    category = self._indexed[key][0]
+                    updated = max(case.get(name) or 0 for name in ('created_at', 'reported_at', 'closed_at'))
+                    self.text_index.add(key, category, case, updated or None)
+                    self._track_incident(key, category, case, case.get('reported_at', case.get('created_at')))
+                if not self._unindexed:
+                    break
+            time.sleep(0)
+
+        # Archived cases stay searchable for the search retention period
+        now = time.time()
+        batch = []
+        for case in self.archive.scan(now - self.text_index.retention, now):
+            batch.append(case)
+            if len(batch) == INDEX_BATCH:
+                self._index_archived(batch)
+                batch = []
+        self._index_archived(batch)
+        logging.info("Indexed %d cases for search", len(self.text_index))
+
+    def _index_archived(self, cases):
+        with self._lock:
+            for case in cases:
+                key = str(case['case_number'])
+                if key not in self._cases and key not in self.text_index:
+                    updated = max(case.get(name) or 0 for name in ('created_at', 'reported_at', 'closed_at'))
+                    self.text_index.add(key, case['category'], case, updated or None)
+
+    def _remove(self, key, searchable=False):
+        """Drop a case from the store and its indexes; an archived case stays `searchable`"""
+        old = self._indexed.pop(key, None)
+        case = self._cases.pop(key, None)
+        if case is None:
+            return
+        for index, value in zip((self._by_category, self._by_status, self._by_priority), old):
+            index.get(value, {}).pop(key, None)
+            if value in index and not index[value] and index is not self._by_category:
+                del index[value]
+        self.aggregates.update(old, None)
+        for caller in case.get('callers', ()):
+            if self._aliases.get(caller) == key:
+                del self._aliases[caller]
+        if self.text_index is not None and not searchable:
+            self.text_index.remove(key)
+        if self.incidents is not None:
+            self.incidents.remove(key)
+
+    def _archive_closed(self):
+        """Move cases closed for longer than the retention window to the archive"""
+        now = time.time()
+        self._next_archive = now + ARCHIVE_INTERVAL
+        cutoff = now - self.retention
+        expired = []
+        for status, keys in self._by_status.items():
+            if status == 'yes':
+                continue
+            for key in keys:
+                if _expired(self._cases[key], cutoff):
+                    expired.append(key)
+            if len(expired) >= ARCHIVE_BATCH:
+                # The rest go with the next flush, keeping each hold of the lock short
+                del expired[ARCHIVE_BATCH:]
+                self._next_archive = now
+                break
+        if self.text_index is not None:
+            self.text_index.expire(lambda key: key in self._cases, now)
+        if not expired:
+            return
+
+        self.archive.append([(self._indexed[key][0], self._cases[key]) for key in expired])
+        self._seq += 1
+        self._delta_log.write(json.dumps({'seq': self._seq, 'ts': now, 'archived': expired}) + "\n")
+        self._delta_log.flush()
+        for key in expired:
+            self._remove(key, searchable=True)
+        self._dirty = True
+
+    def _archived(self, key):
+        """Whether a case not in the store was moved to the archive"""
+        return self.archive is not None and key not in self._cases and key in self.archive
+
+    def get(self, case_id):
+        """Return the case stored under case_id, or None"""
+        with self._lock:
+            return self._cases.get(str(case_id))
+
+    def search(self, query, limit=20, category=None):
+        """Cases matching a full-text query, best first, each with its category and score"""
+        if self.text_index is None:
+            raise RuntimeError("Case store was opened read-only")
+        with self._lock:
+            results = [
+                (key, score, dict(self._cases[key], category=self._indexed[key][0]) if key in self._cases else None)
+                for key, score in self.text_index.search(query, limit, category)
+            ]
+        # Matches that were archived meanwhile are read back from the archive
+        archived = self.archive.get_many([key for key, _, case in results if case is None])
+        return [
+            dict(case or archived[key], score=round(score, 4), **({} if case else {'archived': True}))
+            for key, score, case in results if case is not None or key in archived
+        ]
+
+    def incident_of(self, case_id):
+        """Id of the case a caller's reports are filed under: their incident's, or their own"""
+        key = str(case_id)
+        with self._lock:
+            return self._aliases.get(key, key)
+
+    def category_of(self, case_id):
+        with self._lock:
+            indexed = self._indexed.get(str(case_id))
+            return indexed[0] if indexed else None
+
+    def cases_in(self, category):
+        """Return the cases filed under a category"""
+        with self._lock:
+            return [self._cases[key] for key in self._by_category.get(category, {})]
+
+    def open_cases(self, category=None):
+        """Return open cases, optionally limited to one category"""
+        with self._lock:
+            keys = self._by_status.get('yes', {})
+            if category is not None:
+                in_category = self._by_category.get(category, {})
+                keys = [key for key in keys if key in in_category]
+            return [self._cases[key] for key in keys]
+
+    def by_priority(self, open_only=True):
+        """Return cases ordered by priority, most urgent first"""
+        with self._lock:
+            ordered = []
+            for priority in sorted(p for p in self._by_priority if p is not None):
+                ordered.extend(
+                    self._cases[key] for key in self._by_priority[priority]
+                    if not open_only or self._indexed[key][1] == 'yes'
+                )
+            return ordered
+
+    def rows(self):
+        """Yield (category, case) pairs without copying or mutating cases"""
+        with self._lock:
+            for category, keys in self._by_category.items():
+                for key in keys:
+                    yield category, self._cases[key]
+
+    def ingest(self, report):
+        """Add the cases of a {category: [case, ...]} report, skipping known case numbers"""
+        records = [(category, case) for category, cases in report.items() if category in CATEGORIES for case in cases]
+        return self.ingest_records(records).count('added')
+
+    def ingest_records(self, records):
+        """File (category, case) records, skipping known case numbers; returns the status of each
+
+        A record is 'added', a 'duplicate' of a stored or archived case, or
+        'archived': a case closed before the retention window goes straight to
+        the archive rather than through the store. Only records reported within
+        the incident window are correlated into incidents.
+        """
+        records = list(records)
+        now = time.time()
+        cutoff = now - self.retention
+        statuses, expired, seen = [], [], set()
+        with self._lock:
+            archived = self.archive.known(case['case_number'] for _, case in records)
+            for category, case in records:
+                key = str(case['case_number'])
+                # Case lookup is a dict hit instead of a scan of the category list
+                if key in seen or key in archived or self.get(self.incident_of(key)) is not None:
+                    logging.debug("Duplicate case number '%s' found in category '%s', not adding.", key, category)
+                    statuses.append('duplicate')
+                    continue
+                seen.add(key)
+                if _status_of(case) != 'yes' and _expired(case, cutoff):
+                    expired.append((category, case))
+                    statuses.append('archived')
+                    continue
+                reported = case.get('reported_at') or case.get('created_at')
+                if self.incidents is not None and reported and now - reported > self.incidents.window:
+                    # A backfilled report from before the incident window neither joins nor opens a live incident
+                    self.upsert(key, category, case, ts=reported)
+                else:
+                    self.file(key, category, case)
+                statuses.append('added')
+                logging.debug("Added new case to category '%s': %s", category, key)
+            if expired:
+                self.archive.append(expired)
+                if self.text_index is not None:
+                    self._index_archived([dict(case, category=category) for category, case in expired])
+        return statuses
+
+    def reclassify(self, case_id, category):
+        """Move a case to another category"""
+        key = str(case_id)
+        if key not in self._cases:
+            return None
+        return self.upsert(key, category, {})
+
+    def close_case(self, case_id):
+        """Mark a case as no longer open; an incident closes once its last caller hangs up"""
+        caller = str(case_id)
+        with self._lock:
+            key = self._aliases.get(caller, caller)
+            if key not in self._cases:
+                return None
+            case = self._cases[key]
+            if 'active_callers' in case:
+                active = [other for other in case['active_callers'] if other != caller]
+                if active:
+                    return self.upsert(key, self._indexed[key][0], {'active_callers': active})
+                return self.upsert(key, self._indexed[key][0],
+                                   {'active_callers': [], 'open_status': 'no', 'closed_at': time.time()})
+            return self.upsert(key, self._indexed[key][0], {'open_status': 'no', 'closed_at': time.time()})
+
+    def file(self, case_id, category, fields, turn=None):
+        """Upsert a caller's case, merging it into an open incident other callers reported"""
+        caller = str(case_id)
+        if category not in CATEGORIES:
+            return self.upsert(caller, category, fields, turn)
+        with self._lock:
+            if self._archived(caller):
+                logging.debug("Skipping late turn %s of archived case '%s'", turn, caller)
+                return None
+            incident = self._aliases.get(caller)
+            if incident is not None and caller in (self._cases.get(incident, {}).get('callers') or ()):
+                if self._indexed[incident][0] == category:
+                    return self._merge(incident, caller, fields, turn)
+                # The caller turned out to report something else; they get a case of their own
+                self._detach(incident, caller)
+
+            existing = self._cases.get(caller)
+            # A caller's own case is matched until other callers have joined it
+            if self.incidents is not None and (existing is None or len(existing.get('callers', ())) <= 1):
+                report = dict(existing or {}, **fields)
+                incident = self.incidents.match(category, report, exclude=caller)
+                if incident is not None:
+                    if existing is not None:
+                        self._delete(caller)
+                    return self._merge(incident, caller, report, turn)
+            return self.upsert(caller, category, fields, turn)
+
+    def _merge(self, key, caller, fields, turn=None):
+        """Fold one caller's report into an incident"""
+        incident = self._cases[key]
+        turns = incident.get('caller_turns', {})
+        if turn is not None and turns.get(caller, 0) > turn:
+            logging.debug("Skipping stale turn %s of caller '%s' in incident '%s'", turn, caller, key)
+            return incident
+
+        callers = incident.get('callers') or [key]
+        update = {'reported_at': time.time()}
+        if caller not in callers:
+            self._merged.inc()
+            logging.info("Caller %s joined incident %s (%d callers)", caller, key, len(callers) + 1)
+            update['callers'] = callers + [caller]
+            update['active_callers'] = incident.get('active_callers', callers) + [caller]
+            update['caller_count'] = len(callers) + 1
+        if turn is not None:
+            update['caller_turns'] = dict(turns, **{caller: turn})
+        # The incident keeps what it knows; another caller only fills the gaps
+        for name in ('location', 'situation', 'dispatch', 'next_question'):
+            if not incident.get(name) and fields.get(name):
+                update[name] = fields[name]
+        # and may raise its priority
+        priority, reported = _priority_of(incident), _priority_of(fields)
+        if reported is not None and (priority is None or reported < priority):
+            update['stack_rank'] = reported
+        return self.upsert(key, self._indexed[key][0], update)
+
+    def _detach(self, key, caller):
+        """Take a caller out of an incident; it closes if they were the last caller still on the line"""
+        incident = self._cases[key]
+        callers = [other for other in incident.get('callers') or [key] if other != caller]
+        active = [other for other in incident.get('active_callers', callers) if other != caller]
+        update = {'callers': callers, 'active_callers': active, 'caller_count': len(callers)}
+        if caller in incident.get('caller_turns', {}):
+            update['caller_turns'] = {other: turn for other, turn in incident['caller_turns'].items() if other != caller}
+        if not active and _status_of(incident) == 'yes':
+            update.update(open_status='no', closed_at=time.time())
+        logging.info("Caller %s left incident %s (%d callers)", caller, key, len(callers))
+        self._aliases.pop(caller, None)
+        self.upsert(key, self._indexed[key][0], update)
+
+    def _delete(self, key):
+        """Remove a case for good, logging the deletion for replay"""
+        self._seq += 1
+        self._delta_log.write(json.dumps({'seq': self._seq, 'ts': time.time(), 'case_id': key, 'deleted': True}) + "\n")
+        self._delta_log.flush()
+        self._remove(key)
+        self._dirty = True
+
+    def upsert(self, case_id, category, fields, turn=None, ts=None, reopen=False):
+        """Create or update a case and schedule a coalesced snapshot write; `ts` backdates a report filed after the fact
+
+        A closed case stays closed: a turn filed after the caller hung up does
+        not set it open again unless `reopen` is given. A turn of a case that
+        was archived is dropped, unless `reopen` is given.
+        """
+        if category not in CATEGORIES:
+            logging.debug("Ignoring case '%s' with unknown category '%s'", case_id, category)
+            return None
+
+        if self.read_only:
+            raise RuntimeError("Case store was opened read-only")
+
+        key = str(case_id)
+        with self._lock:
+            # Turns can be redelivered after a restart; never let an older turn overwrite a newer one
+            existing = self._cases.get(key)
+            # A late or replayed turn of an archived call must not start a second copy of its case
+            if existing is None and not reopen and self._archived(key):
+                logging.debug("Skipping late turn %s of archived case '%s'", turn, key)
+                return None
+            if turn is not None and existing is not None and existing.get('turns', 0) > turn:
+                logging.debug("Skipping stale turn %s of case '%s'", turn, key)
+                return existing
+            if existing is not None and existing.get('closed_at') and _status_of(existing) != 'yes' and 'open_status' in fields:
+                if reopen:
+                    fields = dict(fields, closed_at=None)
+                elif _status_of(fields) == 'yes':
+                    fields = {name: value for name, value in fields.items() if name != 'open_status'}
+
+            self._seq += 1
+            entry = {
+                'seq': self._seq,
+                'ts': ts or time.time(),
+                'case_id': key,
+                'category': category,
+                'turn': turn,
+                'fields': fields,
+            }
+            self._delta_log.write(json.dumps(entry) + "\n")
+            self._delta_log.flush()
+
+            case = self._apply(key, category, fields, turn, entry['ts'])
+            self._dirty = True
+            self._schedule_flush()
+            return case
+
+    def snapshot(self):
+        """Return the store in the dashboard's category layout"""
+        with self._lock:
+            return {
+                category: [self._cases[key] for key in keys]
+                for category, keys in self._by_category.items()
+            }
+
+    def _schedule_flush(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _capture(self):
+        """Copy the (category, case) rows and aggregates a snapshot is written from; called with the lock held"""
+        rows = [(category, dict(self._cases[key])) for category, keys in self._by_category.items() for key in keys]
+        return rows, self.aggregates.to_dict()
+
+    def _write_snapshot(self, rows, stats):
+        snapshot = {category: [] for category in self._by_category}
+        for category, case in rows:
+            snapshot[category].append(case)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+            # Synced before the delta log it replaces is deleted
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_dir(self.snapshot_path)
+        self._write_derived(rows, stats)
+
+    def _write_derived(self, rows, stats):
+        """Write the chart aggregates and the columnar snapshot"""
+        tmp_path = f"{self.stats_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, self.stats_path)
+        self._write_columnar(rows)
+
+    @staticmethod
+    def _columns(rows):
+        columns = {name: [] for name in SNAPSHOT_COLUMNS}
+        for category, case in rows:
+            columns['case_number'].append(_text(case.get('case_number')))
+            columns['location'].append(_text(case.get('location')))
+            columns['dispatch'].append(_text(case.get('dispatch')))
+            columns['situation'].append(_text(case.get('situation')))
+            columns['open_status'].append(_status_of(case))
+            columns['stack_rank'].append(_priority_of(case))
+            columns['category'].append(category)
+            columns['caller_count'].append(case.get('caller_count', 1))
+        return columns
+
+    def _write_columnar(self, rows):
+        """Write the typed Arrow IPC snapshot read by the dashboard"""
+        if pa is None:
+            return
+        table = pa.table(self._columns(rows), schema=SNAPSHOT_SCHEMA)
+        tmp_path = f"{self.columnar_path}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.columnar_path)
+
+    def flush(self):
+        """Write the snapshot to disk if anything changed since the last flush
+
+        The store lock is only held while the cases are copied; the files are
+        written outside it, so requests updating the store do not wait on a
+        large snapshot being serialized.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            # Another thread is writing the snapshot; what it missed goes in the next one
+            with self._lock:
+                if self.flush_interval > 0:
+                    self._flush_timer = None
+                    self._schedule_flush()
+            return
+        try:
+            while self._flush_once():
+                pass
+        finally:
+            self._flush_lock.release()
+
+    def _flush_once(self):
+        """Write one snapshot; returns whether changes were made meanwhile that need another"""
+        with self._lock:
+            self._flush_timer = None
+            if self.archive is not None and time.time() >= self._next_archive:
+                try:
+                    self._archive_closed()
+                except Exception as e:
+                    logging.error(f"Error archiving closed cases: {e}")
+                if self._next_archive <= time.time():
+                    self._schedule_flush()
+            if not self._dirty:
+                return False
+            seq = self._seq
+            rows, stats = self._capture()
+            self._dirty = False
+            # Deltas from here on go to a fresh log; the current one is covered by this snapshot.
+            # A log left by a failed write stays until a snapshot covering it is durable
+            if not os.path.exists(self.flushing_log_path):
+                self._delta_log.close()
+                os.replace(self.delta_log_path, self.flushing_log_path)
+                self._delta_log = open(self.delta_log_path, 'a')
+
+        try:
+            self._write_snapshot(rows, stats)
+        except Exception as e:
+            logging.error(f"Error flushing case store: {e}")
+            with self._lock:
+                self._dirty = True
+            return False
+
+        with self._lock:
+            self._delta_log.write(json.dumps({'seq': seq, 'flushed': True}) + "\n")
+            self._delta_log.flush()
+            try:
+                os.remove(self.flushing_log_path)
+            except FileNotFoundError:
+                pass
+            logging.debug("Flushed case store snapshot at seq %d", seq)
+            # Without a flush timer, changes made during the write are written now
+            return self._dirty and self.flush_interval <= 0
+
+    def shutdown(self):
+        if self._delta_log is None:
+            return
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self.flush()
+        self._delta_log.close()
+        self.archive.close()
@@ -0,0 +1,99 @@
+"""
+Bounded work queue feeding the emergency agent.
+
+Producers (the webhook layer) put analysed turns on the queue and move on; a
+fixed pool of consumer tasks on the agent's event loop drains it in batches.
+The queue bound is the backpressure signal: `offer` refuses work when the
+queue is full, `put` waits for room, and `saturated` tells producers to shed
+optional load before it comes to that.
+"""
+
+import asyncio
+import logging
+import time
+
+from agents.metrics import registry
+
+
+class WorkQueue:
+    def __init__(self, name, handler, maxsize=1000, concurrency=4, batch_size=32, high_watermark=0.8):
+        """`handler` is a coroutine function called with a list of up to `batch_size` items"""
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.high_watermark = int(maxsize * high_watermark)
+        # Bound to a loop on first use, so producers may enqueue before the consumers start
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._workers = []
+
+        registry.gauge('queue_depth', fn=self.depth, queue=name)
+        self._rejected = registry.counter('queue_rejected_total', queue=name)
+        self._batches = registry.counter('queue_batches_total', queue=name)
+        self._items = registry.counter('queue_items_total', queue=name)
+        self._wait = registry.histogram('queue_wait_seconds', queue=name)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    @property
+    def saturated(self):
+        """True once the backlog passes the high watermark"""
+        return self.depth() >= self.high_watermark
+
+    def start(self):
+        """Start the consumer tasks on the running loop"""
+        if self._workers:
+            return
+        for index in range(self.concurrency):
+            task = asyncio.create_task(self._consume(), name=f"{self.name}-consumer-{index}")
+            self._workers.append(task)
+        logging.info("Started %d %s consumers (queue size %d, batch size %d)",
+                     self.concurrency, self.name, self.maxsize, self.batch_size)
+
+    async def stop(self, timeout=5.0):
+        """Let the consumers drain the backlog for up to `timeout` seconds, then cancel them"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("%s queue stopped with %d items undrained", self.name, self.depth())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def offer(self, item):
+        """Enqueue without waiting; returns False when the queue is full"""
+        try:
+            self._queue.put_nowait((time.perf_counter(), item))
+            return True
+        except asyncio.QueueFull:
+            self._rejected.inc()
+            return False
+
+    async def put(self, item):
+        """Enqueue, waiting for room when the queue is full"""
+        await self._queue.put((time.perf_counter(), item))
+
+    async def _consume(self):
+        while True:
+            # Block for the first item, then take whatever else is already waiting
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            now = time.perf_counter()
+            for enqueued_at, _ in batch:
+                self._wait.observe(now - enqueued_at)
+            self._batches.inc()
+            self._items.inc(len(batch))
+            try:
+                await self.handler([item for _, item in batch])
+            except Exception as e:
+                logging.error("Error processing %s batch of %d: %s", self.name, len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
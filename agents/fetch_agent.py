@@ -1,103 +1,167 @@
+import asyncio
 from uagents import Agent, Context, Protocol, Model
 from uagents.setup import fund_agent_if_low
+from uagents_core.types import DeliveryStatus
 import os
-import json
 import logging
+from agents.agent_runtime import AgentRuntime
+from agents.case_store import CaseStore
+from agents.emergency_queue import WorkQueue
+from agents.turn_journal import TurnJournal
+from agents.metrics import timed
+from agents.tracing import tracer, traced
 
 class EmergencyData(Model):
     category: str
     cases: list
+    call_sid: str = ""
+    turn: int = 0
+
+# Cases are filed by CallSid so a multi-turn call stays a single case, and callers
+# reporting the same incident share one;
+# loaded by open() during startup, not on import
+case_store = CaseStore(os.getenv('CASE_STORE_PATH', 'data.json'), load=False)
+
+# Durable record of caller turns from the webhook until they are dispatched
+turn_journal = TurnJournal(os.getenv('TURN_JOURNAL_PATH', 'turns.db'))
 
 class EmergencyProtocol(Protocol):
     def __init__(self):
         super().__init__("emergency_protocol")
         
+    @traced("process_emergency")
     async def process_emergency(self, emergency_data: EmergencyData):
-        """Process emergency data and communicate with dispatcher"""
+        """Process emergency data and communicate with dispatcher; returns whether it was handed over"""
         try:
             # Process the emergency data
-            logging.info(f"Processing emergency: {emergency_data}")
+            logging.info("Processing %s emergency for call %s turn %d", emergency_data.category, emergency_data.call_sid, emergency_data.turn)
             
-            # Create a context for the dispatcher protocol
-            ctx = Context()
-            ctx.logger = logging.getLogger("dispatcher")
-            
-            # Send to dispatcher agent using the dispatcher protocol
-            await dispatcher_protocol.handle_emergency(ctx, emergency_data)
+            # Send to the dispatcher agent; in memory when it is hosted in this process
+            status = await runtime.send(
+                runtime.agent("emergency_processor"),
+                runtime.agent("emergency_dispatcher").address,
+                emergency_data
+            )
+            if status.status == DeliveryStatus.FAILED:
+                logging.error("Dispatch of call %s failed: %s", emergency_data.call_sid, status.detail)
+                return False
+            return True
             
         except Exception as e:
-            logging.error(f"Error processing emergency: {e}")
+            logging.error("Error processing emergency: %s", e)
+            return False
 
 class DispatcherProtocol(Protocol):
     def __init__(self):
         super().__init__("dispatcher_protocol")
     
+    @timed("handle_emergency")
+    @traced("handle_emergency")
     async def handle_emergency(self, ctx: Context, emergency_data: EmergencyData):
         """Handle emergency data from the processing agent"""
         try:
-            # Update the dispatcher dashboard
-            with open('data.json', 'r+') as f:
-                data = json.load(f)
-                # Update relevant categories
-                if emergency_data.category in data:
-                    data[emergency_data.category].extend(emergency_data.cases)
-                
-                # Write back to file
-                f.seek(0)
-                json.dump(data, f)
-                f.truncate()
+            # Update the dispatcher dashboard, one evolving case per call
+            for case in emergency_data.cases:
+                case_id = emergency_data.call_sid or case.get('case_number')
+                case_store.file(case_id, emergency_data.category, case, turn=emergency_data.turn or None)
             
             ctx.logger.info("Emergency data updated in dispatcher dashboard")
             
         except Exception as e:
-            ctx.logger.error(f"Error handling emergency: {e}")
+            ctx.logger.error("Error handling emergency: %s", e)
+            # The sender keeps the turn journaled for replay only if it learns of the failure
+            raise
 
-# Create the emergency processing agent
-emergency_agent = Agent(
-    name="emergency_processor",
-    seed="emergency_processor_seed",  # Replace with a secure seed
-    port=8001  # Using port 8001 for the emergency agent
-)
+emergency_protocol = EmergencyProtocol()
+dispatcher_protocol = DispatcherProtocol()
+
+def create_agents(loop):
+    """Build both agents; constructing an Agent queries the network, so this runs when the runtime starts"""
+    # Create the emergency processing agent
+    emergency_agent = Agent(
+        name="emergency_processor",
+        seed="emergency_processor_seed",  # Replace with a secure seed
+        port=8001,  # Using port 8001 for the emergency agent
+        loop=loop
+    )
+
+    # Create the dispatcher agent
+    dispatcher_agent = Agent(
+        name="emergency_dispatcher",
+        seed="emergency_dispatcher_seed",  # Replace with a secure seed
+        port=8002,  # Using port 8002 for the dispatcher agent
+        loop=loop
+    )
 
-# Create the dispatcher agent
-dispatcher_agent = Agent(
-    name="emergency_dispatcher",
-    seed="emergency_dispatcher_seed",  # Replace with a secure seed
-    port=8002  # Using port 8002 for the dispatcher agent
+    # Register protocols
+    emergency_agent.include(emergency_protocol)
+    dispatcher_agent.include(dispatcher_protocol)
+
+    emergency_agent.on_event("startup")(start_consumers)
+    emergency_agent.on_event("startup")(fund_agents)
+    emergency_agent.on_event("shutdown")(stop_consumers)
+    dispatcher_agent.on_message(model=EmergencyData)(handle_emergency_message)
+
+    # Store agent addresses
+    os.environ["EMERGENCY_AGENT_ADDRESS"] = emergency_agent.address
+    os.environ["DISPATCHER_AGENT_ADDRESS"] = dispatcher_agent.address
+    return [emergency_agent, dispatcher_agent]
+
+# Both agents share one event loop (the web server's when imported by it);
+# remote agents reach them through one envelope endpoint on AGENT_PORT (0 disables it)
+runtime = AgentRuntime(factory=create_agents)
+agent_port = int(os.getenv('AGENT_PORT', '8001'))
+
+async def process_batch(batch):
+    """Dispatch a batch of analysed turns, each under its own turn's trace"""
+    for emergency_data in batch:
+        if not emergency_data.call_sid:
+            await emergency_protocol.process_emergency(emergency_data)
+            continue
+        with tracer.resume(emergency_data.call_sid, emergency_data.turn):
+            delivered = await emergency_protocol.process_emergency(emergency_data)
+        # Undelivered turns stay in the journal and are replayed on the next start
+        if delivered:
+            turn_journal.complete(emergency_data.call_sid, emergency_data.turn)
+
+# Analysed turns waiting for the emergency agent; the webhook layer enqueues,
+# the agent's consumers drain it in batches
+emergency_queue = WorkQueue(
+    "emergency",
+    process_batch,
+    maxsize=int(os.getenv('EMERGENCY_QUEUE_SIZE', '1000')),
+    concurrency=int(os.getenv('EMERGENCY_CONCURRENCY', '4')),
+    batch_size=int(os.getenv('EMERGENCY_BATCH_SIZE', '32')),
 )
 
-# Register protocols
-emergency_protocol = EmergencyProtocol()
-dispatcher_protocol = DispatcherProtocol()
+async def start_consumers(ctx: Context):
+    """Start draining the emergency queue on the agent's loop"""
+    emergency_queue.start()
 
-emergency_agent.include(emergency_protocol)
-dispatcher_agent.include(dispatcher_protocol)
+async def fund_agents(ctx: Context):
+    """Top up the agents' wallets in the background; it is a network round trip the agents can start without"""
+    if os.getenv('FUND_AGENTS', '1') == '0':
+        return
 
-# Fund agents if needed
-fund_agent_if_low(emergency_agent.wallet.address())
-fund_agent_if_low(dispatcher_agent.wallet.address())
+    async def fund():
+        for agent in runtime.agents:
+            try:
+                await asyncio.to_thread(fund_agent_if_low, agent.wallet.address())
+            except Exception as e:
+                logging.warning("Could not fund agent %s: %s", agent.name, e)
 
-# Store agent addresses
-os.environ["EMERGENCY_AGENT_ADDRESS"] = emergency_agent.address
-os.environ["DISPATCHER_AGENT_ADDRESS"] = dispatcher_agent.address
+    runtime.background(fund())
 
-@emergency_agent.on_interval(period=5.0)
-async def check_new_emergencies(ctx: Context):
-    """Periodically check for new emergency data"""
-    try:
-        # Check for new emergency data (this would come from Twilio/Minimax)
-        # For now, we'll just log
-        ctx.logger.info("Checking for new emergencies...")
-        
-    except Exception as e:
-        ctx.logger.error(f"Error checking emergencies: {e}")
+async def stop_consumers(ctx: Context):
+    await emergency_queue.stop()
 
-@dispatcher_agent.on_message(model=EmergencyData)
 async def handle_emergency_message(ctx: Context, sender: str, msg: EmergencyData):
     """Handle incoming emergency messages"""
-    await dispatcher_protocol.handle_emergency(ctx, msg)
+    # Messages from another process carry the call and turn, not the trace itself
+    with tracer.resume(msg.call_sid, msg.turn):
+        await dispatcher_protocol.handle_emergency(ctx, msg)
 
 if __name__ == "__main__":
-    # Run both agents
-    emergency_agent.run()
-    dispatcher_agent.run() 
\ No newline at end of file
+    # Run both agents on one loop
+    case_store.open()
+    asyncio.run(runtime.serve(agent_port)) 
\ No newline at end of file
@@ -1,15 +1,24 @@
-from groq import Groq
+from groq import AsyncGroq
 import os
 import logging
 from dotenv import load_dotenv
 import json
+from agents.metrics import timed
+from agents.tracing import traced
+from agents.scheduler import PriorityScheduler
 
 # Load environment variables
 load_dotenv()
 
+# Groq requests of every call beyond LLM_CONCURRENCY wait their turn, most urgent calls first
+scheduler = PriorityScheduler('llm', int(os.getenv('LLM_CONCURRENCY', '32')))
+
 class EmergencyProcessor:
     def __init__(self):
-        self.client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+        self._client = None
+        self.model = os.getenv('GROQ_MODEL', "meta-llama/llama-4-scout-17b-16e-instruct")
+        # Smaller, faster model used while the server sheds load
+        self.small_model = os.getenv('GROQ_SMALL_MODEL', "llama-3.1-8b-instant")
         self.system_prompt = """You are an experienced 911 emergency call operator AI assistant. Your role is to handle emergency calls with professionalism, empathy, and efficiency while gathering all critical information through a natural conversation flow.
 
 CONVERSATION PRINCIPLES:
@@ -138,37 +147,47 @@ FORMAT YOUR RESPONSE AS:
     }
 }"""
 
-    async def process_emergency_call(self, transcript, conversation_history=None):
-        """Process emergency call transcript through Groq"""
+    @property
+    def client(self):
+        """Groq client, created on first use so a missing key fails the first call rather than startup"""
+        if self._client is None:
+            self._client = AsyncGroq(api_key=os.getenv('GROQ_API_KEY'))
+        return self._client
+
+    @timed("process_emergency_call")
+    @traced("process_emergency_call")
+    async def process_emergency_call(self, transcript, conversation_history=None, small_model=False):
+        """Process emergency call transcript through Groq, on the small model if `small_model`"""
         try:
-            logging.info(f"Processing emergency call through Groq: {transcript}")
+            logging.debug("Processing emergency call through Groq: %s", transcript)
             
             # Include conversation history if available
             user_content = f"Current response: {transcript}"
             if conversation_history:
                 user_content = f"Conversation history:\n{conversation_history}\n\nCurrent response: {transcript}"
             
-            completion = self.client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_content}
-                ],
-                temperature=0.2,
-                max_completion_tokens=1024,
-                top_p=1,
-                stream=False
-            )
+            async with scheduler.slot():
+                completion = await self.client.chat.completions.create(
+                    model=self.small_model if small_model else self.model,
+                    messages=[
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": user_content}
+                    ],
+                    temperature=0.2,
+                    max_completion_tokens=1024,
+                    top_p=1,
+                    stream=False
+                )
             
             result = completion.choices[0].message.content
             
             # Ensure the result is valid JSON
             try:
                 json_result = json.loads(result)
-                logging.info(f"Groq Analysis: {json_result}")
+                logging.debug("Groq Analysis: %s", json_result)
                 return json_result
             except json.JSONDecodeError:
-                logging.error(f"Invalid JSON response from Groq: {result}")
+                logging.error("Invalid JSON response from Groq: %.500s", result)
                 # Return a basic structure if JSON parsing fails
                 return {
                     "analysis": {
@@ -197,5 +216,5 @@ FORMAT YOUR RESPONSE AS:
                 }
             
         except Exception as e:
-            logging.error(f"Error processing emergency call through Groq: {e}")
+            logging.error("Error processing emergency call through Groq: %s", e)
             raise 
\ No newline at end of file
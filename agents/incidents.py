@@ -0,0 +1,277 @@
+"""
+Correlation of cases that report the same incident.
+
+In a large event dozens of callers report the same fire. The case store asks
+this index for an open incident matching each new report, and files the
+report under it instead of opening another case. A report matches an incident
+of the same category that was reported within the time window when it was
+made at the same place:
+
+  - both carry coordinates and lie within the radius of each other, or
+  - their addresses share enough words (house number, street name; unit
+    numbers must not differ), or
+  - their addresses overlap partly and their transcripts are similar.
+
+A report without any location never matches; it is correlated again once a
+later turn of the call says where it is.
+
+Candidates come from a spatial grid and from MinHash LSH buckets over the
+address words, so a lookup touches a handful of incidents rather than every
+open one. Every match needs either proximity or an address overlap, so
+transcripts only score the candidates and are never looked up.
+
+Environment:
+    INCIDENT_WINDOW_MINUTES  how long an incident attracts new reports after its latest one
+    INCIDENT_RADIUS_METERS   distance within which geocoded reports are at the same place
+    INCIDENT_LOCATION_MATCH  address word overlap at which two reports are at the same place
+    INCIDENT_TEXT_MATCH      transcript similarity that lets a partial address overlap match
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import random
+import re
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Signatures are computed in pure Python instead, with the same values
+    np = None
+
+from agents.metrics import registry, timed
+
+# MinHash signature length and its split into LSH bands of ROWS values;
+# two sets with Jaccard similarity s share a bucket with probability 1 - (1 - s**ROWS)**BANDS
+PERMUTATIONS = 32
+ROWS = 2
+BANDS = PERMUTATIONS // ROWS
+
+# Multiply-shift hash functions over 64-bit shingle hashes: ((a * x + b) mod 2**64) >> 32, a odd
+_MASK = (1 << 64) - 1
+_random = random.Random(911)
+_HASH_PARAMS = [(_random.getrandbits(64) | 1, _random.getrandbits(64)) for _ in range(PERMUTATIONS)]
+if np is not None:
+    _A = np.array([a for a, _ in _HASH_PARAMS], dtype=np.uint64)[:, None]
+    _B = np.array([b for _, b in _HASH_PARAMS], dtype=np.uint64)[:, None]
+
+EARTH_RADIUS_METERS = 6_371_000
+METERS_PER_DEGREE = 111_320
+
+WORD = re.compile(r"[a-z0-9]+")
+UNIT = re.compile(r"\b(?:apartment|apt|unit|suite|ste|room|rm|flat|floor|fl|#)\s*#?\s*([a-z0-9-]+)")
+# Street suffixes and filler say nothing about which place is meant
+LOCATION_STOPWORDS = {
+    'the', 'a', 'an', 'at', 'of', 'on', 'in', 'near', 'by', 'and', 'to', 'corner', 'block', 'it', 'is', 'its',
+    'street', 'st', 'avenue', 'ave', 'road', 'rd', 'boulevard', 'blvd', 'drive', 'dr', 'lane', 'ln',
+    'way', 'place', 'pl', 'court', 'ct', 'highway', 'hwy', 'north', 'south', 'east', 'west', 'n', 's', 'e', 'w',
+}
+TEXT_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'is', 'are', 'was', 'were', 'it', 'its', 'i', 'im', 'my', 'me', 'we', 'our',
+    'there', 'theres', 'here', 'this', 'that', 'of', 'in', 'on', 'at', 'to', 'from', 'for', 'with', 'please',
+    'help', 'just', 'so', 'like', 'um', 'uh', 'yes', 'no', 's', 't',
+}
+
+
+def _words(text, stopwords):
+    return [word for word in WORD.findall(str(text or '').lower()) if word not in stopwords]
+
+
+def location_tokens(location):
+    """The words of an address that identify the place, and its unit if one is given"""
+    text = str(location or '').lower()
+    unit = UNIT.search(text)
+    words = _words(UNIT.sub(' ', text), LOCATION_STOPWORDS)
+    return frozenset(words + [f"{a} {b}" for a, b in zip(words, words[1:])]), unit.group(1) if unit else None
+
+
+def text_shingles(text):
+    """Words and word pairs of a transcript"""
+    words = _words(text, TEXT_STOPWORDS)
+    return set(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+
+
+def minhash(shingles):
+    """MinHash signature of a set of shingles; None for an empty set"""
+    if not shingles:
+        return None
+    hashes = [_hash(shingle) for shingle in shingles]
+    if np is not None:
+        # uint64 arithmetic wraps modulo 2**64, as the pure-Python mask does
+        values = (_A * np.array(hashes, dtype=np.uint64) + _B) >> np.uint64(32)
+        return tuple(values.min(axis=1).tolist())
+    return tuple(min(((a * h + b) & _MASK) >> 32 for h in hashes) for a, b in _HASH_PARAMS)
+
+
+def similarity(a, b):
+    """Jaccard similarity estimated from two MinHash signatures"""
+    if a is None or b is None:
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / PERMUTATIONS
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def distance_meters(a, b):
+    """Great-circle distance between two (latitude, longitude) points"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+
+
+def coordinates(fields):
+    """(latitude, longitude) of a case if it carries valid ones"""
+    try:
+        point = float(fields['latitude']), float(fields['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+        return None
+    return point
+
+
+class Report:
+    """The features of a case that incidents are matched on"""
+    __slots__ = ('category', 'place', 'unit', 'place_signature', 'point', 'text', 'updated')
+
+    def __init__(self, category, fields, updated):
+        self.category = category
+        self.place, self.unit = location_tokens(fields.get('location'))
+        self.place_signature = minhash(self.place)
+        self.point = coordinates(fields)
+        self.text = minhash(text_shingles(f"{fields.get('situation', '')} {fields.get('transcript', '')}"))
+        self.updated = updated
+
+    @property
+    def located(self):
+        return bool(self.place) or self.point is not None
+
+
+class IncidentIndex:
+    def __init__(self):
+        self.window = float(os.getenv('INCIDENT_WINDOW_MINUTES', '60')) * 60
+        self.radius = float(os.getenv('INCIDENT_RADIUS_METERS', '250'))
+        self.location_match = float(os.getenv('INCIDENT_LOCATION_MATCH', '0.6'))
+        self.text_match = float(os.getenv('INCIDENT_TEXT_MATCH', '0.4'))
+        # Grid cells are one radius high, so a match lies in the 3 rows around a report
+        self.cell_degrees = self.radius / METERS_PER_DEGREE
+
+        self._incidents = {}  # incident id -> Report
+        self._buckets = {}  # (category, 'place', band, values) or (category, 'cell', row, column) -> incident ids
+        self._keys = {}  # incident id -> the bucket keys it is filed under
+        self._expiry = []  # heap of (updated, incident id), stale entries skipped
+
+        registry.gauge('open_incidents', fn=lambda: len(self._incidents))
+
+    def __len__(self):
+        return len(self._incidents)
+
+    def __contains__(self, incident_id):
+        return incident_id in self._incidents
+
+    def _cell(self, point):
+        row = math.floor(point[0] / self.cell_degrees)
+        width = self.cell_degrees / max(math.cos(math.radians((row + 0.5) * self.cell_degrees)), 0.01)
+        return row, math.floor(point[1] / width), width
+
+    def _bucket_keys(self, report):
+        keys = []
+        signature = report.place_signature
+        if signature is not None:
+            for band in range(BANDS):
+                keys.append((report.category, 'place', band, signature[band * ROWS:(band + 1) * ROWS]))
+        if report.point is not None:
+            row, column, _ = self._cell(report.point)
+            keys.append((report.category, 'cell', row, column))
+        return keys
+
+    def _nearby_cells(self, category, point):
+        for row in (-1, 0, 1):
+            shifted = (point[0] + row * self.cell_degrees, point[1])
+            cell_row, _, width = self._cell(shifted)
+            for column in range(math.floor((point[1] - width) / width), math.floor((point[1] + width) / width) + 1):
+                yield (category, 'cell', cell_row, column)
+
+    def add(self, incident_id, category, fields, now=None):
+        """File or refresh an open incident"""
+        now = now if now is not None else time.time()
+        self.remove(incident_id)
+        report = Report(category, fields, now)
+        if not report.located:
+            return
+        self._incidents[incident_id] = report
+        self._keys[incident_id] = keys = self._bucket_keys(report)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(incident_id)
+        heapq.heappush(self._expiry, (now, incident_id))
+        self.expire(now)
+
+    def remove(self, incident_id):
+        """Stop matching reports to an incident, e.g. once it is closed"""
+        if self._incidents.pop(incident_id, None) is None:
+            return
+        for key in self._keys.pop(incident_id):
+            bucket = self._buckets[key]
+            bucket.discard(incident_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def expire(self, now=None):
+        """Drop incidents without a report within the window"""
+        cutoff = (now if now is not None else time.time()) - self.window
+        while self._expiry and self._expiry[0][0] < cutoff:
+            updated, incident_id = heapq.heappop(self._expiry)
+            report = self._incidents.get(incident_id)
+            if report is not None and report.updated == updated:
+                self.remove(incident_id)
+
+    def _candidates(self, report):
+        candidates = set()
+        for key in self._bucket_keys(report):
+            if key[1] != 'cell':
+                candidates.update(self._buckets.get(key, ()))
+        if report.point is not None:
+            for key in self._nearby_cells(report.category, report.point):
+                candidates.update(self._buckets.get(key, ()))
+        return candidates
+
+    def _score(self, report, incident, now):
+        """How strongly a report matches an incident, or None if it does not"""
+        if incident.category != report.category or now - incident.updated > self.window:
+            return None
+        if report.unit and incident.unit and report.unit != incident.unit:
+            return None
+        text = similarity(report.text, incident.text)
+        if report.point is not None and incident.point is not None:
+            meters = distance_meters(report.point, incident.point)
+            if meters <= self.radius:
+                return 2.0 - meters / self.radius + text
+        place = jaccard(report.place, incident.place)
+        if place >= self.location_match or (place >= self.location_match / 2 and text >= self.text_match):
+            return place + text
+        return None
+
+    @timed("match_incident")
+    def match(self, category, fields, exclude=None, now=None):
+        """Id of the open incident a report belongs to, or None"""
+        now = now if now is not None else time.time()
+        report = Report(category, fields, now)
+        if not report.located:
+            return None
+        best, best_score = None, None
+        for incident_id in self._candidates(report):
+            if incident_id == exclude:
+                continue
+            score = self._score(report, self._incidents[incident_id], now)
+            if score is not None and (best_score is None or score > best_score):
+                best, best_score = incident_id, score
+        return best
@@ -0,0 +1,103 @@
+"""
+Logging setup for the voice server.
+
+Request handlers only put records on an in-memory queue; a QueueListener
+thread formats and writes them, so log I/O never blocks a Twilio response.
+Records are formatted lazily on the listener thread, caller phone numbers are
+redacted from every line, and full request payload dumps are sampled.
+
+Environment:
+    LOG_LEVEL                 minimum level (default INFO)
+    LOG_FORMAT                "text" (default) or "json"
+    LOG_FILE                  also write to this file
+    LOG_PAYLOAD_SAMPLE_RATE   fraction of requests whose payload is dumped at DEBUG (default 0.01)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+
+# Phone numbers as Twilio sends them (+15551234567) and common spoken/written forms
+PHONE_PATTERN = re.compile(r'\+\d{7,15}\b|\(?\b\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}\b')
+
+# Form fields that identify the caller; masked wholesale in payload dumps
+PII_FIELDS = {'From', 'To', 'Caller', 'Called', 'CallerName', 'FromCity', 'FromZip', 'CallerZip', 'CallerCity'}
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+
+
+def redact(text):
+    """Mask phone numbers, keeping the last two digits for correlation"""
+    return PHONE_PATTERN.sub(lambda m: '***' + m.group(0)[-2:], text)
+
+
+def redact_fields(form):
+    """Copy of a request form or dict with caller-identifying fields masked"""
+    return {key: ('***' if key in PII_FIELDS and value else value) for key, value in form.items()}
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry))
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves message formatting to the listener thread"""
+
+    def prepare(self, record):
+        # The stock handler formats here, on the request thread; the queue never
+        # leaves this process, so the record can travel as-is
+        return record
+
+
+def setup_logging():
+    """Route the root logger through a queue to a background writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if os.getenv('LOG_FORMAT') == 'json' else RedactingFormatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if os.getenv('LOG_FILE'):
+        handlers.append(logging.FileHandler(os.getenv('LOG_FILE')))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def log_payload(message, payload):
+    """Log a redacted request payload at DEBUG for a sample of requests"""
+    if logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < _sample_rate:
+        logging.debug(message, redact_fields(payload))
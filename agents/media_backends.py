@@ -0,0 +1,148 @@
+"""
+Streaming STT and TTS backends for media stream calls.
+
+GroqWhisperSTT cuts the caller's audio into utterances with an energy VAD and
+transcribes each one through Groq's Whisper endpoint as soon as the caller
+stops talking. MinimaxStreamingTTS synthesizes raw 8 kHz PCM through Minimax
+a sentence at a time and hands it back as Twilio frames.
+
+Environment:
+    GROQ_STT_MODEL  Whisper model used for stream calls
+"""
+
+import asyncio
+import io
+import logging
+import os
+import wave
+from collections import deque
+
+from groq import AsyncGroq
+
+from agents.media_stream import (
+    EnergyVAD, SAMPLE_RATE, STTSession, StreamingSTT, StreamingTTS, frames, pcm16_to_ulaw, ulaw_to_pcm16,
+)
+from agents.metrics import timed
+from agents.speech_cache import SpeechCache, split_sentences
+from agents.transcript_agent_minimax.minimax_tts import MinimaxTTS
+
+# Audio kept from before the VAD fires, so the first syllable is not clipped
+PRE_ROLL_FRAMES = 10
+
+
+def ulaw_to_wav(audio):
+    """Mono 8 kHz WAV file holding mu-law `audio`"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(ulaw_to_pcm16(audio))
+    return buffer.getvalue()
+
+
+class GroqWhisperSession(STTSession):
+    def __init__(self, stt, call_sid, on_transcript):
+        self.stt = stt
+        self.call_sid = call_sid
+        self.on_transcript = on_transcript
+        self.vad = EnergyVAD()
+        self._pre_roll = deque(maxlen=PRE_ROLL_FRAMES)
+        self._utterance = []
+        self._requests = set()
+
+    async def send(self, frame):
+        change = self.vad.update(frame)
+        if change == 'start':
+            self._utterance = list(self._pre_roll)
+        if self.vad.active or change == 'end':
+            self._utterance.append(frame)
+        else:
+            self._pre_roll.append(frame)
+        if change == 'end':
+            audio, self._utterance = b''.join(self._utterance), []
+            # Transcribe off the frame loop so the caller's audio keeps flowing meanwhile
+            task = asyncio.create_task(self._transcribe(audio))
+            self._requests.add(task)
+            task.add_done_callback(self._requests.discard)
+
+    async def _transcribe(self, audio):
+        text = await self.stt.transcribe(audio)
+        if text:
+            await self.on_transcript(text, True)
+
+    async def close(self):
+        for task in list(self._requests):
+            task.cancel()
+
+
+class GroqWhisperSTT(StreamingSTT):
+    """One Whisper request per utterance; the caller's pause ends the utterance"""
+
+    def __init__(self):
+        self.model = os.getenv('GROQ_STT_MODEL', 'whisper-large-v3-turbo')
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncGroq(api_key=os.getenv('GROQ_API_KEY'))
+        return self._client
+
+    async def open(self, call_sid, parameters, on_transcript):
+        return GroqWhisperSession(self, call_sid, on_transcript)
+
+    @timed("transcribe_utterance")
+    async def transcribe(self, audio):
+        try:
+            transcription = await self.client.audio.transcriptions.create(
+                file=('utterance.wav', ulaw_to_wav(audio)),
+                model=self.model,
+                language='en',
+            )
+            return transcription.text.strip()
+        except Exception as e:
+            logging.error("Error transcribing utterance with Groq: %s", e)
+            return ''
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class MinimaxStreamingTTS(StreamingTTS):
+    """Sentences synthesized in parallel and streamed in order, from a cache of mu-law audio"""
+
+    def __init__(self, voice_id="female_01", speed=1.0):
+        self.voice_id = voice_id
+        self.speed = speed
+        self.tts = MinimaxTTS()
+        self.speech = SpeechCache(self._render, name='ulaw')
+
+    async def _render(self, text, voice_id, speed):
+        pcm = await self.tts.synthesize_pcm(text, voice_id, speed, sample_rate=SAMPLE_RATE)
+        return pcm16_to_ulaw(pcm) if pcm else None
+
+    async def synthesize(self, text, cached_only=False):
+        sentences = split_sentences(text)
+        if cached_only:
+            sentences = [sentence for sentence in sentences if self.speech.ready(sentence, self.voice_id, self.speed)]
+        for sentence in sentences:
+            self.speech.prefetch(sentence, self.voice_id, self.speed)
+        # The first sentence plays while the rest are still rendering
+        for sentence in sentences:
+            audio = await self.speech.get(sentence, self.voice_id, self.speed)
+            if audio is None:
+                logging.warning("Skipping a sentence Minimax could not synthesize")
+                continue
+            for frame in frames(audio):
+                yield frame
+
+    def pin(self, text):
+        for sentence in split_sentences(text):
+            self.speech.pin(sentence, self.voice_id, self.speed)
+
+    async def aclose(self):
+        await self.speech.aclose()
+        await self.tts.aclose()
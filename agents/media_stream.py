@@ -0,0 +1,329 @@
+"""
+Real-time media streaming mode for the voice server.
+
+Instead of a Gather -> /voice/transcribe -> TwiML round trip per turn, Twilio
+opens a WebSocket (a Media Stream) for the whole call. The caller's audio
+arrives as 20 ms frames of 8 kHz mu-law, is fed to a streaming STT backend,
+and every final transcript is answered with synthesized frames sent back down
+the same socket. When the caller starts talking over the reply, the queued
+audio is cleared and synthesis stops (barge-in).
+
+STT and TTS backends are pluggable: a backend is any class implementing
+StreamingSTT or StreamingTTS, named as 'module:Class' in STREAM_STT or
+STREAM_TTS.
+
+Environment:
+    STREAM_STT  streaming STT backend (default agents.media_backends:GroqWhisperSTT)
+    STREAM_TTS  streaming TTS backend (default agents.media_backends:MinimaxStreamingTTS)
+"""
+
+import asyncio
+import base64
+import importlib
+import json
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+
+try:
+    import audioop
+except ImportError:  # Removed in Python 3.13; the pure-Python codec below takes over
+    audioop = None
+
+from agents.metrics import registry
+from agents.scheduler import enter_call
+
+SAMPLE_RATE = 8000
+# Twilio sends and expects 20 ms frames of 8-bit mu-law
+FRAME_BYTES = 160
+FRAME_SECONDS = FRAME_BYTES / SAMPLE_RATE
+SILENCE = b'\xff' * FRAME_BYTES
+
+
+def _ulaw_to_linear(byte):
+    byte = ~byte & 0xFF
+    magnitude = ((((byte & 0x0F) << 3) + 0x84) << ((byte & 0x70) >> 4)) - 0x84
+    return -magnitude if byte & 0x80 else magnitude
+
+
+ULAW_TO_LINEAR = [_ulaw_to_linear(byte) for byte in range(256)]
+ULAW_SQUARED = [sample * sample for sample in ULAW_TO_LINEAR]
+
+
+def ulaw_decode(frame):
+    """mu-law bytes to a list of 16-bit samples"""
+    return [ULAW_TO_LINEAR[byte] for byte in frame]
+
+
+def ulaw_encode(samples):
+    """16-bit samples to mu-law bytes"""
+    encoded = bytearray(len(samples))
+    for index, sample in enumerate(samples):
+        sign = 0x80 if sample < 0 else 0
+        magnitude = min(abs(sample), 32635) + 0x84
+        exponent = max(0, magnitude.bit_length() - 8)
+        mantissa = (magnitude >> (exponent + 3)) & 0x0F
+        encoded[index] = ~(sign | (exponent << 4) | mantissa) & 0xFF
+    return bytes(encoded)
+
+
+def ulaw_to_pcm16(audio):
+    """mu-law bytes to little-endian 16-bit PCM"""
+    if audioop is not None:
+        return audioop.ulaw2lin(audio, 2)
+    return b''.join(sample.to_bytes(2, 'little', signed=True) for sample in ulaw_decode(audio))
+
+
+def pcm16_to_ulaw(pcm):
+    """Little-endian 16-bit PCM to mu-law bytes"""
+    pcm = pcm[:len(pcm) // 2 * 2]
+    if audioop is not None:
+        return audioop.lin2ulaw(pcm, 2)
+    return ulaw_encode([int.from_bytes(pcm[i:i + 2], 'little', signed=True) for i in range(0, len(pcm), 2)])
+
+
+def frames(audio, size=FRAME_BYTES):
+    """Split mu-law audio into Twilio frames, padding the last one with silence"""
+    for start in range(0, len(audio), size):
+        yield audio[start:start + size].ljust(size, b'\xff')
+
+
+def rms(frame):
+    """Root mean square amplitude of a mu-law frame"""
+    if not frame:
+        return 0.0
+    if audioop is not None:
+        return audioop.rms(audioop.ulaw2lin(frame, 2), 2)
+    return math.sqrt(sum(map(ULAW_SQUARED.__getitem__, frame)) / len(frame))
+
+
+class EnergyVAD:
+    """Voice activity from frame energy: speech starts after a few loud frames and ends after a stretch of quiet"""
+
+    def __init__(self, threshold=500.0, start_frames=3, end_frames=25):
+        self.threshold = threshold
+        self.start_frames = start_frames
+        self.end_frames = end_frames
+        self.active = False
+        self._run = 0
+
+    def update(self, frame):
+        """Feed one frame; returns 'start', 'end' or None"""
+        loud = rms(frame) >= self.threshold
+        # Count consecutive frames that disagree with the current state
+        self._run = self._run + 1 if loud != self.active else 0
+        if not self.active and self._run >= self.start_frames:
+            self.active, self._run = True, 0
+            return 'start'
+        if self.active and self._run >= self.end_frames:
+            self.active, self._run = False, 0
+            return 'end'
+        return None
+
+
+class StreamingSTT(ABC):
+    """Speech-to-text over a live call; open() returns a session fed one frame at a time"""
+
+    @abstractmethod
+    async def open(self, call_sid, parameters, on_transcript):
+        """Start transcribing a call; `on_transcript(text, final)` is awaited for each result"""
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class STTSession(ABC):
+    @abstractmethod
+    async def send(self, frame):
+        """Feed one mu-law frame of caller audio"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StreamingTTS(ABC):
+    """Text-to-speech producing mu-law frames as they become available"""
+
+    @abstractmethod
+    async def synthesize(self, text, cached_only=False):
+        """Async iterator of 8 kHz mu-law frames speaking `text`
+
+        cached_only: synthesis is shed under load; speak only sentences whose
+        audio is already synthesized, or on its way, and skip the rest
+        """
+        raise NotImplementedError
+        yield
+
+    def pin(self, text):
+        """Keep the audio of a fixed prompt for good once it is synthesized"""
+
+    async def aclose(self):
+        pass
+
+
+def load_backend(spec):
+    """Instantiate a backend named as 'module:Class'"""
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)()
+
+
+class StreamBackends:
+    """The configured STT and TTS backends, loaded on first use"""
+
+    def __init__(self):
+        self.stt_spec = os.getenv('STREAM_STT', 'agents.media_backends:GroqWhisperSTT')
+        self.tts_spec = os.getenv('STREAM_TTS', 'agents.media_backends:MinimaxStreamingTTS')
+        self._stt = None
+        self._tts = None
+
+    @property
+    def stt(self):
+        if self._stt is None:
+            self._stt = load_backend(self.stt_spec)
+        return self._stt
+
+    @property
+    def tts(self):
+        if self._tts is None:
+            self._tts = load_backend(self.tts_spec)
+        return self._tts
+
+    async def aclose(self):
+        for backend in (self._stt, self._tts):
+            if backend is not None:
+                await backend.aclose()
+        self._stt = self._tts = None
+
+
+class MediaStreamSession:
+    """One Twilio Media Stream: caller audio in, synthesized replies out, with barge-in"""
+
+    def __init__(self, websocket, stt, tts, on_utterance, greeting, vad=None, static_prompts=None, fallback=None):
+        """`on_utterance(call_sid, text)` returns (reply text, whether the conversation continues)
+
+        `static_prompts()` tells whether speech synthesis is shed; replies are
+        then spoken from cached audio only, and `fallback` in place of a reply
+        none of which is cached.
+        """
+        self.websocket = websocket
+        self.stt = stt
+        self.tts = tts
+        self.on_utterance = on_utterance
+        self.greeting = greeting
+        self.vad = vad or EnergyVAD()
+        self.static_prompts = static_prompts
+        self.fallback = fallback
+        self.call_sid = None
+        self.stream_sid = None
+        self.speaking = False
+        self._stt_session = None
+        self._speech = None
+        self._turns = set()
+        self._marks = 0
+        self._last_mark = None
+        self._hang_up = False
+        self._send_lock = asyncio.Lock()
+        self._heard_at = None
+
+        self._barge_ins = registry.counter('stream_barge_ins_total')
+        self._latency = registry.histogram('stream_turn_latency_seconds')
+
+    async def run(self):
+        """Serve the stream until Twilio stops it or the conversation ends"""
+        try:
+            while not self._hang_up or self.speaking:
+                message = json.loads(await self.websocket.receive_text())
+                event = message.get('event')
+                if event == 'start':
+                    await self._start(message['start'])
+                elif event == 'media':
+                    await self._media(message['media'])
+                elif event == 'mark':
+                    self._mark(message['mark'].get('name'))
+                elif event == 'stop':
+                    break
+        finally:
+            for task in [self._speech, *self._turns]:
+                if task is not None:
+                    task.cancel()
+            if self._stt_session is not None:
+                await self._stt_session.close()
+
+    async def _start(self, start):
+        self.call_sid = start.get('callSid', '')
+        self.stream_sid = start.get('streamSid', '')
+        logging.info("Media stream %s started for call %s", self.stream_sid, self.call_sid)
+        # Speech for the call, from here and the tasks started below, is synthesized at its priority
+        enter_call(self.call_sid)
+        self._stt_session = await self.stt.open(self.call_sid, start.get('customParameters', {}), self._transcript)
+        self.say(self.greeting)
+
+    async def _media(self, media):
+        if media.get('track', 'inbound') != 'inbound':
+            return
+        frame = base64.b64decode(media['payload'])
+        change = self.vad.update(frame)
+        if change == 'start' and self.speaking:
+            await self.barge_in()
+        elif change == 'end':
+            self._heard_at = time.perf_counter()
+        await self._stt_session.send(frame)
+
+    def _mark(self, name):
+        # Twilio echoes a mark once the audio before it has played
+        if name == self._last_mark and (self._speech is None or self._speech.done()):
+            self.speaking = False
+
+    async def _transcript(self, text, final):
+        if final and text.strip():
+            task = asyncio.create_task(self._respond(text.strip()))
+            self._turns.add(task)
+            task.add_done_callback(self._turns.discard)
+
+    async def _respond(self, text):
+        heard_at = self._heard_at or time.perf_counter()
+        reply, more = await self.on_utterance(self.call_sid, text)
+        self.say(reply, heard_at)
+        if not more:
+            self._hang_up = True
+
+    def say(self, text, heard_at=None):
+        """Speak `text`, replacing anything still being synthesized"""
+        if self._speech is not None:
+            self._speech.cancel()
+        self.speaking = True
+        self._speech = asyncio.create_task(self._play(text, heard_at))
+
+    async def _play(self, text, heard_at):
+        first = True
+        cached_only = self.static_prompts is not None and self.static_prompts()
+        lines = (text, self.fallback) if cached_only and self.fallback else (text,)
+        for line in lines:
+            async for frame in self.tts.synthesize(line, cached_only=cached_only):
+                if first and heard_at is not None:
+                    self._latency.observe(time.perf_counter() - heard_at)
+                first = False
+                await self._send({'event': 'media', 'streamSid': self.stream_sid,
+                                  'media': {'payload': base64.b64encode(frame).decode()}})
+            if not first:
+                break
+        self._marks += 1
+        self._last_mark = f"reply-{self._marks}"
+        await self._send({'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': self._last_mark}})
+
+    async def barge_in(self):
+        """The caller talks over the reply: drop the audio Twilio has queued and stop synthesizing"""
+        self._barge_ins.inc()
+        if self._speech is not None:
+            self._speech.cancel()
+            self._speech = None
+        self.speaking = False
+        await self._send({'event': 'clear', 'streamSid': self.stream_sid})
+
+    async def _send(self, message):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message))
@@ -0,0 +1,313 @@
+"""
+In-process metrics registry.
+
+Counters, gauges and latency histograms keep lifetime totals plus rollups at
+1 second, 1 minute and 1 hour resolution. Rollups are fixed-size ring buffers,
+so memory use does not grow with uptime.
+"""
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Rollup resolution -> (seconds per slot, number of slots kept)
+ROLLUPS = {
+    '1s': (1, 120),
+    '1m': (60, 120),
+    '1h': (3600, 48),
+}
+
+
+class Rollup:
+    """Ring buffer of per-slot aggregates at one resolution"""
+
+    def __init__(self, step, slots, buckets=0):
+        self.step = step
+        self.slots = slots
+        self.buckets = buckets
+        self._starts = [None] * slots
+        self._values = [None] * slots  # [count, sum, max, bucket counts...]
+
+    def _slot(self, now):
+        index = int(now // self.step)
+        start = index * self.step
+        i = index % self.slots
+        if self._starts[i] != start:
+            self._starts[i] = start
+            self._values[i] = [0, 0.0, 0.0] + [0] * self.buckets
+        return self._values[i]
+
+    def add(self, value, bucket=None, now=None):
+        slot = self._slot(now or time.time())
+        slot[0] += 1
+        slot[1] += value
+        slot[2] = max(slot[2], value)
+        if bucket is not None:
+            slot[3 + bucket] += 1
+
+    def series(self, now=None):
+        """Return (slot start, values) pairs still inside the window, oldest first"""
+        oldest = (int((now or time.time()) // self.step) - self.slots + 1) * self.step
+        return sorted(
+            (start, values) for start, values in zip(self._starts, self._values)
+            if start is not None and start >= oldest
+        )
+
+
+def _percentile(bucket_counts, q):
+    """Estimate a quantile from histogram bucket counts"""
+    total = sum(bucket_counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(bucket_counts):
+        if seen + count >= rank and count:
+            lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1] * 2
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+class Metric:
+    kind = None
+    buckets = 0
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._rollups = {res: Rollup(step, slots, self.buckets) for res, (step, slots) in ROLLUPS.items()}
+
+    def _record(self, value, bucket=None):
+        now = time.time()
+        for rollup in self._rollups.values():
+            rollup.add(value, bucket, now)
+
+    def series(self, resolution='1m'):
+        with self._lock:
+            return self._rollups[resolution].series()
+
+    def _recent(self, seconds):
+        """Per-second slots covering roughly the last `seconds`"""
+        cutoff = time.time() - seconds
+        return [values for start, values in self.series('1s') if start >= cutoff]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, labels):
+        super().__init__(name, labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+            self._record(amount)
+
+    def recent(self, seconds=60):
+        """Amount added over roughly the last `seconds`"""
+        return sum(values[1] for values in self._recent(seconds))
+
+    def to_dict(self, resolution):
+        return {
+            'value': self.value,
+            'series': [{'t': start, 'value': values[1]} for start, values in self.series(resolution)],
+        }
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, labels, fn=None):
+        super().__init__(name, labels)
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+            self._record(value)
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+    def sample(self):
+        """Record the current value of a callback gauge into its rollups"""
+        if self.fn is not None:
+            self.set(self.fn())
+
+    def to_dict(self, resolution):
+        return {
+            'value': self.value,
+            'series': [
+                {'t': start, 'value': values[1] / values[0], 'max': values[2]}
+                for start, values in self.series(resolution)
+            ],
+        }
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    buckets = len(LATENCY_BUCKETS) + 1
+
+    def __init__(self, name, labels):
+        super().__init__(name, labels)
+        self.count = 0
+        self.sum = 0.0
+        self.bucket_counts = [0] * self.buckets
+
+    def observe(self, seconds):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            self.bucket_counts[bucket] += 1
+            self._record(seconds, bucket)
+
+    def recent_count(self, seconds=60):
+        """Observations over roughly the last `seconds`"""
+        return sum(values[0] for values in self._recent(seconds))
+
+    def recent_percentile(self, q, seconds=60):
+        """Estimate a quantile over roughly the last `seconds` of observations"""
+        merged = [0] * self.buckets
+        for values in self._recent(seconds):
+            merged = [a + b for a, b in zip(merged, values[3:])]
+        return _percentile(merged, q)
+
+    def to_dict(self, resolution):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': _percentile(self.bucket_counts, 0.50),
+            'p95': _percentile(self.bucket_counts, 0.95),
+            'p99': _percentile(self.bucket_counts, 0.99),
+            'series': [
+                {
+                    't': start,
+                    'count': values[0],
+                    'mean': values[1] / values[0],
+                    'max': values[2],
+                    'p95': _percentile(values[3:], 0.95),
+                }
+                for start, values in self.series(resolution)
+            ],
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def _get(self, cls, name, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = cls(name, labels, **kwargs)
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def gauge(self, name, fn=None, **labels):
+        return self._get(Gauge, name, labels, fn=fn)
+
+    def timed(self, stage):
+        """Decorator recording call count, errors and latency of a sync or async function"""
+        calls = self.counter('stage_calls_total', stage=stage)
+        errors = self.counter('stage_errors_total', stage=stage)
+        latency = self.histogram('stage_duration_seconds', stage=stage)
+
+        def decorator(f):
+            if inspect.iscoroutinefunction(f):
+                @functools.wraps(f)
+                async def async_wrapper(*args, **kwargs):
+                    calls.inc()
+                    start = time.perf_counter()
+                    try:
+                        return await f(*args, **kwargs)
+                    except Exception:
+                        errors.inc()
+                        raise
+                    finally:
+                        latency.observe(time.perf_counter() - start)
+                return async_wrapper
+
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                calls.inc()
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    latency.observe(time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def start_sampler(self, interval=1.0):
+        """Sample callback gauges into their rollups on a background thread"""
+        if self._sampler is not None:
+            return
+
+        def run():
+            while True:
+                for metric in list(self._metrics.values()):
+                    if isinstance(metric, Gauge):
+                        metric.sample()
+                time.sleep(interval)
+
+        self._sampler = threading.Thread(target=run, name="metrics-sampler", daemon=True)
+        self._sampler.start()
+
+    def to_dict(self, resolution='1m'):
+        """Return totals and rollups for every metric, grouped by metric name"""
+        result = {}
+        for metric in list(self._metrics.values()):
+            entry = {'kind': metric.kind, 'labels': metric.labels}
+            entry.update(metric.to_dict(resolution))
+            result.setdefault(metric.name, []).append(entry)
+        return result
+
+    def to_prometheus(self):
+        """Render lifetime totals in the Prometheus text exposition format"""
+        lines = []
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            labels = ','.join(f'{k}="{v}"' for k, v in sorted(metric.labels.items()))
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), metric.bucket_counts):
+                    cumulative += count
+                    bucket_labels = ','.join(filter(None, [labels, f'le="{bound}"']))
+                    lines.append(f"{metric.name}_bucket{{{bucket_labels}}} {cumulative}")
+                label_set = f"{{{labels}}}" if labels else ""
+                lines.append(f"{metric.name}_sum{label_set} {metric.sum}")
+                lines.append(f"{metric.name}_count{label_set} {metric.count}")
+            else:
+                label_set = f"{{{labels}}}" if labels else ""
+                lines.append(f"{metric.name}{label_set} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the server and the agents
+registry = MetricsRegistry()
+timed = registry.timed
@@ -0,0 +1,75 @@
+"""
+Client for the voice server's bulk upload endpoint.
+
+Reports are sent to /webhook/bulk as gzip-compressed newline-delimited JSON,
+one case per line and BATCH_SIZE cases per request, so a long backfill goes
+out in bounded pieces instead of one JSON document. Shared by the transcript
+agents.
+"""
+
+import gzip
+import json
+import os
+import time
+
+import requests
+
+# The voice server on this machine unless pointed elsewhere
+BULK_URL = os.getenv('BULK_WEBHOOK_URL', "http://localhost:8000/webhook/bulk")
+BATCH_SIZE = 500
+# Attempts per batch while the server answers 503 because it is busy with live calls
+ATTEMPTS = 5
+
+COUNTS = ('records', 'added', 'duplicate', 'archived', 'rejected')
+
+
+def report_records(report):
+    """Case records of a {category: [case, ...]} report, given parsed or as the model's JSON text"""
+    if isinstance(report, (str, bytes)):
+        report = json.loads(report)
+    for category, cases in report.items():
+        for case in cases or ():
+            yield dict(case, category=category)
+
+
+def batches(records, size=BATCH_SIZE):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _post(session, url, body):
+    for attempt in range(ATTEMPTS):
+        response = session.post(url, data=body, timeout=30, headers={
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': 'gzip',
+        })
+        if response.status_code != 503 or attempt == ATTEMPTS - 1:
+            break
+        time.sleep(float(response.headers.get('Retry-After', '1')))
+    response.raise_for_status()
+    return response.json()
+
+
+def send_records(records, url=BULK_URL, batch_size=BATCH_SIZE):
+    """Upload case records; returns the server's counts summed over the batches and its rejected records
+
+    A rejected record is given by its position in `records`, counting from 1.
+    """
+    totals = dict.fromkeys(COUNTS, 0)
+    errors = []
+    sent = 0
+    with requests.Session() as session:
+        for batch in batches(records, batch_size):
+            body = gzip.compress(b''.join(json.dumps(record).encode() + b'\n' for record in batch))
+            result = _post(session, url, body)
+            for key in COUNTS:
+                totals[key] += result.get(key, 0)
+            errors.extend({'record': sent + error['line'], 'error': error['error']} for error in result.get('errors', ()))
+            sent += len(batch)
+    return dict(totals, errors=errors)
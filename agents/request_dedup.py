@@ -0,0 +1,124 @@
+"""
+Deduplication of repeated Twilio transcription webhooks.
+
+Twilio retries a webhook it got no timely answer to, and a caller's utterance
+can be delivered twice. Every delivery of /voice/transcribe would otherwise
+append a turn, run the LLM and TTS and write the case again, so a slow backend
+that causes retries gets slower still. The first delivery of an utterance does
+the work; a repeat waits for its reply while it is being answered, and gets
+the same TwiML from a short-lived cache once it is.
+
+Within a call, a delivery repeats an earlier one when either
+
+  - both carry the same I-Twilio-Idempotency-Token, which Twilio keeps across
+    retries of a request, or
+  - both have the same transcript and the same Timestamp; deliveries without
+    a Timestamp match on the transcript while the first one is being answered
+    or for DEDUP_WINDOW_SECONDS after it was. The caller has to hear the reply
+    before saying anything new, so a caller answering "yes" to two questions
+    in a row is still heard twice.
+
+Environment:
+    DEDUP_WINDOW_SECONDS  how long after an utterance is answered the same words count as a repeat of it
+    DEDUP_CACHE_SECONDS   how long replies are kept for retries
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import deque
+
+from agents.metrics import registry
+
+IDEMPOTENCY_HEADER = 'I-Twilio-Idempotency-Token'
+
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def transcript_digest(transcript):
+    """Hash of a transcript's words, ignoring case, punctuation and spacing"""
+    words = ' '.join(WORD.findall(str(transcript or '').lower()))
+    return hashlib.sha256(words.encode()).hexdigest()[:32]
+
+
+class Utterance:
+    """One caller utterance and the reply to it, shared by every delivery of it"""
+    __slots__ = ('keys', 'arrived', 'timed', 'answered_at', '_reply')
+
+    def __init__(self, keys, arrived, timed):
+        self.keys = keys
+        self.arrived = arrived
+        self.timed = timed  # identified by its Timestamp rather than by a time window
+        self.answered_at = None
+        self._reply = asyncio.get_running_loop().create_future()
+
+    @property
+    def answered(self):
+        return self._reply.done()
+
+    def resolve(self, reply):
+        if not self._reply.done():
+            self._reply.set_result(reply)
+            self.answered_at = time.monotonic()
+
+    def fail(self, error):
+        if not self._reply.done():
+            self._reply.set_exception(error)
+            self.answered_at = time.monotonic()
+            # Retrieved here, so a failure no repeat waited on is not logged as unhandled
+            self._reply.exception()
+
+    async def wait(self):
+        """The reply to the first delivery; a repeat hanging up does not cancel it"""
+        return await asyncio.shield(self._reply)
+
+
+class RequestDeduplicator:
+    def __init__(self, window=None, ttl=None):
+        self.window = window if window is not None else float(os.getenv('DEDUP_WINDOW_SECONDS', '2'))
+        self.ttl = max(self.window, ttl if ttl is not None else float(os.getenv('DEDUP_CACHE_SECONDS', '60')))
+        self._utterances = {}  # identity key -> Utterance
+        self._arrivals = deque()  # utterances, oldest first, for expiry
+        self._repeats = {kind: registry.counter('duplicate_requests_total', kind=kind) for kind in ('in_flight', 'cached')}
+        registry.gauge('dedup_utterances', fn=lambda: len(self._arrivals))
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def _expire(self, now):
+        while self._arrivals and now - self._arrivals[0].arrived > self.ttl:
+            utterance = self._arrivals.popleft()
+            for key in utterance.keys:
+                if self._utterances.get(key) is utterance:
+                    del self._utterances[key]
+
+    def _matches(self, utterance, key, now):
+        if key[1] == 'token' or utterance.timed:
+            return True
+        return not utterance.answered or now - utterance.answered_at <= self.window
+
+    def claim(self, call_sid, transcript, token=None, timestamp=None):
+        """The utterance a delivery belongs to, and whether an earlier delivery already claimed it"""
+        now = time.monotonic()
+        self._expire(now)
+        keys = [(call_sid, 'transcript', transcript_digest(transcript), timestamp or None)]
+        if token:
+            keys.append((call_sid, 'token', token))
+        for key in reversed(keys):
+            utterance = self._utterances.get(key)
+            if utterance is not None and self._matches(utterance, key, now):
+                self._repeats['cached' if utterance.answered else 'in_flight'].inc()
+                # A retry with a new token still finds the utterance by it next time
+                for other in keys:
+                    if other not in utterance.keys:
+                        utterance.keys.append(other)
+                        self._utterances[other] = utterance
+                return utterance, True
+
+        utterance = Utterance(keys, now, bool(timestamp))
+        for key in keys:
+            self._utterances[key] = utterance
+        self._arrivals.append(utterance)
+        return utterance, False
@@ -0,0 +1,174 @@
+"""
+Priority scheduling of LLM and TTS requests across calls.
+
+Groq and Minimax serve every call on the server, and when their rate limits
+bind a cardiac arrest should not queue behind a noise complaint. Each backend
+has a scheduler that lets at most its capacity of requests run at once and
+hands a free slot to the most urgent waiting request: the one whose call's
+latest analysis gave the lowest priority number (1 life-threatening, 5
+routine). A waiting request ranks one priority level higher for every
+PRIORITY_AGING_SECONDS it has waited, so routine calls are delayed under load
+but never starved. A share of the slots is only ever given to priority 1
+calls, so they start at once even while lower priorities fill the rest.
+
+A request runs at the priority of the call it is made for: the call whose
+context it runs in, entered by the request handlers and inherited by the
+tasks they start. Calls not analysed yet, and work outside any call, run at
+DEFAULT_PRIORITY.
+
+Environment:
+    LLM_CONCURRENCY          Groq requests in flight at once
+    TTS_CONCURRENCY          Minimax requests in flight at once
+    PRIORITY_RESERVED_SLOTS  fraction of each backend's slots held for priority 1 calls
+    PRIORITY_AGING_SECONDS   wait after which a request ranks one priority level higher
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from agents.metrics import registry
+
+TOP_PRIORITY = 1
+LOWEST_PRIORITY = 5
+# A call still on its first turn may be anything; it ranks just below known life threats
+DEFAULT_PRIORITY = 2
+
+_current_call = contextvars.ContextVar('scheduled_call', default=None)
+
+# CallSid -> priority of the call's latest analysis
+_priorities = {}
+
+
+def parse_priority(value):
+    """An analysis priority clamped to 1-5, or None if it is not a number"""
+    try:
+        return min(max(int(value), TOP_PRIORITY), LOWEST_PRIORITY)
+    except (TypeError, ValueError):
+        return None
+
+
+def set_priority(call_sid, priority):
+    """Record the priority of a call's latest analysis"""
+    priority = parse_priority(priority)
+    if call_sid and priority is not None:
+        _priorities[call_sid] = priority
+
+
+def forget_priority(call_sid):
+    _priorities.pop(call_sid, None)
+
+
+def enter_call(call_sid):
+    """Schedule the rest of the current task, and the tasks it starts, for a call"""
+    _current_call.set(call_sid)
+
+
+@contextmanager
+def for_call(call_sid):
+    """Schedule the requests made inside the block for a call"""
+    token = _current_call.set(call_sid)
+    try:
+        yield
+    finally:
+        _current_call.reset(token)
+
+
+def current_priority():
+    """Priority of the call the current task works for"""
+    return _priorities.get(_current_call.get(), DEFAULT_PRIORITY)
+
+
+class PriorityScheduler:
+    def __init__(self, name, capacity, reserved=None, aging=None):
+        self.name = name
+        self.capacity = max(1, capacity)
+        if reserved is None:
+            reserved = int(self.capacity * float(os.getenv('PRIORITY_RESERVED_SLOTS', '0.25')))
+        # At least one slot stays open to every priority
+        self.reserved = max(0, min(reserved, self.capacity - 1))
+        self.aging = aging if aging is not None else float(os.getenv('PRIORITY_AGING_SECONDS', '10'))
+        self.active = 0
+
+        # Heaps of (rank, sequence, future). Every waiting request ages at the same
+        # rate, so ranking by priority - waited / aging is the same as ranking by
+        # the fixed priority * aging + enqueue time
+        self._urgent = []  # top-priority requests, which may take reserved slots
+        self._waiting = []  # every other request
+        self._sequence = itertools.count()
+
+        registry.gauge('scheduler_active', fn=lambda: self.active, backend=name)
+        registry.gauge('scheduler_waiting', fn=lambda: self.waiting, backend=name)
+        self._waits = {
+            priority: registry.histogram('scheduler_wait_seconds', backend=name, priority=str(priority))
+            for priority in range(TOP_PRIORITY, LOWEST_PRIORITY + 1)
+        }
+
+    @property
+    def waiting(self):
+        return sum(not future.done() for heap in (self._urgent, self._waiting) for _, _, future in heap)
+
+    def _limit(self, priority):
+        return self.capacity if priority <= TOP_PRIORITY else self.capacity - self.reserved
+
+    @staticmethod
+    def _prune(heap):
+        # Requests cancelled while waiting are dropped once they reach the top
+        while heap and heap[0][2].done():
+            heapq.heappop(heap)
+
+    def _dispatch(self):
+        while True:
+            self._prune(self._urgent)
+            self._prune(self._waiting)
+            heaps = []
+            if self._urgent and self.active < self._limit(TOP_PRIORITY):
+                heaps.append(self._urgent)
+            if self._waiting and self.active < self._limit(LOWEST_PRIORITY):
+                heaps.append(self._waiting)
+            if not heaps:
+                return
+            _, _, future = heapq.heappop(min(heaps, key=lambda heap: heap[0][:2]))
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self, priority=None):
+        """Wait for a slot; at the current call's priority unless one is given"""
+        priority = parse_priority(priority) or current_priority()
+        heap = self._urgent if priority <= TOP_PRIORITY else self._waiting
+        started = time.monotonic()
+        self._prune(heap)
+        if not heap and self.active < self._limit(priority):
+            self.active += 1
+            self._waits[priority].observe(0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(heap, (priority * self.aging + started, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Handed a slot just as the request was cancelled; pass it on
+                self.release()
+            raise
+        self._waits[priority].observe(time.monotonic() - started)
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority=None):
+        """Hold one of the backend's slots for the duration of the block"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'reserved': self.reserved, 'active': self.active, 'waiting': self.waiting}
@@ -0,0 +1,278 @@
+"""
+Full-text search over cases.
+
+The location, situation and transcript of every case are kept in an inverted
+index: term -> case -> positions of the term. The case store updates it as it
+applies each change, so webhook reports and live call turns are searchable as
+soon as they are stored.
+
+Query syntax, all parts of a query must match:
+
+    oak                a word
+    oak*               any word starting with "oak"
+    "red pickup"       words next to each other, in order, within one field
+
+Matches are ranked by BM25, weighted by recency: the score of a case halves
+with every SEARCH_HALF_LIFE_DAYS since it was last updated. A query with a
+selective part scores only the cases containing it. A query made of common
+words instead walks cases from the newest hour back, and stops once no older
+case could outrank the results found so far, so it never scores the months of
+history that would rank below them anyway.
+
+Cases the case store has archived stay searchable until they are
+SEARCH_RETENTION_DAYS old, which bounds the index however much history the
+archive holds.
+
+Environment:
+    SEARCH_HALF_LIFE_DAYS  age at which a case ranks half as high as a new one
+    SEARCH_RETENTION_DAYS  age after which archived cases drop out of the index
+"""
+
+import bisect
+import heapq
+import math
+import os
+import re
+import time
+
+from agents.metrics import timed
+
+FIELDS = ('location', 'situation', 'transcript')
+# Positions of each field start this far apart, so a phrase never spans two fields
+FIELD_SPAN = 1 << 20
+
+# BM25 term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+# Terms a prefix expands to, most frequent first, bounding the cost of a short prefix
+MAX_PREFIX_TERMS = 64
+# Queries whose most selective part matches at most this many cases score them all directly
+DIRECT_SCORING_LIMIT = 2000
+# Prefixes matching at most this many postings are scored up front rather than term by term per case
+PREFIX_MERGE_LIMIT = 20000
+# Cases are bucketed by the hour they were last updated, for the newest-first walk
+BUCKET_SECONDS = 3600
+
+WORD = re.compile(r"[a-z0-9]+")
+CLAUSE = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+def tokenize(text):
+    return WORD.findall(str(text or '').lower())
+
+
+def _positions(entry):
+    # Most terms occur once per case, so a single position is stored as a bare int
+    return (entry,) if isinstance(entry, int) else entry
+
+
+class Clause:
+    """One part of a query: the cases it can match, their count, and a bound on its score"""
+    __slots__ = ('candidates', 'size', 'bound', 'score')
+
+    def __init__(self, candidates, size, bound, score):
+        self.candidates = candidates  # callable returning the ids of cases that may match
+        self.size = size
+        self.bound = bound  # no case scores higher on this clause
+        self.score = score  # case id -> score, or None if the case does not match
+
+
+class SearchIndex:
+    def __init__(self):
+        self.half_life = float(os.getenv('SEARCH_HALF_LIFE_DAYS', '7')) * 86400
+        self.retention = float(os.getenv('SEARCH_RETENTION_DAYS', '90')) * 86400
+        self._postings = {}  # term -> case id -> position or tuple of positions
+        self._terms = []  # every indexed term, sorted, for prefix lookups
+        self._docs = {}  # case id -> (indexed text, length, updated, category)
+        self._total_length = 0
+        self._average_length = 1
+        self._buckets = {}  # hour -> ids of the cases last updated in it
+        self._hours = []  # sorted hours that have a bucket
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, case_id):
+        return case_id in self._docs
+
+    def _bucket(self, case_id, updated, add):
+        hour = int(updated // BUCKET_SECONDS)
+        if add:
+            bucket = self._buckets.get(hour)
+            if bucket is None:
+                bucket = self._buckets[hour] = set()
+                bisect.insort(self._hours, hour)
+            bucket.add(case_id)
+            return
+        bucket = self._buckets[hour]
+        bucket.discard(case_id)
+        if not bucket:
+            del self._buckets[hour]
+            del self._hours[bisect.bisect_left(self._hours, hour)]
+
+    def add(self, case_id, category, case, updated=None):
+        """Index a case, replacing what was indexed for it before"""
+        updated = updated if updated is not None else time.time()
+        text = tuple(str(case.get(field) or '') for field in FIELDS)
+        doc = self._docs.get(case_id)
+        if doc is not None and doc[0] == text:
+            # Most updates touch other fields; only the recency and category change
+            self._bucket(case_id, doc[2], add=False)
+            self._bucket(case_id, updated, add=True)
+            self._docs[case_id] = (text, doc[1], updated, category)
+            return
+        self.remove(case_id)
+
+        terms = {}
+        length = 0
+        for field, value in enumerate(text):
+            words = tokenize(value)
+            length += len(words)
+            for position, word in enumerate(words, field * FIELD_SPAN):
+                terms.setdefault(word, []).append(position)
+        for term, positions in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[case_id] = positions[0] if len(positions) == 1 else tuple(positions)
+        self._docs[case_id] = (text, length, updated, category)
+        self._total_length += length
+        self._bucket(case_id, updated, add=True)
+
+    def remove(self, case_id):
+        doc = self._docs.pop(case_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc[1]
+        self._bucket(case_id, doc[2], add=False)
+        for term in set(word for value in doc[0] for word in tokenize(value)):
+            postings = self._postings[term]
+            del postings[case_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def expire(self, keep, now=None):
+        """Drop cases not updated within the retention period, except those `keep(case_id)` holds on to"""
+        cutoff = int(((now if now is not None else time.time()) - self.retention) // BUCKET_SECONDS)
+        for hour in self._hours[:bisect.bisect_left(self._hours, cutoff)]:
+            for case_id in list(self._buckets[hour]):
+                if not keep(case_id):
+                    self.remove(case_id)
+
+    def _idf(self, postings):
+        return math.log(1 + (len(self._docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+
+    def _bm25(self, idf, frequency, case_id):
+        norm = 1 - B + B * self._docs[case_id][1] / self._average_length
+        return idf * frequency * (K1 + 1) / (frequency + K1 * norm)
+
+    def _word(self, term):
+        postings = self._postings.get(term)
+        if not postings:
+            return None
+        idf = self._idf(postings)
+
+        def score(case_id):
+            entry = postings.get(case_id)
+            return None if entry is None else self._bm25(idf, len(_positions(entry)), case_id)
+        return Clause(lambda: postings, len(postings), idf * (K1 + 1), score)
+
+    def _prefix(self, prefix):
+        """Any term starting with a prefix; a case scores as its best matching term"""
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + '\uffff', start)
+        terms = heapq.nlargest(MAX_PREFIX_TERMS, self._terms[start:end], key=lambda term: len(self._postings[term]))
+        if not terms:
+            return None
+        words = [self._word(term) for term in terms]
+        size, bound = sum(word.size for word in words), max(word.bound for word in words)
+        if size <= PREFIX_MERGE_LIMIT:
+            scores = {}
+            for term, word in zip(terms, words):
+                for case_id in self._postings[term]:
+                    scores[case_id] = max(scores.get(case_id, 0.0), word.score(case_id))
+            return Clause(lambda: scores, len(scores), bound, scores.get)
+
+        def candidates():
+            return set().union(*(self._postings[term] for term in terms))
+
+        def score(case_id):
+            return max((score for score in (word.score(case_id) for word in words) if score is not None), default=None)
+        return Clause(candidates, size, bound, score)
+
+    def _phrase(self, words):
+        """Words one after the other, scored as the sum of the words where they form the phrase"""
+        if len(words) == 1:
+            return self._word(words[0])
+        postings = [self._postings.get(word) for word in words]
+        if not all(postings):
+            return None
+        idfs = [self._idf(other) for other in postings]
+        rarest = min(postings, key=len)
+
+        def score(case_id):
+            if not all(case_id in other for other in postings):
+                return None
+            starts = set(_positions(postings[0][case_id]))
+            for offset, other in enumerate(postings[1:], 1):
+                starts &= {position - offset for position in _positions(other[case_id])}
+                if not starts:
+                    return None
+            return sum(self._bm25(idf, len(starts), case_id) for idf in idfs)
+        return Clause(lambda: rarest, len(rarest), sum(idfs) * (K1 + 1), score)
+
+    def _clause(self, phrase, word):
+        if phrase:
+            return self._phrase(tokenize(phrase))
+        if word.endswith('*'):
+            return self._prefix(''.join(tokenize(word)))
+        # "I-95" or "o'brien" are a phrase of their parts
+        return self._phrase(tokenize(word))
+
+    @timed("search_cases")
+    def search(self, query, limit=20, category=None, now=None):
+        """(case id, score) of the best matches of a query, best first"""
+        now = now if now is not None else time.time()
+        parts = [(phrase, word) for phrase, word in CLAUSE.findall(query) if tokenize(phrase or word)]
+        if not parts or not self._docs or limit <= 0:
+            return []
+        self._average_length = self._total_length / len(self._docs) or 1
+        clauses = [self._clause(phrase, word) for phrase, word in parts]
+        if not all(clauses):
+            return []
+        # Every clause must match; the most selective one is checked first
+        clauses.sort(key=lambda clause: clause.size)
+        bound = sum(clause.bound for clause in clauses)
+
+        best = []  # min-heap of the best (score, case id) found so far
+
+        def consider(case_id):
+            _, _, updated, indexed_category = self._docs[case_id]
+            if category is not None and indexed_category != category:
+                return
+            total = 0.0
+            for clause in clauses:
+                score = clause.score(case_id)
+                if score is None:
+                    return
+                total += score
+            entry = (total * 0.5 ** (max(0.0, now - updated) / self.half_life), case_id)
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+        if clauses[0].size <= DIRECT_SCORING_LIMIT:
+            for case_id in clauses[0].candidates():
+                consider(case_id)
+        else:
+            for hour in reversed(self._hours):
+                # No case in this hour or an older one is more recent than its end
+                newest = 0.5 ** (max(0.0, now - (hour + 1) * BUCKET_SECONDS) / self.half_life)
+                if len(best) == limit and bound * newest <= best[0][0]:
+                    break
+                for case_id in self._buckets[hour]:
+                    consider(case_id)
+        return [(case_id, score) for score, case_id in sorted(best, reverse=True)]
@@ -0,0 +1,135 @@
+"""
+Consistent-hash sharding of live calls across server nodes.
+
+Every call is owned by exactly one node, found by hashing its CallSid onto a
+ring of virtual nodes, so a conversation's history, journal and traces stay in
+one place and a membership change moves only about 1/N of the calls. A node
+that receives a Twilio callback for a call it does not own replays the request
+on the owner. When membership changes, each node hands the sessions it no
+longer owns to their new owners.
+
+Environment:
+    NODE_URL        this node's base URL, as the other nodes reach it
+    CLUSTER_NODES   comma-separated base URLs of every node (unset: single node)
+    CLUSTER_TOKEN   shared secret between the nodes, checked on handoffs,
+                    membership changes and forwarded callbacks; required, without
+                    it the node runs alone and refuses every cluster request
+"""
+
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+
+import httpx
+
+# Set on requests replayed on their owner, so they are never forwarded twice
+FORWARDED_HEADER = 'X-Shard-Forwarded'
+TOKEN_HEADER = 'X-Cluster-Token'
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def node_id(node_url):
+    """Short id of a node, given in URLs that are routed back to it"""
+    return hashlib.blake2b(node_url.encode(), digest_size=4).hexdigest()
+
+
+def _normalise(nodes):
+    return sorted({node.strip().rstrip('/') for node in nodes if node and node.strip()})
+
+
+class HashRing:
+    def __init__(self, nodes=(), vnodes=128):
+        self.nodes = _normalise(nodes)
+        points = sorted((_hash(f"{node}#{index}"), node) for node in self.nodes for index in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key):
+        """Node owning `key`: the first virtual node clockwise from its hash"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class Cluster:
+    def __init__(self, node_url=None, nodes=None, token=None, vnodes=128):
+        self.node_url = (node_url if node_url is not None else os.getenv('NODE_URL', '')).rstrip('/')
+        if nodes is None:
+            nodes = os.getenv('CLUSTER_NODES', '').split(',')
+        self.token = token if token is not None else os.getenv('CLUSTER_TOKEN', '')
+        self.vnodes = vnodes
+        self.ring = HashRing(nodes, vnodes)
+        self._client = None
+        if self.node_url and self.ring.nodes and not self.token:
+            logging.error("CLUSTER_TOKEN is not set; running as a single node")
+
+    @property
+    def enabled(self):
+        """Whether any call can be owned by a node other than this one"""
+        return bool(self.token) and bool(self.node_url) and bool(self.ring.nodes) and self.ring.nodes != [self.node_url]
+
+    @property
+    def members(self):
+        return list(self.ring.nodes)
+
+    def owner(self, call_sid):
+        if not self.enabled or not call_sid:
+            return self.node_url
+        return self.ring.owner(call_sid)
+
+    def owns(self, call_sid):
+        return self.owner(call_sid) == self.node_url
+
+    def member(self, member_id):
+        """URL of the member with a node id, or None"""
+        return next((node for node in self.ring.nodes if node_id(node) == member_id), None)
+
+    def set_members(self, nodes):
+        self.ring = HashRing(nodes, self.vnodes)
+        logging.info("Cluster membership is now %s", ", ".join(self.ring.nodes))
+
+    def authorized(self, headers):
+        """Whether a request carries the cluster token; never without one configured"""
+        return bool(self.token) and hmac.compare_digest(headers.get(TOKEN_HEADER, ''), self.token)
+
+    def _http(self):
+        if self._client is None:
+            headers = {TOKEN_HEADER: self.token} if self.token else {}
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(10.0), headers=headers)
+        return self._client
+
+    async def forward(self, owner, path, body, headers):
+        """Replay a request on the node that owns it"""
+        return await self._http().post(f"{owner}{path}", content=body,
+                                       headers=dict(headers, **{FORWARDED_HEADER: self.node_url}))
+
+    async def fetch(self, node, path):
+        """GET a resource another node holds"""
+        return await self._http().get(f"{node}{path}", headers={FORWARDED_HEADER: self.node_url})
+
+    async def handoff(self, owner, session):
+        """Give a call's session to its new owner"""
+        response = await self._http().post(f"{owner}/cluster/handoff", json=session)
+        response.raise_for_status()
+
+    async def announce(self, nodes):
+        """Tell the other members about a membership change"""
+        for node in _normalise(nodes):
+            if node == self.node_url:
+                continue
+            try:
+                response = await self._http().post(f"{node}/cluster/members", json={'nodes': _normalise(nodes)})
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                logging.warning("Could not announce membership to %s: %s", node, e)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
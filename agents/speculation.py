@@ -0,0 +1,103 @@
+"""
+Speculative analysis of caller turns from Twilio's partial speech results.
+
+While the caller is still speaking, Twilio posts interim transcripts of the
+turn. Once the stable part of the transcript is long enough, the turn's
+analysis starts on the interim text, overlapping model latency with the rest
+of the utterance. When the final SpeechResult arrives, the speculative
+analysis is used if the final text is close enough to the text it ran on, and
+cancelled otherwise. An interim transcript that drifts too far from the one
+being analysed restarts the speculation, a bounded number of times per turn.
+
+Environment:
+    SPECULATION_ENABLED       1 to request partial results from Twilio; off by default, as every turn then costs extra LLM calls
+    SPECULATION_MIN_WORDS     stable words needed before a speculation starts
+    SPECULATION_MATCH         word-level similarity at which a speculation still counts
+    SPECULATION_MAX_RESTARTS  restarts allowed per turn
+"""
+
+import asyncio
+import difflib
+import logging
+import os
+
+from agents.metrics import registry
+
+
+def similarity(a, b):
+    """Word-level similarity of two transcripts, from 0 to 1"""
+    return difflib.SequenceMatcher(None, a.lower().split(), b.lower().split(), autojunk=False).ratio()
+
+
+class Speculation:
+    def __init__(self, turn, text, task):
+        self.turn = turn
+        self.text = text
+        self.task = task
+        self.sequence = -1
+        self.restarts = 0
+
+
+class Speculator:
+    def __init__(self, analyse):
+        """`analyse(text, call_sid, turn)` is the coroutine function run speculatively; it must have no side effects"""
+        self.analyse = analyse
+        self.enabled = os.getenv('SPECULATION_ENABLED', '0') == '1'
+        self.min_words = int(os.getenv('SPECULATION_MIN_WORDS', '4'))
+        self.match = float(os.getenv('SPECULATION_MATCH', '0.85'))
+        self.max_restarts = int(os.getenv('SPECULATION_MAX_RESTARTS', '2'))
+        # CallSid -> the speculation running for that call's next turn
+        self._running = {}
+
+        self._started = registry.counter('speculation_started_total')
+        self._restarted = registry.counter('speculation_restarted_total')
+        self._hits = registry.counter('speculation_hits_total')
+        self._misses = registry.counter('speculation_misses_total')
+
+    def _start(self, call_sid, turn, text):
+        task = asyncio.create_task(self.analyse(text, call_sid, turn), name=f"speculate-{call_sid}-{turn}")
+        # A dropped speculation's error is never awaited; retrieve it so it is not reported as lost
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
+
+    def feed(self, call_sid, turn, stable_text, text, sequence=0):
+        """Take an interim transcript of `turn`; starts or restarts its speculative analysis as needed"""
+        speculation = self._running.get(call_sid)
+        if speculation is not None and speculation.turn != turn:
+            # The previous turn's final result never claimed it
+            self.discard(call_sid)
+            speculation = None
+        if speculation is not None and sequence <= speculation.sequence:
+            return
+
+        if speculation is None:
+            if len(stable_text.split()) < self.min_words:
+                return
+            speculation = self._running[call_sid] = Speculation(turn, text, self._start(call_sid, turn, text))
+            self._started.inc()
+        elif similarity(text, speculation.text) < self.match and speculation.restarts < self.max_restarts:
+            speculation.task.cancel()
+            speculation.task = self._start(call_sid, turn, text)
+            speculation.text = text
+            speculation.restarts += 1
+            self._restarted.inc()
+        speculation.sequence = sequence
+
+    def claim(self, call_sid, turn, final_text):
+        """The speculative analysis task for `turn` if it ran on text close to `final_text`, else None"""
+        speculation = self._running.pop(call_sid, None)
+        if speculation is None:
+            return None
+        if speculation.turn == turn and similarity(final_text, speculation.text) >= self.match:
+            self._hits.inc()
+            return speculation.task
+        speculation.task.cancel()
+        self._misses.inc()
+        logging.debug("Dropped speculative analysis of call %s turn %d", call_sid, speculation.turn)
+        return None
+
+    def discard(self, call_sid):
+        """Cancel any speculation for a call, e.g. when it ends"""
+        speculation = self._running.pop(call_sid, None)
+        if speculation is not None:
+            speculation.task.cancel()
@@ -0,0 +1,204 @@
+"""
+Sentence-level speech synthesis with a shared cache.
+
+A reply is split into sentences, and every sentence is synthesized as its own
+request, all at once. Playback starts as soon as the first sentence is ready
+while the rest are still rendering, so the time to first audio no longer
+grows with the length of the reply. Rendered sentences are kept in an LRU
+cache shared by all calls; repeated guidance ("Push hard and fast in the
+center of the chest.") is synthesized once. Concurrent requests for the same
+sentence share one synthesis. The audio of fixed prompts is pinned outside
+the LRU, so prompts still play while synthesis is shed under load.
+
+For Gather calls each sentence is played from its own /audio URL. The URL
+names the sentence by an HMAC digest only; the node that issued it looks the
+text up by digest, so replies (addresses, medical details) never appear in
+URLs or access logs, and nobody can use the route to synthesize arbitrary
+text. In a cluster the URL also names the issuing node, and a node receiving
+a URL it did not issue fetches the audio from that node.
+
+Environment:
+    SPEECH_CACHE_MB   memory for cached sentence audio
+    AUDIO_URL_SECRET  key for the /audio URL digests (default TWILIO_AUTH_TOKEN)
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import re
+from collections import OrderedDict
+
+from agents.metrics import registry
+
+AUDIO_PATH = '/audio'
+
+# /audio URLs whose sentence is remembered; the oldest are forgotten first
+MAX_ISSUED_URLS = 20000
+
+# Fragments shorter than this ride along with the next sentence rather than costing a request
+MIN_SENTENCE_CHARS = 20
+# Longer sentences are split again at clause boundaries, bounding the time to first audio
+MAX_SENTENCE_CHARS = 160
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+CLAUSE_END = re.compile(r'(?<=[,;:])\s+')
+
+
+def _join_short(parts):
+    chunks, pending = [], ''
+    for part in parts:
+        pending = f"{pending} {part}".strip()
+        if len(pending) >= MIN_SENTENCE_CHARS:
+            chunks.append(pending)
+            pending = ''
+    if pending:
+        if chunks:
+            chunks[-1] = f"{chunks[-1]} {pending}"
+        else:
+            chunks.append(pending)
+    return chunks
+
+
+def split_sentences(text):
+    """Split a reply into the chunks synthesized separately"""
+    parts = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        if len(sentence) > MAX_SENTENCE_CHARS:
+            parts.extend(_join_short(CLAUSE_END.split(sentence)))
+        elif sentence:
+            parts.append(sentence)
+    return _join_short(parts)
+
+
+class SpeechCache:
+    def __init__(self, render, name='mp3', max_bytes=None, secret=None):
+        """`render(text, voice_id, speed)` is the coroutine returning a sentence's audio, or None on failure"""
+        self.render = render
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv('SPEECH_CACHE_MB', '64')) * 2**20)
+        secret = secret or os.getenv('AUDIO_URL_SECRET') or os.getenv('TWILIO_AUTH_TOKEN') or os.urandom(32).hex()
+        self._secret = secret.encode()
+        # (text, voice_id, speed) -> audio, least recently used first
+        self._audio = OrderedDict()
+        self._bytes = 0
+        # Sentences being synthesized, shared by everyone waiting on them
+        self._rendering = {}
+        # Digest -> (text, voice_id, speed) of the /audio URLs handed out, least recently used first
+        self._issued = OrderedDict()
+        # Id of this node, given in /audio URLs when other nodes may receive them
+        self.origin = ''
+        # Sentences of fixed prompts, never evicted: key -> audio once rendered, and digest -> key
+        self._pinned = {}
+        self._pinned_keys = {}
+
+        self._hits = registry.counter('speech_cache_hits_total', cache=name)
+        self._misses = registry.counter('speech_cache_misses_total', cache=name)
+        registry.gauge('speech_cache_bytes', fn=lambda: self._bytes, cache=name)
+
+    def _digest(self, text, voice_id, speed):
+        message = f"{voice_id}|{float(speed)!r}|{text}".encode()
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def url(self, text, voice_id, speed):
+        """Path of the /audio URL serving one sentence"""
+        key = (text, voice_id, float(speed))
+        digest = self._digest(*key)
+        self._issued[digest] = key
+        self._issued.move_to_end(digest)
+        while len(self._issued) > MAX_ISSUED_URLS:
+            self._issued.popitem(last=False)
+        return f"{AUDIO_PATH}/{digest}" + (f"?node={self.origin}" if self.origin else '')
+
+    def sentence(self, digest):
+        """(text, voice_id, speed) served by an /audio URL issued here, or None"""
+        key = self._issued.get(digest)
+        if key is not None:
+            self._issued.move_to_end(digest)
+            return key
+        return self._pinned_keys.get(digest)
+
+    def pin(self, text, voice_id, speed):
+        """Keep a fixed prompt's sentence for good once it is rendered"""
+        key = (text, voice_id, float(speed))
+        self._pinned_keys[self._digest(*key)] = key
+        audio = self._audio.pop(key, None)
+        if audio is not None:
+            self._bytes -= len(audio)
+            self._pinned[key] = audio
+
+    def ready(self, text, voice_id, speed):
+        """Whether a sentence is cached or being rendered, so get() needs no new synthesis"""
+        key = (text, voice_id, float(speed))
+        return key in self._pinned or key in self._audio or key in self._rendering
+
+    def pinned(self, text, voice_id, speed):
+        """Whether a pinned sentence has been rendered"""
+        return (text, voice_id, float(speed)) in self._pinned
+
+    def prefetch(self, text, voice_id, speed):
+        """Start synthesizing a sentence unless it is cached or already rendering"""
+        key = (text, voice_id, float(speed))
+        if key in self._pinned or key in self._audio or key in self._rendering:
+            self._hits.inc()
+            return
+        self._misses.inc()
+        self._start(key)
+
+    def _start(self, key):
+        task = asyncio.create_task(self.render(*key))
+        self._rendering[key] = task
+        task.add_done_callback(lambda task: self._rendered(key, task))
+
+    def _rendered(self, key, task):
+        self._rendering.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error("Error synthesizing sentence: %s", task.exception())
+            return
+        audio = task.result()
+        if audio:
+            self._store(key, audio)
+
+    def _store(self, key, audio):
+        if self._digest(*key) in self._pinned_keys:
+            self._pinned[key] = audio
+            return
+        if len(audio) > self.max_bytes:
+            return
+        self._audio[key] = audio
+        self._bytes += len(audio)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._audio.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    async def get(self, text, voice_id, speed):
+        """A sentence's audio, synthesized if needed; None if synthesis failed"""
+        key = (text, voice_id, float(speed))
+        audio = self._pinned.get(key)
+        if audio is not None:
+            return audio
+        audio = self._audio.get(key)
+        if audio is not None:
+            self._audio.move_to_end(key)
+            return audio
+        task = self._rendering.get(key)
+        if task is None:
+            self._start(key)
+            task = self._rendering[key]
+        try:
+            # Shielded: a caller hanging up must not cancel a synthesis others share
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return None
+            raise
+        except Exception:
+            return None
+
+    async def aclose(self):
+        tasks = list(self._rendering.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,187 @@
+"""
+Lightweight per-turn latency tracing.
+
+A trace covers one conversational turn of one call, keyed by CallSid and turn
+number. The active trace lives in a context variable, so it follows the request
+into worker threads started with contextvars.copy_context().run and into
+asyncio tasks. Finished traces are kept in an in-memory ring buffer; spans can
+also be appended to a JSONL file by setting TRACE_LOG_PATH.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    def __init__(self, call_sid, turn):
+        self.call_sid = call_sid
+        self.turn = turn
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def offset(self):
+        return time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            'call_sid': self.call_sid,
+            'turn': self.turn,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'spans': list(self.spans),
+        }
+
+
+class Tracer:
+    def __init__(self, capacity=None, log_path=None):
+        self.capacity = capacity or int(os.getenv('TRACE_BUFFER_SIZE', '2000'))
+        self.log_path = log_path or os.getenv('TRACE_LOG_PATH')
+        self._traces = OrderedDict()  # (call_sid, turn) -> Trace, oldest first
+        self._lock = threading.Lock()
+        self._log_file = open(self.log_path, 'a') if self.log_path else None
+
+    def _remember(self, trace):
+        with self._lock:
+            key = (trace.call_sid, trace.turn)
+            self._traces.pop(key, None)
+            self._traces[key] = trace
+            while len(self._traces) > self.capacity:
+                self._traces.popitem(last=False)
+
+    @contextmanager
+    def request(self, call_sid, turn=None):
+        """Open a trace for one request; the turn can be filled in later with set_turn"""
+        trace = Trace(call_sid, turn)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            trace.duration = trace.offset()
+            _current_trace.reset(token)
+            self._remember(trace)
+
+    @contextmanager
+    def resume(self, call_sid, turn):
+        """Re-enter the trace of a turn, e.g. on the far side of an agent message"""
+        if _current_trace.get() is not None:
+            yield _current_trace.get()
+            return
+        with self._lock:
+            trace = self._traces.get((call_sid, turn))
+        if trace is None:
+            trace = Trace(call_sid, turn)
+            self._remember(trace)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    def set_turn(self, turn):
+        """Fix the turn of the current trace and publish it, so resume() finds it while it is still open"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.turn = turn
+            self._remember(trace)
+
+    @contextmanager
+    def span(self, stage):
+        """Time a stage of the current trace; a no-op outside a trace"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+            return
+        offset = trace.offset()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            span = {
+                'stage': stage,
+                'offset': offset,
+                'duration': trace.offset() - offset,
+                'thread': threading.current_thread().name,
+            }
+            if error:
+                span['error'] = error
+            trace.spans.append(span)
+            self._write(trace, span)
+
+    def _write(self, trace, span):
+        if self._log_file is None:
+            return
+        try:
+            with self._lock:
+                self._log_file.write(json.dumps(dict(span, call_sid=trace.call_sid, turn=trace.turn)) + "\n")
+                self._log_file.flush()
+        except Exception as e:
+            logging.error(f"Error writing trace span: {e}")
+
+    def traced(self, stage):
+        """Decorator wrapping a sync or async function in a span"""
+        def decorator(f):
+            if inspect.iscoroutinefunction(f):
+                @functools.wraps(f)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(stage):
+                        return await f(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._traces.values())
+
+    def for_call(self, call_sid):
+        """Return the buffered traces of one call in turn order"""
+        return [trace.to_dict() for trace in self._snapshot() if trace.call_sid == call_sid]
+
+    def slowest(self, limit=10):
+        """Return the slowest finished turns, slowest first"""
+        finished = [trace for trace in self._snapshot() if trace.duration is not None]
+        finished.sort(key=lambda trace: trace.duration, reverse=True)
+        return [trace.to_dict() for trace in finished[:limit]]
+
+    def breakdown(self):
+        """Return count, mean and p95 duration per stage across buffered traces"""
+        durations = {}
+        for trace in self._snapshot():
+            for span in list(trace.spans):
+                durations.setdefault(span['stage'], []).append(span['duration'])
+
+        result = {}
+        for stage, values in durations.items():
+            values.sort()
+            result[stage] = {
+                'count': len(values),
+                'mean': sum(values) / len(values),
+                'p95': values[min(len(values) - 1, int(0.95 * len(values)))],
+                'max': values[-1],
+            }
+        return result
+
+
+# Process-wide tracer used by the server and the agents
+tracer = Tracer()
+traced = tracer.traced
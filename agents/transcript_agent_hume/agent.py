@@ -14,9 +14,10 @@ class Request(Model):
 agent = Agent()
 
 API_KEY = ""  # Replace with your API key
+API_URL = os.getenv("HUME_API_URL", "https://api.hume.ai")
 
 def fetch_top_chats():
-    url = "https://api.hume.ai/v0/evi/chats"
+    url = f"{API_URL}/v0/evi/chats"
     
     params = {
         'page_number': 0,
@@ -40,7 +41,7 @@ def fetch_top_chats():
 
 def process_chat_id(chat_id):
     # Example: define the second API call you want to perform with each chat ID
-    url = f"https://api.hume.ai/v0/evi/chats/{chat_id}"
+    url = f"{API_URL}/v0/evi/chats/{chat_id}"
 
     params = {
         'page_size' : 100,
@@ -5,8 +5,8 @@ and Groq for analysis and categorization.
 
 from uagents import Agent, Context
 from simple_protocol import simples
+from agents.report_client import report_records, send_records
 import requests
-import json
 import os
 import groq
 from dotenv import load_dotenv
@@ -83,19 +83,14 @@ def fetch_transcripts():
 
 def send_report(report):
     """
-    Send processed report to the webhook endpoint
+    Send processed report to the bulk webhook endpoint, batched and gzip-compressed
     """
-    url = "https://a4ff-199-115-241-212.ngrok-free.app/webhook"
-    headers = {'Content-Type': 'application/json'}
-    
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(report))
-        if response.status_code == 200:
-            print("Report sent successfully")
-            return True
-        else:
-            print(f"Failed to send report: {response.status_code}")
-            return False
+        result = send_records(report_records(report))
+        print(f"Report sent: {result['added']} new cases, {result['duplicate']} duplicates, {result['rejected']} rejected")
+        for error in result['errors']:
+            print(f"Case {error['record']} rejected: {error['error']}")
+        return True
     except Exception as e:
         print(f"Error sending report: {e}")
         return False
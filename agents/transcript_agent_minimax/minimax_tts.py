@@ -1,18 +1,27 @@
 import os
-import requests
+import httpx
 from dotenv import load_dotenv
 import logging
 import base64
 import json
+from twilio.twiml.voice_response import VoiceResponse
+from agents.metrics import registry, timed
+from agents.tracing import traced
+from agents.speech_cache import SpeechCache, split_sentences
+from agents.scheduler import PriorityScheduler
 
 # Load environment variables
 load_dotenv()
 
+# Minimax requests of every call and voice mode beyond TTS_CONCURRENCY wait their turn, most urgent calls first
+scheduler = PriorityScheduler('tts', int(os.getenv('TTS_CONCURRENCY', '64')))
+
 class MinimaxTTS:
     def __init__(self):
         self.api_key = os.getenv("MINIMAX_API_KEY")
         self.group_id = os.getenv("MINIMAX_GROUP_ID")
-        self.base_url = f"https://api.minimaxi.chat/v1/t2a_v2?GroupId={self.group_id}"
+        api_base = os.getenv("MINIMAX_BASE_URL", "https://api.minimaxi.chat")
+        self.base_url = f"{api_base}/v1/t2a_v2?GroupId={self.group_id}"
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -23,11 +32,41 @@ class MinimaxTTS:
             logging.debug(f"API Key present: {bool(self.api_key)}")
             logging.debug(f"Group ID present: {bool(self.group_id)}")
 
-    def generate_speech(self, text, voice_id="female_01", speed=1.0):
+        # Pooled HTTP client, created on first use so it belongs to the serving loop
+        self._client = None
+        # TwiML and sentences of fixed prompts from their last successful synthesis, played when TTS is shed
+        self._prompts = {}
+        self._failures = registry.counter('tts_failures_total')
+        self._speech = None
+
+    def _http(self):
+        if self._client is None:
+            # Every active call synthesizes speech at once on a turn; size the pool for that
+            limits = httpx.Limits(max_connections=int(os.getenv('MINIMAX_MAX_CONNECTIONS', '500')))
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(10.0), limits=limits)
+        return self._client
+
+    @property
+    def speech(self):
+        """Sentence audio shared by all calls, served to Twilio from /audio"""
+        if self._speech is None:
+            self._speech = SpeechCache(self._synthesize)
+        return self._speech
+
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        if self._speech is not None:
+            await self._speech.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @timed("generate_speech")
+    @traced("generate_speech")
+    async def _synthesize(self, text, voice_id="female_01", speed=1.0, audio_setting=None):
         """
-        Generate speech from text using Minimax TTS API
-        voice_id options: female_01, female_02, male_01, male_02
-        speed: 0.5 to 2.0
+        One Minimax TTS request; the decoded audio, or None on failure
+        audio_setting: output format, sample rate and channels; Minimax's default (mp3) when None
         """
         try:
             if not self.api_key or not self.group_id:
@@ -41,25 +80,24 @@ class MinimaxTTS:
                 "vol": 1.0,
                 "pitch": 0
             }
+            if audio_setting:
+                payload["audio_setting"] = audio_setting
 
-            logging.info(f"Making Minimax TTS request to {self.base_url}")
-            logging.debug(f"Request payload: {payload}")
-            logging.debug(f"Headers: {self.headers}")
+            # Headers carry the API key and are never logged
+            logging.debug("Making Minimax TTS request for %d characters", len(text))
 
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json=payload
-            )
+            async with scheduler.slot():
+                response = await self._http().post(
+                    self.base_url,
+                    headers=self.headers,
+                    json=payload
+                )
 
-            logging.debug(f"Minimax response status: {response.status_code}")
-            logging.debug(f"Minimax response headers: {response.headers}")
-            logging.debug(f"Minimax response content: {response.text[:200]}")  # Log first 200 chars of response
+            logging.debug("Minimax response status: %s", response.status_code)
 
             if response.status_code == 200:
                 try:
                     audio_data = response.json()
-                    logging.debug(f"Response JSON keys: {audio_data.keys()}")
                     
                     # Try different possible response structures
                     audio_content = (
@@ -69,49 +107,89 @@ class MinimaxTTS:
                     )
                     
                     if audio_content:
-                        # Convert audio content to proper format for Twilio
-                        audio_url = f"data:audio/mp3;base64,{audio_content}"
-                        return audio_url
+                        return base64.b64decode(audio_content)
                     else:
-                        logging.error(f"No audio content found in response structure: {audio_data}")
+                        logging.error("No audio content found in Minimax response with keys %s", list(audio_data))
                         return None
-                except json.JSONDecodeError as e:
-                    logging.error(f"Failed to parse JSON response: {e}")
+                except (json.JSONDecodeError, ValueError) as e:
+                    logging.error("Failed to parse Minimax response: %s", e)
                     return None
             else:
-                logging.error(f"Minimax TTS API error: {response.status_code} - {response.text}")
+                logging.error("Minimax TTS API error: %s - %.200s", response.status_code, response.text)
                 return None
 
         except Exception as e:
-            logging.error(f"Error generating speech with Minimax: {e}")
+            logging.error("Error generating speech with Minimax: %s", e)
             return None
 
-    def generate_twiml_response(self, text, voice_id="female_01", speed=1.0):
+    async def generate_speech(self, text, voice_id="female_01", speed=1.0):
         """
-        Generate TwiML response with Minimax TTS audio
+        Generate speech from text using Minimax TTS API
+        voice_id options: female_01, female_02, male_01, male_02
+        speed: 0.5 to 2.0
         """
-        from twilio.twiml.voice_response import VoiceResponse
+        audio = await self._synthesize(text, voice_id, speed)
+        if audio is None:
+            return None
+        # Convert audio content to proper format for Twilio
+        return f"data:audio/mp3;base64,{base64.b64encode(audio).decode()}"
 
+    async def synthesize_pcm(self, text, voice_id="female_01", speed=1.0, sample_rate=8000):
+        """
+        Raw mono 16-bit PCM of text at sample_rate, for media stream calls; None on failure
+        """
+        pcm = await self._synthesize(text, voice_id, speed, {"format": "pcm", "sample_rate": sample_rate, "channel": 1})
+        if pcm is None:
+            self._failures.inc()
+        return pcm
+
+    async def generate_twiml_response(self, text, voice_id="female_01", speed=1.0, prompt=False):
+        """
+        Generate TwiML response with Minimax TTS audio, one Play per sentence
+        The response is ready once the first sentence is; the others keep rendering behind /audio URLs
+        prompt: the text is a fixed prompt, kept for static_twiml once synthesized
+        """
         try:
-            # Generate speech using Minimax
-            audio_url = self.generate_speech(text, voice_id, speed)
+            sentences = split_sentences(text)
+            for sentence in sentences:
+                if prompt:
+                    self.speech.pin(sentence, voice_id, speed)
+                self.speech.prefetch(sentence, voice_id, speed)
+            first_audio = await self.speech.get(sentences[0], voice_id, speed) if sentences else None
             
             # Create TwiML response
             response = VoiceResponse()
             
-            if audio_url:
-                # Add the audio content as a Play verb
-                response.play(audio_url)
+            if first_audio:
+                # Twilio fetches each sentence as it reaches it
+                for sentence in sentences:
+                    response.play(self.speech.url(sentence, voice_id, speed))
+                if prompt:
+                    self._prompts[(text, voice_id, speed)] = (str(response), sentences)
             else:
                 # Fallback to Twilio's TTS if Minimax fails
                 logging.warning("Falling back to Twilio TTS")
+                self._failures.inc()
                 response.say(text, voice='alice')
             
             return str(response)
 
         except Exception as e:
-            logging.error(f"Error generating TwiML with Minimax: {e}")
+            logging.error("Error generating TwiML with Minimax: %s", e)
+            self._failures.inc()
             # Fallback to Twilio's TTS
             response = VoiceResponse()
             response.say(text, voice='alice')
-            return str(response) 
\ No newline at end of file
+            return str(response)
+
+    def static_twiml(self, text, voice_id="female_01", speed=1.0):
+        """
+        TwiML for text without calling Minimax: the pinned audio of a fixed prompt, or Twilio's own TTS
+        """
+        cached = self._prompts.get((text, voice_id, speed))
+        # Played from /audio only if every sentence rendered; the route does not synthesize while shedding
+        if cached is not None and all(self.speech.pinned(sentence, voice_id, speed) for sentence in cached[1]):
+            return cached[0]
+        response = VoiceResponse()
+        response.say(text, voice='alice')
+        return str(response)
@@ -1,9 +1,12 @@
+import asyncio
 from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from twilio.twiml.voice_response import VoiceResponse, Gather
 import os
 import logging
 from dotenv import load_dotenv
 from .minimax_tts import MinimaxTTS
+from agents.tracing import traced
 
 # Load environment variables
 load_dotenv()
@@ -14,26 +17,70 @@ class TwilioHandler:
         self.account_sid = os.getenv('TWILIO_ACCOUNT_SID')
         self.auth_token = os.getenv('TWILIO_AUTH_TOKEN')
         self.phone_number = os.getenv('TWILIO_PHONE_NUMBER')
-        self.client = Client(self.account_sid, self.auth_token)
-        self.tts = MinimaxTTS()  # Initialize Minimax TTS
+        self._client = None
+        self._tts = None
         logging.info(f"TwilioHandler initialized with phone number: {self.phone_number}")
 
-    def handle_incoming_call(self):
+    @property
+    def client(self):
+        """Twilio REST client on an aiohttp session, created on first use inside the serving loop"""
+        if self._client is None:
+            self._client = Client(self.account_sid, self.auth_token, http_client=AsyncTwilioHttpClient(timeout=10))
+            # Point the REST client at a local stub when load testing
+            if os.getenv('TWILIO_API_BASE_URL'):
+                self._client.api.base_url = os.getenv('TWILIO_API_BASE_URL')
+        return self._client
+
+    @property
+    def tts(self):
+        """Minimax TTS, created on first use"""
+        if self._tts is None:
+            self._tts = MinimaxTTS()
+        return self._tts
+
+    async def aclose(self):
+        """Close the Twilio and TTS HTTP sessions"""
+        if self._client is not None:
+            await self._client.http_client.close()
+            self._client = None
+        if self._tts is not None:
+            await self._tts.aclose()
+
+    async def handle_incoming_call(self, static_prompts=False, partial_result_callback=None):
         """
         Handle incoming 911 calls using Minimax TTS
+        static_prompts: play cached prompts instead of calling Minimax, as under surge load
+        partial_result_callback: route Twilio posts interim transcripts of the caller's speech to
         """
         logging.info("Handling incoming call")
         try:
             response = VoiceResponse()
-            
-            # Initial greeting using Minimax TTS
-            greeting_response = self.tts.generate_twiml_response(
+            prompts = (
                 "911, what's your emergency?",
-                voice_id="female_01",  # Using female voice for emergency services
-                speed=1.0
+                "Please describe your emergency.",
+                "We didn't receive any input. Please call back if you have an emergency.",
             )
+            
+            # Using female voice for emergency services
+            if static_prompts:
+                greeting_response, prompt_response, no_input_response = (
+                    self.tts.static_twiml(text, voice_id="female_01", speed=1.0) for text in prompts
+                )
+            else:
+                # Synthesize the greeting, prompt and no-input message concurrently
+                greeting_response, prompt_response, no_input_response = await asyncio.gather(*(
+                    self.tts.generate_twiml_response(text, voice_id="female_01", speed=1.0, prompt=True)
+                    for text in prompts
+                ))
+            
+            # Initial greeting using Minimax TTS
             response.append(greeting_response)
             
+            # Interim transcripts let the server start analysing before the caller finishes
+            partial_results = {}
+            if partial_result_callback:
+                partial_results = {'partialResultCallback': partial_result_callback, 'partialResultCallbackMethod': 'POST'}
+
             # Configure Gather with explicit speech settings
             gather = Gather(
                 input='speech dtmf',
@@ -44,43 +91,34 @@ class TwilioHandler:
                 speechTimeout='auto',
                 enhanced=True,
                 hints='emergency, help, fire, medical, police',
-                speechModel='phone_call'
+                speechModel='phone_call',
+                **partial_results
             )
             
             # Add the prompt using Minimax TTS
-            prompt_response = self.tts.generate_twiml_response(
-                "Please describe your emergency.",
-                voice_id="female_01",
-                speed=1.0
-            )
             gather.append(prompt_response)
             
             # Add the Gather to the response
             response.append(gather)
             
-            # Log the full TwiML for debugging
-            logging.info(f"Generated TwiML response: {str(response)}")
+            # Log the TwiML size only; it embeds the synthesized audio
+            logging.debug("Generated TwiML response of %d bytes", len(str(response)))
             
             # If no input received, this will only execute after Gather is done
-            no_input_response = self.tts.generate_twiml_response(
-                "We didn't receive any input. Please call back if you have an emergency.",
-                voice_id="female_01",
-                speed=1.0
-            )
             response.append(no_input_response)
             
             logging.info("Successfully created voice response")
             return str(response)
         except Exception as e:
-            logging.error(f"Error in handle_incoming_call: {e}")
+            logging.error("Error in handle_incoming_call: %s", e)
             raise
 
+    @traced("process_speech")
     def process_speech(self, speech_result):
         """
         Process the speech input and send to Minimax
         """
-        logging.info("Processing speech input")
-        logging.debug(f"Speech result: {speech_result}")
+        logging.debug("Processing speech input for call %s", speech_result.get('CallSid'))
         
         # This will be processed by the main agent
         result = {
@@ -90,29 +128,28 @@ class TwilioHandler:
             'confidence': speech_result.get('Confidence'),
             'timestamp': speech_result.get('Timestamp')
         }
-        logging.info(f"Processed speech result: {result}")
         return result
 
-    def end_call(self, call_sid):
+    async def end_call(self, call_sid):
         """
         End the call and save any final information
         """
-        logging.info(f"Ending call with SID: {call_sid}")
+        logging.info("Ending call with SID: %s", call_sid)
         try:
-            call = self.client.calls(call_sid).update(status='completed')
+            call = await self.client.calls(call_sid).update_async(status='completed')
             logging.info("Call ended successfully")
             return True
         except Exception as e:
-            logging.error(f"Error ending call: {e}")
+            logging.error("Error ending call: %s", e)
             return False
 
-    def make_test_call(self, to_number):
+    async def make_test_call(self, to_number):
         """
         Make a test call to verify the setup
         """
         logging.info(f"Making test call to: {to_number}")
         try:
-            call = self.client.calls.create(
+            call = await self.client.calls.create_async(
                 url='http://demo.twilio.com/docs/voice.xml',
                 to=to_number,
                 from_=self.phone_number
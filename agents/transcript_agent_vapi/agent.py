@@ -4,8 +4,8 @@ This agent requests, fetches call transcripts of most recent 911 calls periodica
 
 from uagents import Agent, Context
 from simple_protocol import simples
+from agents.report_client import report_records, send_records
 import requests
-import json
 import os
 import groq
 
@@ -19,7 +19,7 @@ agent.include(simples)
 def fetch_transcripts():
 
     # Define the API endpoint and parameters
-    url = "https://api.vapi.ai/call"
+    url = f"{os.getenv('VAPI_API_URL', 'https://api.vapi.ai')}/call"
     params = {
         'assistantId': 'ID',
         'phoneNumberId': 'PID',
@@ -56,26 +56,15 @@ def fetch_transcripts():
         return []
 
 def send_report(report):
-    # Define the API endpoint
-    url = "https://a4ff-199-115-241-212.ngrok-free.app/webhook"
-
-    # Define the JSON data to be sent in the POST request
-    data = report
-    # Define the headers
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
-    # Make the POST request to the API
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    # Upload the report's cases to the bulk webhook endpoint, batched and gzip-compressed
+    try:
+        result = send_records(report_records(report))
+    except Exception as e:
+        print(f"Failed to make the request: {e}")
+        return
 
-    # Check if the response is successful
-    if response.status_code == 200:
-        print("Request was successful!")
-        print("Response data:", response.json())  # Print the response data (if any)
-    else:
-        print(f"Failed to make the request: {response.status_code}")
-        print(response.text)  # Print the response message for debugging
+    print("Request was successful!")
+    print("Response data:", result)  # Counts of new, duplicate and rejected cases
 
             
 
@@ -0,0 +1,136 @@
+"""
+Durable journal of caller turns, between the webhook layer and the
+analysis and dispatch stages.
+
+Every utterance is written to an SQLite database in WAL mode, keyed by
+(CallSid, turn), before it is analysed; the analysis is written next to it
+before the turn is queued for dispatch, and the turn is marked dispatched once
+the dispatcher has it. After a crash or restart, the rows of live calls rebuild
+the conversation history, and turns that were never dispatched are replayed:
+analysed turns go straight back on the dispatch queue, the rest are analysed
+again. Delivery is at least once; the (CallSid, turn) key is what makes
+retries and replays idempotent downstream. A call whose hang-up never arrived
+(the node was down when it ended) is expired at recovery once it is older
+than any call can be, so its rows do not come back on every restart.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    call_sid TEXT NOT NULL,
+    turn INTEGER NOT NULL,
+    transcript TEXT NOT NULL,
+    timestamp TEXT NOT NULL DEFAULT '',
+    analysis TEXT,
+    dispatched INTEGER NOT NULL DEFAULT 0,
+    ended INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (call_sid, turn)
+);
+CREATE INDEX IF NOT EXISTS turns_undispatched ON turns (dispatched) WHERE dispatched = 0;
+"""
+
+
+class TurnJournal:
+    def __init__(self, path="turns.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        # Connected on first use, so importing the journal's owner touches no files
+        self._conn = None
+
+    @property
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            # WAL with synchronous=NORMAL survives a process crash without an fsync per turn
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def record_utterance(self, call_sid, turn, transcript, timestamp=''):
+        """Journal a caller turn; returns False if this (CallSid, turn) was already recorded"""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO turns (call_sid, turn, transcript, timestamp, created_at) VALUES (?, ?, ?, ?, ?)",
+                (call_sid, turn, transcript, timestamp or '', time.time())
+            )
+            return cursor.rowcount == 1
+
+    def record_analysis(self, call_sid, turn, analysis_json):
+        """Store the dispatch payload of an analysed turn"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE turns SET analysis = ? WHERE call_sid = ? AND turn = ?",
+                (analysis_json, call_sid, turn)
+            )
+
+    def complete(self, call_sid, turn):
+        """Mark a turn dispatched; rows of ended calls are dropped once nothing is left to do"""
+        with self._lock:
+            self._db.execute("UPDATE turns SET dispatched = 1 WHERE call_sid = ? AND turn = ?", (call_sid, turn))
+            self._db.execute("DELETE FROM turns WHERE call_sid = ? AND turn = ? AND ended = 1", (call_sid, turn))
+
+    def end_call(self, call_sid):
+        """Forget a finished call's conversation, keeping turns that still await dispatch"""
+        with self._lock:
+            self._db.execute("UPDATE turns SET ended = 1 WHERE call_sid = ?", (call_sid,))
+            self._db.execute("DELETE FROM turns WHERE call_sid = ? AND dispatched = 1", (call_sid,))
+
+    def adopt(self, call_sid, history):
+        """Journal the conversation of a call handed over by another node
+
+        The previous owner keeps dispatching the turns it already accepted, so
+        adopted turns are recorded as dispatched.
+        """
+        now = time.time()
+        with self._lock:
+            # The call may be coming back to a node that handed it away earlier
+            self._db.execute("UPDATE turns SET ended = 0 WHERE call_sid = ?", (call_sid,))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO turns (call_sid, turn, transcript, timestamp, dispatched, created_at) "
+                "VALUES (?, ?, ?, ?, 1, ?)",
+                [(call_sid, turn, item['transcript'], item.get('timestamp', ''), now)
+                 for turn, item in enumerate(history, start=1)]
+            )
+
+    def expire_calls(self, max_duration):
+        """End the live calls that started more than `max_duration` seconds ago; returns their CallSids"""
+        cutoff = time.time() - max_duration
+        with self._lock:
+            expired = [call_sid for call_sid, in self._db.execute(
+                "SELECT call_sid FROM turns WHERE ended = 0 GROUP BY call_sid HAVING MIN(created_at) < ?", (cutoff,)
+            )]
+            for call_sid in expired:
+                self._db.execute("UPDATE turns SET ended = 1 WHERE call_sid = ?", (call_sid,))
+                self._db.execute("DELETE FROM turns WHERE call_sid = ? AND dispatched = 1", (call_sid,))
+        return expired
+
+    def conversations(self):
+        """Conversation history of calls still in progress, as {CallSid: [{transcript, timestamp}, ...]}"""
+        history = {}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT call_sid, transcript, timestamp FROM turns WHERE ended = 0 ORDER BY call_sid, turn"
+            ).fetchall()
+        for call_sid, transcript, timestamp in rows:
+            history.setdefault(call_sid, []).append({'transcript': transcript, 'timestamp': timestamp})
+        return history
+
+    def unfinished(self):
+        """Turns never dispatched, oldest first, as (call_sid, turn, transcript, analysis_json or None)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT call_sid, turn, transcript, analysis FROM turns WHERE dispatched = 0 ORDER BY created_at"
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        logging.debug("Closed turn journal %s", self.path)
@@ -0,0 +1,176 @@
+"""
+Multi-process smoke test for CallSid sharding.
+
+Starts several server nodes as local processes against the stub backends,
+sends every Twilio callback to a random node and checks that each call's
+conversation lives only on the node owning its CallSid. A node then joins and
+another leaves, and the test checks that the affected calls were handed over
+with their history intact.
+
+Run from the repository root:
+
+    python -m benchmarks.cluster_smoke --nodes 3 --calls 30
+"""
+
+import argparse
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from twilio.request_validator import RequestValidator
+
+from agents.sharding import HashRing
+from benchmarks.stubs import start_stubs, stub_environment
+
+AUTH_TOKEN = 'cluster-smoke-auth-token'
+CLUSTER_TOKEN = 'cluster-smoke-token'
+# Twilio signs the public URL every node sits behind, not the node's own address
+PUBLIC_BASE_URL = 'https://voice.example.test'
+
+
+class Node:
+    def __init__(self, port, workdir, env):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.dir = os.path.join(workdir, f"node-{port}")
+        self.env = env
+        self.process = None
+        os.makedirs(self.dir, exist_ok=True)
+
+    def start(self, members):
+        env = dict(os.environ, **self.env)
+        env.update({
+            'NODE_URL': self.url,
+            'CLUSTER_NODES': ",".join(members),
+            'CASE_STORE_PATH': os.path.join(self.dir, 'data.json'),
+            'TURN_JOURNAL_PATH': os.path.join(self.dir, 'turns.db'),
+        })
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1',
+             '--port', str(self.port), '--log-level', 'warning'],
+            env=env,
+        )
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{self.url}/cluster", timeout=1).ok:
+                    return self
+            except requests.exceptions.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError(f"node {self.url} did not start")
+
+    def calls(self):
+        return requests.get(f"{self.url}/cluster", timeout=5).json()['calls']
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            # SIGTERM lets the node leave the ring and hand its calls over
+            self.process.send_signal(signal.SIGTERM)
+            self.process.wait(timeout=30)
+
+
+class Caller:
+    def __init__(self):
+        self.validator = RequestValidator(AUTH_TOKEN)
+        self.session = requests.Session()
+
+    def post(self, node, path, form):
+        signature = self.validator.compute_signature(f"{PUBLIC_BASE_URL}{path}", form)
+        response = self.session.post(f"{node.url}{path}", data=form,
+                                     headers={'X-Twilio-Signature': signature}, timeout=30)
+        response.raise_for_status()
+
+    def turn(self, node, call_sid, text):
+        self.post(node, '/voice/transcribe', {'CallSid': call_sid, 'SpeechResult': text, 'Confidence': '0.9'})
+
+
+def check_placement(nodes, call_sids, turns, timeout=15):
+    """Wait until every call is held by its owner alone, with `turns` turns of history"""
+    ring = HashRing([node.url for node in nodes])
+    deadline = time.time() + timeout
+    while True:
+        held = {node.url: node.calls() for node in nodes}
+        problems = []
+        for call_sid in call_sids:
+            holders = [url for url, calls in held.items() if call_sid in calls]
+            owner = ring.owner(call_sid)
+            if holders != [owner]:
+                problems.append(f"{call_sid} held by {holders or 'nobody'}, owner {owner}")
+            elif held[owner][call_sid] != turns:
+                problems.append(f"{call_sid} has {held[owner][call_sid]} turns on {owner}, expected {turns}")
+        if not problems or time.time() > deadline:
+            return held, problems
+        time.sleep(0.5)
+
+
+def report(stage, held, problems):
+    counts = ", ".join(f"{url}: {len(calls)}" for url, calls in sorted(held.items()))
+    print(f"{stage:<28} {'ok' if not problems else 'FAILED'}  ({counts})")
+    for problem in problems[:10]:
+        print(f"    {problem}")
+    return not problems
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check CallSid sharding across local server processes")
+    parser.add_argument('--nodes', type=int, default=3, help="nodes in the cluster after the join")
+    parser.add_argument('--calls', type=int, default=30)
+    parser.add_argument('--base-port', type=int, default=8100)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stubs = start_stubs({name: {'latency': 0.05} for name in ('groq', 'minimax', 'twilio', 'hume', 'vapi')})
+    env = stub_environment(stubs)
+    env.update({
+        'TWILIO_AUTH_TOKEN': AUTH_TOKEN,
+        'CLUSTER_TOKEN': CLUSTER_TOKEN,
+        'PUBLIC_BASE_URL': PUBLIC_BASE_URL,
+        'AGENT_PORT': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    workdir = tempfile.mkdtemp(prefix='cluster-smoke-')
+    nodes = [Node(args.base_port + index, workdir, env) for index in range(max(args.nodes, 2))]
+    initial, joiner = nodes[:-1], nodes[-1]
+    caller = Caller()
+    call_sids = [f"CA{index:032d}" for index in range(args.calls)]
+    ok = True
+
+    try:
+        for node in initial:
+            node.start([node.url for node in initial])
+
+        # Every callback lands on a random node, as behind a load balancer
+        for call_sid in call_sids:
+            caller.post(random.choice(initial), '/voice', {'CallSid': call_sid})
+            caller.turn(random.choice(initial), call_sid, "There's a fire on Main Street")
+        ok &= report(f"{len(initial)} nodes, 1 turn", *check_placement(initial, call_sids, 1))
+
+        joiner.start([node.url for node in nodes])
+        ok &= report(f"{joiner.url} joined", *check_placement(nodes, call_sids, 1))
+
+        for call_sid in call_sids:
+            caller.turn(random.choice(nodes), call_sid, "Two people are still inside")
+        ok &= report(f"{len(nodes)} nodes, 2 turns", *check_placement(nodes, call_sids, 2))
+
+        leaver = nodes[0]
+        leaver.stop()
+        ok &= report(f"{leaver.url} left", *check_placement(nodes[1:], call_sids, 2))
+    finally:
+        for node in nodes:
+            node.stop()
+        for stub in stubs.values():
+            stub.stop()
+
+    print("cluster smoke test passed" if ok else "cluster smoke test FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Local fake media for exercising the media stream mode without Twilio.
+
+FakeMediaSource produces the messages Twilio sends over a Media Stream for a
+scripted caller: a tone while the caller talks and mu-law silence otherwise.
+ScriptedSTT and ToneTTS are streaming backends that stand in for real speech
+recognition and synthesis; select them with
+
+    STREAM_STT=benchmarks.fake_media:ScriptedSTT
+    STREAM_TTS=benchmarks.fake_media:ToneTTS
+
+ScriptedSTT "recognizes" the next line of the caller's script each time the
+caller stops talking. The script travels in the stream's start message as the
+custom parameter 'script', lines separated by '|'.
+
+Environment:
+    FAKE_TTS_FIRST_FRAME_SECONDS  delay before ToneTTS yields its first frame
+    FAKE_TTS_FRAMES_PER_CHAR      frames of reply audio per character of text
+"""
+
+import asyncio
+import base64
+import json
+import math
+import os
+
+from agents.media_stream import (
+    EnergyVAD, FRAME_BYTES, FRAME_SECONDS, SAMPLE_RATE, SILENCE, STTSession, StreamingSTT, StreamingTTS,
+    frames, ulaw_encode,
+)
+
+
+def tone(seconds, frequency=440.0, amplitude=8000):
+    """mu-law audio of a sine tone, standing in for speech"""
+    count = int(seconds * SAMPLE_RATE)
+    return ulaw_encode([int(amplitude * math.sin(2 * math.pi * frequency * n / SAMPLE_RATE)) for n in range(count)])
+
+
+# One frame of tone, reused for every frame of caller speech
+TONE_FRAME = tone(FRAME_SECONDS)
+
+
+class FakeMediaSource:
+    """Twilio Media Stream messages for one scripted caller"""
+
+    def __init__(self, call_sid, script, stream_sid=None):
+        self.call_sid = call_sid
+        self.script = list(script)
+        self.stream_sid = stream_sid or 'MZ' + call_sid[2:]
+        self._sequence = 0
+        self._chunk = 0
+
+    def _next_sequence(self):
+        self._sequence += 1
+        return str(self._sequence)
+
+    def start(self):
+        """The connected and start messages that open the stream"""
+        return [
+            json.dumps({'event': 'connected', 'protocol': 'Call', 'version': '1.0.0'}),
+            json.dumps({
+                'event': 'start',
+                'sequenceNumber': self._next_sequence(),
+                'streamSid': self.stream_sid,
+                'start': {
+                    'streamSid': self.stream_sid,
+                    'callSid': self.call_sid,
+                    'tracks': ['inbound'],
+                    'mediaFormat': {'encoding': 'audio/x-mulaw', 'sampleRate': SAMPLE_RATE, 'channels': 1},
+                    'customParameters': {'script': '|'.join(self.script)},
+                },
+            }),
+        ]
+
+    def media(self, frame):
+        """One media message carrying a frame of caller audio"""
+        self._chunk += 1
+        return json.dumps({
+            'event': 'media',
+            'sequenceNumber': self._next_sequence(),
+            'streamSid': self.stream_sid,
+            'media': {
+                'track': 'inbound',
+                'chunk': str(self._chunk),
+                'timestamp': str(int(self._chunk * FRAME_SECONDS * 1000)),
+                'payload': base64.b64encode(frame).decode(),
+            },
+        })
+
+    def speech(self, seconds):
+        """Media messages for the caller talking for `seconds`"""
+        return [self.media(TONE_FRAME) for _ in range(max(1, round(seconds / FRAME_SECONDS)))]
+
+    def silence(self, seconds):
+        """Media messages for the caller staying quiet for `seconds`"""
+        return [self.media(SILENCE) for _ in range(max(1, round(seconds / FRAME_SECONDS)))]
+
+    def mark(self, name):
+        """Twilio's echo of a mark once the audio before it has played"""
+        return json.dumps({'event': 'mark', 'sequenceNumber': self._next_sequence(),
+                           'streamSid': self.stream_sid, 'mark': {'name': name}})
+
+    def stop(self):
+        return json.dumps({'event': 'stop', 'sequenceNumber': self._next_sequence(), 'streamSid': self.stream_sid,
+                           'stop': {'callSid': self.call_sid}})
+
+
+class ScriptedSession(STTSession):
+    def __init__(self, script, on_transcript):
+        self.script = script
+        self.on_transcript = on_transcript
+        self.vad = EnergyVAD()
+
+    async def send(self, frame):
+        if self.vad.update(frame) == 'end' and self.script:
+            await self.on_transcript(self.script.pop(0), True)
+
+
+class ScriptedSTT(StreamingSTT):
+    """Recognizes the next scripted line each time the caller stops talking"""
+
+    async def open(self, call_sid, parameters, on_transcript):
+        script = [line for line in parameters.get('script', '').split('|') if line]
+        return ScriptedSession(script, on_transcript)
+
+
+class ToneTTS(StreamingTTS):
+    """A tone as long as the text would take to say, after a fixed synthesis delay"""
+
+    def __init__(self):
+        self.first_frame = float(os.getenv('FAKE_TTS_FIRST_FRAME_SECONDS', '0.2'))
+        self.frames_per_char = float(os.getenv('FAKE_TTS_FRAMES_PER_CHAR', '3'))
+
+    async def synthesize(self, text, cached_only=False):
+        await asyncio.sleep(self.first_frame)
+        audio = tone(max(1, int(len(text) * self.frames_per_char)) * FRAME_SECONDS, frequency=220.0)
+        for index, frame in enumerate(frames(audio, FRAME_BYTES)):
+            # Synthesis runs faster than real time, but not all at once
+            if index and index % 50 == 0:
+                await asyncio.sleep(0)
+            yield frame
@@ -0,0 +1,340 @@
+"""
+Load test for the voice webhook server.
+
+Starts the server in-process against local stub backends, then replays many
+concurrent synthetic calls through /voice, /voice/transcribe and
+/status/callback while agent reports are posted to /webhook. With
+--speaking-time, each utterance is preceded by interim transcripts posted to
+/voice/partial while the caller "speaks", as Twilio's partial results are. Every Twilio
+request is signed with a test auth token, exactly as Twilio would sign it.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test --calls 50 --turns 5 --llm-latency 0.8
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from twilio.request_validator import RequestValidator
+
+from benchmarks.stubs import CATEGORIES, start_stubs, stub_environment
+
+AUTH_TOKEN = 'load-test-auth-token'
+
+# Seconds between interim transcripts while a caller speaks
+PARTIAL_INTERVAL = 0.25
+
+UTTERANCES = [
+    "There's a fire in my apartment building",
+    "My father collapsed and he isn't breathing",
+    "Someone just broke into my neighbor's house",
+    "There's a bear in the parking lot behind the school",
+    "A water main burst and the street is flooding",
+    "It's at 123 Main Street, apartment 4B",
+    "Yes, there are two people still inside",
+    "He's about sixty years old and has a heart condition",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def rss_bytes():
+    """Current resident set size, falling back to the peak where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Recorder:
+    """Thread-safe latency and error samples per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, path, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(path, []).append(seconds)
+            if not ok:
+                self.errors[path] = self.errors.get(path, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                path: {
+                    'requests': len(values),
+                    'errors': self.errors.get(path, 0),
+                    'p50': percentile(values, 0.50),
+                    'p95': percentile(values, 0.95),
+                    'p99': percentile(values, 0.99),
+                    'max': max(values),
+                }
+                for path, values in self.latencies.items()
+            }
+
+
+class LoadTest:
+    def __init__(self, base_url, args, recorder):
+        self.base_url = base_url
+        self.args = args
+        self.recorder = recorder
+        self.validator = RequestValidator(AUTH_TOKEN)
+
+    def signed_post(self, session, path, form):
+        url = f"{self.base_url}{path}"
+        signature = self.validator.compute_signature(url, form)
+        start = time.perf_counter()
+        try:
+            # Twilio marks every webhook request with a token it keeps across retries
+            headers = {'X-Twilio-Signature': signature, 'I-Twilio-Idempotency-Token': uuid.uuid4().hex}
+            response = session.post(url, data=form, headers=headers, timeout=60)
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        self.recorder.record(path, time.perf_counter() - start, ok)
+
+    def simulate_call(self, index):
+        """One caller: answer, several utterances with think time, then hang up"""
+        time.sleep(random.uniform(0, self.args.ramp_up))
+        session = requests.Session()
+        form = {
+            'CallSid': f"CA{index:032d}",
+            'AccountSid': 'AC' + '0' * 32,
+            'From': f"+1555{index:07d}",
+            'To': '+18582603506',
+        }
+        self.signed_post(session, '/voice', form)
+        utterance = None
+        for _ in range(self.args.turns):
+            time.sleep(random.uniform(*self.args.think_time))
+            # Think time here stands in for hearing the reply too, which would
+            # set a caller repeating themselves apart from a repeated delivery
+            utterance = random.choice([other for other in UTTERANCES if other != utterance])
+            if self.args.speaking_time > 0:
+                self.speak(session, form, utterance)
+            self.signed_post(session, '/voice/transcribe', dict(
+                form, SpeechResult=utterance, Confidence='0.92'
+            ))
+        self.signed_post(session, '/status/callback', dict(form, CallStatus='completed'))
+
+    def speak(self, session, form, utterance):
+        """Post growing interim transcripts of an utterance over the speaking time"""
+        words = utterance.split()
+        steps = max(1, int(self.args.speaking_time / PARTIAL_INTERVAL))
+        for step in range(1, steps + 1):
+            spoken = words[:max(1, round(len(words) * step / steps))]
+            # The last couple of words are still unstable, as in Twilio's partial results
+            self.signed_post(session, '/voice/partial', dict(
+                form,
+                StableSpeechResult=" ".join(spoken[:-2]),
+                UnstableSpeechResult=" ".join(spoken[-2:]),
+                SequenceNumber=str(step),
+            ))
+            time.sleep(self.args.speaking_time / steps)
+
+    def post_reports(self, stop):
+        """Post agent-style case reports to /webhook until the calls finish"""
+        session = requests.Session()
+        sequence = 0
+        while not stop.is_set():
+            report = {category: [] for category in CATEGORIES}
+            for _ in range(self.args.report_size):
+                sequence += 1
+                report[random.choice(CATEGORIES)].append({
+                    'case_number': f"report-{sequence}",
+                    'location': f"{random.randint(1, 999)} Main Street",
+                    'dispatch': 'yes',
+                    'situation': random.choice(UTTERANCES),
+                    'open_status': 'yes',
+                    'stack_rank': random.randint(1, 5),
+                })
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{self.base_url}/webhook", json=report, timeout=60)
+                ok = response.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            self.recorder.record('/webhook', time.perf_counter() - start, ok)
+            stop.wait(self.args.report_interval)
+
+    def run(self):
+        stop = threading.Event()
+        reporter = threading.Thread(target=self.post_reports, args=(stop,), daemon=True)
+        if self.args.report_interval > 0:
+            reporter.start()
+        with ThreadPoolExecutor(max_workers=self.args.calls) as pool:
+            list(pool.map(self.simulate_call, range(self.args.calls)))
+        stop.set()
+        if reporter.is_alive():
+            reporter.join()
+
+
+class ServerThread:
+    """uvicorn serving the app on its own event loop in a background thread"""
+
+    def __init__(self, app, log_level):
+        import uvicorn
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.server = uvicorn.Server(uvicorn.Config(app, log_config=None, log_level=log_level.lower()))
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [self.sock]},
+                                       name="load-test-server", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def shutdown(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def start_server(env, log_level):
+    """Import the server with the stub environment and serve it on a free port"""
+    os.environ.update(env)
+    import server
+
+    logging.getLogger().setLevel(log_level)
+    http_server = ServerThread(server.app, log_level).start()
+    return http_server, http_server.url
+
+
+def degradation():
+    """Admission mode changes and work served in degraded modes during the run, by mode"""
+    from agents.metrics import registry
+
+    metrics = registry.to_dict()
+    return {
+        name: {entry['labels']['mode']: entry['value'] for entry in metrics.get(name, []) if entry['value']}
+        for name in ('admission_steps_total', 'degraded_total')
+    }
+
+
+def speculation():
+    """Speculative analyses started, restarted, used and dropped during the run"""
+    from agents.metrics import registry
+
+    return {
+        outcome: registry.counter(f'speculation_{outcome}_total').value
+        for outcome in ('started', 'restarted', 'hits', 'misses')
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay concurrent synthetic 911 calls against the voice server")
+    parser.add_argument('--calls', type=int, default=20, help="concurrent simulated calls")
+    parser.add_argument('--turns', type=int, default=5, help="utterances per call")
+    parser.add_argument('--think-time', type=float, nargs=2, default=(1.0, 4.0), metavar=('MIN', 'MAX'),
+                        help="seconds a caller pauses between utterances")
+    parser.add_argument('--ramp-up', type=float, default=5.0, help="seconds over which calls start")
+    parser.add_argument('--report-interval', type=float, default=1.0,
+                        help="seconds between /webhook reports (0 disables them)")
+    parser.add_argument('--report-size', type=int, default=5, help="cases per /webhook report")
+    parser.add_argument('--speaking-time', type=float, default=0.0,
+                        help="seconds each utterance takes to say, posting partial results meanwhile (0: none)")
+    for provider, latency in (('llm', 0.8), ('tts', 0.3), ('twilio', 0.1), ('hume', 0.2), ('vapi', 0.2)):
+        parser.add_argument(f'--{provider}-latency', type=float, default=latency)
+        parser.add_argument(f'--{provider}-error-rate', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.1, help="+/- seconds added to every stub latency")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', dest='json_path', help="also write the report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stubs = start_stubs({
+        'groq': {'latency': args.llm_latency, 'jitter': args.jitter, 'error_rate': args.llm_error_rate},
+        'minimax': {'latency': args.tts_latency, 'jitter': args.jitter, 'error_rate': args.tts_error_rate},
+        'twilio': {'latency': args.twilio_latency, 'jitter': args.jitter, 'error_rate': args.twilio_error_rate},
+        'hume': {'latency': args.hume_latency, 'jitter': args.jitter, 'error_rate': args.hume_error_rate},
+        'vapi': {'latency': args.vapi_latency, 'jitter': args.jitter, 'error_rate': args.vapi_error_rate},
+    })
+
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    env = stub_environment(stubs)
+    env.update({
+        'TWILIO_AUTH_TOKEN': AUTH_TOKEN,
+        'CASE_STORE_PATH': os.path.join(workdir, 'data.json'),
+        'TURN_JOURNAL_PATH': os.path.join(workdir, 'turns.db'),
+        'AGENT_PORT': '0',
+    })
+    http_server, base_url = start_server(env, args.log_level)
+
+    recorder = Recorder()
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    LoadTest(base_url, args, recorder).run()
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes()
+    http_server.shutdown()
+
+    summary = recorder.summary()
+    turns = summary.get('/voice/transcribe', {}).get('requests', 0)
+    report = {
+        'calls': args.calls,
+        'turns_per_call': args.turns,
+        'elapsed_seconds': elapsed,
+        'turn_throughput_per_second': turns / elapsed if elapsed else 0.0,
+        'rss_before_bytes': rss_before,
+        'rss_after_bytes': rss_after,
+        'rss_growth_bytes': rss_after - rss_before,
+        'endpoints': summary,
+        'stubs': {name: {'requests': stub.requests, 'errors': stub.errors} for name, stub in stubs.items()},
+        'degradation': degradation(),
+        'speculation': speculation(),
+        'case_store': env['CASE_STORE_PATH'],
+    }
+
+    print(f"{args.calls} calls x {args.turns} turns in {elapsed:.1f}s "
+          f"({report['turn_throughput_per_second']:.2f} turns/s)")
+    print(f"RSS {rss_before / 2**20:.1f} MiB -> {rss_after / 2**20:.1f} MiB "
+          f"({report['rss_growth_bytes'] / 2**20:+.1f} MiB)")
+    print(f"{'endpoint':<20}{'requests':>10}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for path, stats in sorted(summary.items()):
+        print(f"{path:<20}{stats['requests']:>10}{stats['errors']:>8}"
+              f"{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+
+    if report['degradation']['admission_steps_total']:
+        print(f"admission steps {report['degradation']['admission_steps_total']}, "
+              f"degraded {report['degradation']['degraded_total']}")
+
+    if report['speculation']['started']:
+        print("speculation " + ", ".join(f"{outcome} {count}" for outcome, count in report['speculation'].items()))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for stub in stubs.values():
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
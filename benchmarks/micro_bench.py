@@ -0,0 +1,258 @@
+"""
+Micro-benchmarks for the case-store and dashboard data paths.
+
+Each benchmark runs against stores of 1k, 10k and 100k cases and keeps the
+best of several repeats. Results are compared with a stored baseline and the
+run exits non-zero when any path got slower than the allowed tolerance.
+
+Timings only compare on the machine that recorded them, so the baseline is
+per machine and not committed (it is git-ignored). Without one the run says
+so and compares nothing; --require-baseline makes that a failure, for CI
+jobs that keep their baseline between runs.
+
+Run from the repository root:
+
+    python -m benchmarks.micro_bench --update-baseline   # record this machine's baseline
+    python -m benchmarks.micro_bench                     # compare against it
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from agents.case_store import CATEGORIES, CaseStore, columnar_path
+from agents.incidents import IncidentIndex
+from agents.search_index import SearchIndex
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'micro_baseline.json')
+
+
+def make_case(number):
+    return {
+        'case_number': f"case-{number}",
+        'location': f"{random.randint(1, 9999)} Main Street",
+        'dispatch': 'yes',
+        'situation': random.choice(["structure fire", "cardiac arrest", "burglary", "flooding", "animal"]),
+        'open_status': random.choice(['yes', 'no']),
+        'stack_rank': random.randint(1, 5),
+    }
+
+
+def make_report(start, count):
+    report = {category: [] for category in CATEGORIES}
+    for number in range(start, start + count):
+        report[random.choice(CATEGORIES)].append(make_case(number))
+    return report
+
+
+class Workspace:
+    """A temporary case store preloaded with `size` cases"""
+
+    def __init__(self, size):
+        self.dir = tempfile.mkdtemp(prefix='micro-bench-')
+        self.path = os.path.join(self.dir, 'data.json')
+        self.size = size
+        with open(self.path, 'w') as f:
+            json.dump(make_report(0, size), f)
+        # Opening the store writes the columnar snapshot and aggregates for the seeded JSON
+        CaseStore(self.path, flush_interval_ms=60_000).shutdown()
+
+    def writer(self):
+        return CaseStore(self.path, flush_interval_ms=60_000)
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def bench_webhook_ingest(workspace, repeat):
+    """/webhook: dedup and add a 100-case report (half duplicates), then write the snapshot"""
+    store = workspace.writer()
+    # Each report overlaps the cases added by the previous one by half
+    reports = iter([make_report(workspace.size + 50 * i - 50, 100) for i in range(repeat)])
+
+    def run():
+        store.ingest(next(reports))
+        store.flush()
+    return run, store.shutdown
+
+
+def bench_dispatch_upsert(workspace, repeat):
+    """handle_emergency: upsert the next turn of an in-flight call, then write the snapshot"""
+    store = workspace.writer()
+    turn = [0]
+
+    def run():
+        turn[0] += 1
+        store.upsert('CA-bench', 'medical', {'situation': f"turn {turn[0]}", 'stack_rank': 1}, turn=turn[0])
+        store.flush()
+    return run, store.shutdown
+
+
+def bench_process_data(workspace, repeat):
+    """dashboard.process_data: flatten the store into a DataFrame"""
+    import dashboard
+    store = CaseStore(workspace.path, read_only=True)
+    return (lambda: dashboard.process_data(store)), None
+
+
+def bench_columnar_load(workspace, repeat):
+    """dashboard.load_columnar_snapshot: memory-map the Arrow snapshot"""
+    import dashboard
+    if dashboard.pa is None:
+        raise ImportError("pyarrow is not installed")
+    path = columnar_path(workspace.path)
+    return (lambda: dashboard.load_columnar_snapshot(path)), None
+
+
+def bench_map_markers(workspace, repeat):
+    """dashboard.build_map: build one clustered marker per case"""
+    import dashboard
+    import pandas as pd
+    store = CaseStore(workspace.path, read_only=True)
+    map_data = pd.DataFrame([
+        {
+            'latitude': 37.7 + random.random() / 10,
+            'longitude': -122.5 + random.random() / 10,
+            'category': category,
+            'situation': case['situation'],
+            'case_number': case['case_number'],
+        }
+        for category, case in store.rows()
+    ])
+    return (lambda: dashboard.build_map(map_data)), None
+
+
+def bench_match_incident(workspace, repeat):
+    """CaseStore.file: match a new report against every open case as an incident"""
+    index = IncidentIndex()
+    for number in range(workspace.size):
+        index.add(f"case-{number}", random.choice(CATEGORIES), make_case(number))
+    reports = [(random.choice(CATEGORIES), make_case(workspace.size + i)) for i in range(repeat)]
+    position = [0]
+
+    def run():
+        category, report = reports[position[0] % len(reports)]
+        position[0] += 1
+        index.match(category, report)
+    return run, None
+
+
+def bench_search_cases(workspace, repeat):
+    """/search: rank the cases matching a street name and situation, spread over 90 days of history"""
+    index = SearchIndex()
+    now = time.time()
+    for number in range(workspace.size):
+        index.add(f"case-{number}", random.choice(CATEGORIES), make_case(number), now - random.random() * 90 * 86400)
+    return (lambda: index.search('main "structure fire"', now=now)), None
+
+
+BENCHMARKS = {
+    'webhook_ingest': bench_webhook_ingest,
+    'dispatch_upsert': bench_dispatch_upsert,
+    'process_data': bench_process_data,
+    'columnar_load': bench_columnar_load,
+    'map_markers': bench_map_markers,
+    'match_incident': bench_match_incident,
+    'search_cases': bench_search_cases,
+}
+
+
+def measure(setup, workspace, repeat):
+    run, teardown = setup(workspace, repeat)
+    try:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        return best
+    finally:
+        if teardown is not None:
+            teardown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the case-store and dashboard data paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="run a subset of benchmarks")
+    parser.add_argument('--repeat', type=int, default=5, help="repeats per benchmark; the best is kept")
+    parser.add_argument('--map-limit', type=int, default=10_000,
+                        help="skip map_markers above this many cases (folium is slow)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown over the baseline, as a fraction")
+    parser.add_argument('--min-delta', type=float, default=0.002,
+                        help="slowdowns smaller than this many seconds are never regressions")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--require-baseline', action='store_true',
+                        help="fail when there is no baseline to compare with")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(0)
+    names = args.only or list(BENCHMARKS)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.update_baseline:
+        print(f"No baseline at {args.baseline}; results are not compared. "
+              f"Record one on this machine with --update-baseline.")
+        if args.require_baseline:
+            return 2
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<18}{'cases':>9}{'seconds':>12}{'baseline':>12}{'change':>9}")
+    for size in args.sizes:
+        workspace = Workspace(size)
+        try:
+            for name in names:
+                if name == 'map_markers' and size > args.map_limit:
+                    continue
+                try:
+                    seconds = measure(BENCHMARKS[name], workspace, args.repeat)
+                except ImportError as e:
+                    print(f"{name:<18}{size:>9}  skipped ({e})")
+                    continue
+
+                results.setdefault(name, {})[str(size)] = seconds
+                previous = baseline.get(name, {}).get(str(size))
+                if previous is None:
+                    print(f"{name:<18}{size:>9}{seconds:>12.5f}{'-':>12}{'-':>9}")
+                    continue
+                change = seconds / previous - 1
+                flag = ''
+                if change > args.tolerance and seconds - previous > args.min_delta:
+                    regressions.append((name, size, previous, seconds))
+                    flag = '  REGRESSION'
+                print(f"{name:<18}{size:>9}{seconds:>12.5f}{previous:>12.5f}{change:>+9.0%}{flag}")
+        finally:
+            workspace.cleanup()
+
+    if args.update_baseline:
+        for name, sizes in results.items():
+            baseline.setdefault(name, {}).update(sizes)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}")
+        return 1
+    if not baseline:
+        print("Not compared: no baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Startup benchmark for the voice webhook server.
+
+Starts the server as a fresh process again and again, as a restart during an
+incident would, and measures how long it takes until the server module is
+imported, until it accepts connections and until it answers its first signed
+/voice request. The case store can be seeded with a backlog so its load time
+shows up too. TTS goes to a local stub.
+
+Run from the repository root:
+
+    python -m benchmarks.startup_bench --runs 5 --cases 10000
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from twilio.request_validator import RequestValidator
+
+from benchmarks.stubs import CATEGORIES, start_stubs, stub_environment
+
+AUTH_TOKEN = 'startup-bench-auth-token'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_cases(path, count):
+    """Write a case store snapshot with `count` open cases"""
+    data = {category: [] for category in CATEGORIES}
+    for index in range(count):
+        category = CATEGORIES[index % len(CATEGORIES)]
+        data[category].append({
+            'case_number': f"CASE{index:08d}",
+            'location': f"{index} Main Street",
+            'dispatch': category,
+            'situation': "Seeded case",
+            'open_status': 'yes',
+            'stack_rank': index % 5 + 1,
+            'created_at': time.time(),
+        })
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def import_time(env):
+    """Seconds to import the server module in a fresh interpreter"""
+    code = "import time; start = time.perf_counter(); import server; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def start_once(env, timeout):
+    """Start one server process; returns (seconds until listening, seconds until the first /voice answer)"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/voice"
+    form = {'CallSid': 'CA' + '0' * 32}
+    signature = RequestValidator(AUTH_TOKEN).compute_signature(url, form)
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    listening = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with status {process.returncode}")
+            try:
+                response = requests.post(url, data=form, headers={'X-Twilio-Signature': signature}, timeout=timeout)
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.01)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - started
+            if response.status_code == 200:
+                return listening, time.perf_counter() - started
+        raise RuntimeError(f"no /voice answer within {timeout:.0f}s")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def summarize(values):
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure time from process start to the first /voice answer")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--cases', type=int, default=0, help="cases to seed the case store with")
+    parser.add_argument('--tts-latency', type=float, default=0.3)
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for each start")
+    parser.add_argument('--json', dest='json_path', help="also write the report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stubs = start_stubs({name: {'latency': args.tts_latency if name == 'minimax' else 0.0}
+                         for name in ('groq', 'minimax', 'twilio', 'hume', 'vapi')})
+    workdir = tempfile.mkdtemp(prefix='startup-bench-')
+    case_store_path = os.path.join(workdir, 'data.json')
+    if args.cases:
+        seed_cases(case_store_path, args.cases)
+
+    env = dict(os.environ, **stub_environment(stubs))
+    env.update({
+        'TWILIO_AUTH_TOKEN': AUTH_TOKEN,
+        'CASE_STORE_PATH': case_store_path,
+        'TURN_JOURNAL_PATH': os.path.join(workdir, 'turns.db'),
+        'AGENT_PORT': '0',
+    })
+
+    imports, listening, first_voice = [], [], []
+    try:
+        for run in range(args.runs):
+            imports.append(import_time(env))
+            ready, answered = start_once(env, args.timeout)
+            listening.append(ready)
+            first_voice.append(answered)
+            print(f"run {run + 1}: import {imports[-1]:.3f}s, listening {ready:.3f}s, first /voice {answered:.3f}s")
+    finally:
+        for stub in stubs.values():
+            stub.stop()
+
+    report = {
+        'runs': args.runs,
+        'cases': args.cases,
+        'import_seconds': summarize(imports),
+        'listening_seconds': summarize(listening),
+        'first_voice_seconds': summarize(first_voice),
+    }
+    print(f"{'stage':<20}{'min':>9}{'median':>9}{'max':>9}")
+    for stage in ('import_seconds', 'listening_seconds', 'first_voice_seconds'):
+        stats = report[stage]
+        print(f"{stage:<20}{stats['min']:>9.3f}{stats['median']:>9.3f}{stats['max']:>9.3f}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Latency test for the media stream mode.
+
+Runs the server in-process with the fake media backends (or the real ones
+against the Minimax stub) and connects many scripted callers to
+/voice/stream at once. Each caller streams real-time audio frames: a tone
+while it talks, silence while it listens. It plays back the reply frames it
+receives, echoes marks once they have "played", and on some turns talks over
+the reply to exercise barge-in.
+
+Reported turn latency is measured from the caller's last frame of speech to
+the first frame of the reply, the gap a caller actually hears, and
+server-side from the end of speech detection to the first reply frame.
+
+Run from the repository root:
+
+    python -m benchmarks.stream_test --calls 20 --turns 3 --llm-latency 0.5
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from twilio.request_validator import RequestValidator
+
+from benchmarks.fake_media import FakeMediaSource
+from benchmarks.load_test import UTTERANCES, percentile
+from benchmarks.stubs import start_stubs, stub_environment
+
+AUTH_TOKEN = 'stream-test-auth-token'
+
+# Frames sent per write, as one 100 ms chunk of real-time audio
+CHUNK_FRAMES = 5
+CHUNK_SECONDS = 0.1
+
+
+class Caller:
+    """One scripted caller on a media stream, playing back what the server says"""
+
+    def __init__(self, client, index, args):
+        self.client = client
+        self.args = args
+        self.call_sid = f"CA{index:032d}"
+        self.script = random.sample(UTTERANCES, min(args.turns, len(UTTERANCES)))
+        self.source = FakeMediaSource(self.call_sid, self.script)
+        self.latencies = []
+        self.barge_ins = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._playing = False
+        self._play_until = 0.0
+        self._marks = []
+        self._reply_at = None
+        self._closed = threading.Event()
+        self._ws = None
+
+    def read(self):
+        """Take the server's messages: queue reply audio for playback and hold marks until it has played"""
+        try:
+            while True:
+                message = json.loads(self._ws.receive_text())
+                now = time.perf_counter()
+                with self._lock:
+                    if message['event'] == 'media':
+                        if not self._playing:
+                            self._playing, self._reply_at = True, now
+                        self._play_until = max(self._play_until, now) + 0.02
+                    elif message['event'] == 'mark':
+                        self._marks.append((self._play_until, message['mark']['name']))
+                    elif message['event'] == 'clear':
+                        # Twilio drops the queued audio and returns its marks at once
+                        self._playing, self._play_until = False, now
+                        self._marks = [(now, name) for _, name in self._marks]
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self._closed.set()
+
+    def send_chunk(self, messages):
+        """Send up to 100 ms of audio, echo marks whose audio has played, then wait out the chunk"""
+        started = time.perf_counter()
+        if self._closed.is_set():
+            return
+        for message in messages:
+            self._ws.send_text(message)
+        with self._lock:
+            due = [name for at, name in self._marks if at <= started]
+            self._marks = [(at, name) for at, name in self._marks if at > started]
+            if due and not self._marks and self._play_until <= started:
+                self._playing = False
+        for name in due:
+            self._ws.send_text(self.source.mark(name))
+        time.sleep(max(0.0, CHUNK_SECONDS - (time.perf_counter() - started)))
+
+    def stream(self, messages):
+        for start in range(0, len(messages), CHUNK_FRAMES):
+            self.send_chunk(messages[start:start + CHUNK_FRAMES])
+
+    def listen(self, until):
+        """Stream silence until `until()` holds or the server hangs up"""
+        deadline = time.perf_counter() + self.args.timeout
+        while not until() and not self._closed.is_set():
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"call {self.call_sid} waited {self.args.timeout:.0f}s")
+            self.send_chunk(self.source.silence(CHUNK_SECONDS))
+
+    def run(self):
+        signature = RequestValidator(AUTH_TOKEN).compute_signature('ws://testserver/voice/stream', {})
+        try:
+            with self.client.websocket_connect('/voice/stream', headers={'X-Twilio-Signature': signature}) as ws:
+                self._ws = ws
+                reader = threading.Thread(target=self.read, daemon=True)
+                reader.start()
+                for message in self.source.start():
+                    ws.send_text(message)
+                # Hear the greeting out
+                self.listen(lambda: self._reply_at is not None)
+                self.listen(lambda: not self._playing)
+
+                for turn, utterance in enumerate(self.script, 1):
+                    self._reply_at = None
+                    self.stream(self.source.speech(self.args.speaking_time))
+                    spoke_at = time.perf_counter()
+                    self.listen(lambda: self._reply_at is not None)
+                    if self._reply_at is None:
+                        break
+                    self.latencies.append(self._reply_at - spoke_at)
+                    if turn < len(self.script) and random.random() < self.args.barge_in:
+                        # Talk over the reply: the next utterance starts while it plays
+                        self.barge_ins += 1
+                        self.stream(self.source.silence(self.args.barge_in_after))
+                    else:
+                        self.listen(lambda: not self._playing)
+
+                if not self._closed.is_set():
+                    ws.send_text(self.source.stop())
+                reader.join(timeout=self.args.timeout)
+        except Exception as e:
+            logging.error("Call %s failed: %r", self.call_sid, e)
+            self.errors += 1
+        return self
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stream concurrent scripted calls through /voice/stream")
+    parser.add_argument('--calls', type=int, default=10, help="concurrent simulated calls")
+    parser.add_argument('--turns', type=int, default=3, help="utterances per call")
+    parser.add_argument('--speaking-time', type=float, default=1.5, help="seconds each utterance takes to say")
+    parser.add_argument('--barge-in', type=float, default=0.3,
+                        help="fraction of replies the caller talks over")
+    parser.add_argument('--barge-in-after', type=float, default=0.3,
+                        help="seconds into a reply before the caller talks over it")
+    parser.add_argument('--ramp-up', type=float, default=2.0, help="seconds over which calls start")
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--tts-latency', type=float, default=0.2,
+                        help="seconds before the first reply frame (fake TTS) or per Minimax request")
+    parser.add_argument('--tts', choices=('fake', 'minimax'), default='fake',
+                        help="tone TTS in-process, or Minimax streaming TTS against the stub")
+    parser.add_argument('--jitter', type=float, default=0.05, help="+/- seconds added to every stub latency")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds a caller waits for a reply")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', dest='json_path', help="also write the report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stubs = start_stubs({
+        'groq': {'latency': args.llm_latency, 'jitter': args.jitter},
+        'minimax': {'latency': args.tts_latency, 'jitter': args.jitter},
+        'twilio': {}, 'hume': {}, 'vapi': {},
+    })
+
+    workdir = tempfile.mkdtemp(prefix='stream-test-')
+    os.environ.update(stub_environment(stubs))
+    os.environ.update({
+        'TWILIO_AUTH_TOKEN': AUTH_TOKEN,
+        'CASE_STORE_PATH': os.path.join(workdir, 'data.json'),
+        'TURN_JOURNAL_PATH': os.path.join(workdir, 'turns.db'),
+        'AGENT_PORT': '0',
+        'VOICE_MODE': 'stream',
+        'STREAM_STT': 'benchmarks.fake_media:ScriptedSTT',
+        'STREAM_TTS': ('benchmarks.fake_media:ToneTTS' if args.tts == 'fake'
+                       else 'agents.media_backends:MinimaxStreamingTTS'),
+        'FAKE_TTS_FIRST_FRAME_SECONDS': str(args.tts_latency),
+    })
+    import server
+    from agents.metrics import registry
+
+    logging.getLogger().setLevel(args.log_level)
+    started = time.perf_counter()
+    with TestClient(server.app) as client, ThreadPoolExecutor(max_workers=args.calls) as pool:
+        def start_call(index):
+            time.sleep(args.ramp_up * index / max(1, args.calls))
+            return Caller(client, index, args).run()
+        callers = list(pool.map(start_call, range(args.calls)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for caller in callers for latency in caller.latencies]
+    server_latency = registry.histogram('stream_turn_latency_seconds')
+    report = {
+        'calls': args.calls,
+        'turns_per_call': args.turns,
+        'elapsed_seconds': elapsed,
+        'turns': len(latencies),
+        'errors': sum(caller.errors for caller in callers),
+        'turn_latency': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'max': max(latencies, default=None),
+        },
+        'server_turn_latency': {
+            'p50': server_latency.recent_percentile(0.50, elapsed + 1),
+            'p95': server_latency.recent_percentile(0.95, elapsed + 1),
+        },
+        'barge_ins_attempted': sum(caller.barge_ins for caller in callers),
+        'barge_ins_detected': registry.counter('stream_barge_ins_total').value,
+        'stubs': {name: {'requests': stub.requests, 'errors': stub.errors} for name, stub in stubs.items()},
+    }
+
+    print(f"{args.calls} stream calls x {args.turns} turns in {elapsed:.1f}s, {report['errors']} failed")
+    if latencies:
+        print(f"turn latency (end of speech -> first reply frame) p50 {report['turn_latency']['p50']:.3f}s "
+              f"p95 {report['turn_latency']['p95']:.3f}s max {report['turn_latency']['max']:.3f}s")
+    if report['server_turn_latency']['p50'] is not None:
+        print(f"server latency (speech end detected -> first reply frame) "
+              f"p50 {report['server_turn_latency']['p50']:.3f}s p95 {report['server_turn_latency']['p95']:.3f}s")
+    print(f"barge-ins attempted {report['barge_ins_attempted']}, detected {report['barge_ins_detected']}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for stub in stubs.values():
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
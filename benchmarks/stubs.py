@@ -0,0 +1,205 @@
+"""
+Local stub servers for the external APIs the voice pipeline calls.
+
+Each stub answers with a canned payload after a configurable latency and fails
+a configurable fraction of requests, so load tests never touch Groq, Minimax,
+Twilio, Hume or Vapi.
+"""
+
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = ["wildlife", "police", "water", "fire", "medical"]
+
+
+def groq_completion(body):
+    """OpenAI-style chat completion wrapping a plausible call analysis"""
+    category = random.choice(CATEGORIES)
+    analysis = {
+        "analysis": {
+            "category": category,
+            "priority": random.randint(1, 5),
+            "current_known_info": {
+                "type": f"{category} emergency",
+                "location": f"{random.randint(1, 999)} Main Street",
+                "missing_critical_info": ["injuries"],
+            },
+        },
+        "conversation": {
+            "next_question": "Is anyone injured?",
+            "follow_up_questions": [],
+            "response_to_caller": "Help is being dispatched. Is anyone injured?",
+            "should_continue": True,
+            "conversation_context": {"emergency_type": category, "priority": "high", "questions_asked": []},
+        },
+    }
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(analysis)},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def minimax_speech(body):
+    setting = body.get('audio_setting', {})
+    if setting.get('format') == 'pcm':
+        # Quiet 16-bit PCM, about as long as the text would take to say
+        samples = int(setting.get('sample_rate', 8000) * 0.06 * len(body.get('text', '')))
+        audio = base64.b64encode(b'\x10\x00' * samples).decode()
+        return {"data": {"audio": audio}}
+    audio = base64.b64encode(f"audio:{body.get('text', '')}".encode()).decode()
+    return {"data": {"audio": audio}}
+
+
+def twilio_call_update(body):
+    return {"sid": "CA" + "0" * 32, "status": "completed"}
+
+
+def hume_chats(body):
+    return {"chats_page": [{"id": f"chat_{i}"} for i in range(3)]}
+
+
+def hume_chat_events(body):
+    return {"events_page": [
+        {"role": "USER", "message_text": "There is a fire on Main Street"},
+        {"role": "AGENT", "message_text": "Is anyone inside the building?"},
+    ]}
+
+
+def vapi_calls(body):
+    return [
+        {
+            "id": f"call_{i}",
+            "transcript": "Caller reports a car accident at 5th and Pine",
+            "customer": {"number": "+15550000000"},
+            "analysis": {"summary": "Car accident"},
+        }
+        for i in range(3)
+    ]
+
+
+# (method, path pattern, handler) routes served by every stub
+ROUTES = [
+    ('POST', re.compile(r'^/openai/v1/chat/completions$'), groq_completion),
+    ('POST', re.compile(r'^/v1/t2a_v2$'), minimax_speech),
+    ('POST', re.compile(r'^/2010-04-01/Accounts/[^/]+/Calls/[^/]+\.json$'), twilio_call_update),
+    ('GET', re.compile(r'^/v0/evi/chats$'), hume_chats),
+    ('GET', re.compile(r'^/v0/evi/chats/[^/]+$'), hume_chat_events),
+    ('GET', re.compile(r'^/call$'), vapi_calls),
+]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hundreds of concurrent calls connect at once; the default backlog of 5 drops SYNs
+    request_queue_size = 1024
+
+
+class StubBackend:
+    """A stub API server with its own latency and error rate"""
+
+    def __init__(self, name, latency=0.0, jitter=0.0, error_rate=0.0, host='127.0.0.1'):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = StubServer((host, 0), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self, method):
+                path = self.path.split('?', 1)[0]
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw and raw.lstrip()[:1] in (b'{', b'[') else {}
+                except json.JSONDecodeError:
+                    body = {}
+
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+
+                for route_method, pattern, handler in ROUTES:
+                    if route_method == method and pattern.match(path):
+                        break
+                else:
+                    return self._reply(404, {"error": f"no stub route for {method} {path}"})
+
+                if random.random() < stub.error_rate:
+                    with stub._lock:
+                        stub.errors += 1
+                    return self._reply(503, {"error": f"{stub.name} stub injected failure"})
+                return self._reply(200, handler(body))
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._serve('GET')
+
+            def do_POST(self):
+                self._serve('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"{self.name}-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def start_stubs(config):
+    """Start one stub per provider from {name: {latency, jitter, error_rate}}"""
+    return {name: StubBackend(name, **options).start() for name, options in config.items()}
+
+
+def stub_environment(stubs):
+    """Environment variables pointing the server and agents at the stubs"""
+    return {
+        'GROQ_API_KEY': 'stub',
+        'GROQ_BASE_URL': stubs['groq'].url,
+        'MINIMAX_API_KEY': 'stub',
+        'MINIMAX_GROUP_ID': 'stub',
+        'MINIMAX_BASE_URL': stubs['minimax'].url,
+        'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+        'TWILIO_API_BASE_URL': stubs['twilio'].url,
+        'HUME_API_URL': stubs['hume'].url,
+        'VAPI_API_URL': stubs['vapi'].url,
+    }
@@ -6,22 +6,26 @@ import folium
 from folium.plugins import MarkerCluster
 from streamlit_folium import folium_static
 import json
+import os
 import requests
 import matplotlib.pyplot as plt
 import altair as alt
+from agents.case_store import CaseStore, columnar_path, stats_path
 
-# Function to read JSON data from a file
-def read_json_data(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
+try:
+    import pyarrow as pa
+except ImportError:  # Fall back to the JSON snapshot without pyarrow
+    pa = None
+
+# Function to load the typed columnar snapshot written by the case store
+def load_columnar_snapshot(file_path):
+    # Memory-mapped, with Arrow-backed dtypes so no column is copied into numpy
+    table = pa.ipc.open_file(pa.memory_map(file_path)).read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
 
-# Function to process JSON data
-def process_data(json_data):
-    all_cases = []
-    for category, cases in json_data.items():
-        for case in cases:
-            case['category'] = category
-            all_cases.append(case)
+# Function to process case data read through the case store's category index
+def process_data(store):
+    all_cases = [dict(case, category=category) for category, case in store.rows()]
     
     df = pd.DataFrame(all_cases)
     expected_columns = ['case_number', 'location', 'dispatch', 'situation', 'open_status', 'stack_rank', 'category']
@@ -29,8 +33,77 @@ def process_data(json_data):
         if col not in df.columns:
             st.error(f"Missing expected column: {col}")
             return None
+    # Only incidents several callers reported carry a caller count
+    df['caller_count'] = df['caller_count'].fillna(1).astype('int64') if 'caller_count' in df.columns else 1
     return df
 
+# Function to read the chart aggregates maintained by the case store
+def read_stats(file_path):
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+# Function to fetch metric rollups from the voice server
+def fetch_metrics(url):
+    try:
+        response = requests.get(url, timeout=2)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException:
+        return None
+
+# Function to run a full-text search over cases on the voice server
+def fetch_search(url, query):
+    try:
+        response = requests.get(url, params={'q': query, 'limit': 50}, timeout=2,
+                                headers={'X-Admin-Token': os.getenv('ADMIN_TOKEN', '')})
+        response.raise_for_status()
+        return response.json()['results']
+    except requests.exceptions.RequestException:
+        return None
+
+# Function to render the cases matching a search
+def render_search_results(query, results):
+    st.subheader(f"Search: {query}")
+    if results is None:
+        st.write("Search is unavailable.")
+    elif not results:
+        st.write("No matching calls.")
+    else:
+        columns = ['case_number', 'category', 'location', 'situation', 'transcript', 'open_status', 'score']
+        st.dataframe(pd.DataFrame(results).reindex(columns=columns))
+
+# Function to pick one labelled series out of the metrics payload
+def find_metric(metrics, name, **labels):
+    for entry in metrics.get(name, []):
+        if all(entry['labels'].get(k) == v for k, v in labels.items()):
+            return entry
+    return None
+
+# Function to render call volume, stage latency and backlog
+def render_metrics_panel(metrics):
+    st.subheader("System Metrics")
+    if metrics is None:
+        st.write("Metrics are unavailable.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    calls = find_metric(metrics, 'stage_calls_total', stage='handle_call')
+    calls_series = calls['series'] if calls else []
+    col1.metric("Calls this minute", int(calls_series[-1]['value']) if calls_series else 0)
+    for col, label, stage in ((col2, "LLM p95 (s)", 'process_emergency_call'), (col3, "TTS p95 (s)", 'generate_speech')):
+        latency = find_metric(metrics, 'stage_duration_seconds', stage=stage)
+        recent = latency['series'][-1]['p95'] if latency and latency['series'] else None
+        col.metric(label, f"{recent:.2f}" if recent is not None else "-")
+
+    if calls_series:
+        calls_df = pd.DataFrame(calls_series)
+        calls_df['time'] = pd.to_datetime(calls_df['t'], unit='s')
+        st.line_chart(calls_df.set_index('time')['value'])
+
+    backlog = {entry['labels']['category']: entry['value'] for entry in metrics.get('open_cases', [])}
+    if backlog:
+        st.bar_chart(pd.Series(backlog, dtype='int64'))
+
 # Function to geocode locations
 def geocode_locations(locations):
     geolocator = Nominatim(user_agent="emergency_app")
@@ -58,6 +131,22 @@ def get_color(category):
     }
     return color_map.get(category, "gray")
 
+# Function to build the case map with one clustered marker per location
+def build_map(map_data):
+    # Create a map centered around the mean location of all valid coordinates
+    m = folium.Map(location=[map_data['latitude'].mean(), map_data['longitude'].mean()], zoom_start=12)
+    marker_cluster = MarkerCluster().add_to(m)
+
+    # Add markers for each location
+    for _, row in map_data.iterrows():
+        folium.Marker(
+            location=(row['latitude'], row['longitude']),
+            popup=f"Case: {row['case_number']}\nCategory: {row['category']}\nSituation: {row['situation']}"
+                  f"\nCallers: {row.get('caller_count', 1)}",
+            icon=folium.Icon(color=get_color(row['category']), icon='info-sign')
+        ).add_to(marker_cluster)
+    return m
+
 # Function to send POST request
 def send_post_request(data):
     url = "http://localhost:5000/webhook"
@@ -71,110 +160,152 @@ def send_post_request(data):
     except requests.exceptions.RequestException as e:
         st.error(f"An error occurred: {e}")
 
-# Streamlit app
-st.title("Emergency Call Insights")
-
-# Path to the JSON file
-json_file_path = "data.json"
-
-# Initialize session state to store data
-if 'data' not in st.session_state:
-    st.session_state.data = {}
-
-# Create placeholders for components
-data_placeholder = st.empty()
-insights_placeholder = st.empty()
-map_placeholder = st.empty()
-
-# Streamlit loop to check for file updates
-while True:
-    # Read the latest data
-    new_data = read_json_data(json_file_path)
-
-    # Check if the data has changed
-    if new_data != st.session_state.data:
-        st.session_state.data = new_data  # Update data if the file has changed
-        
-        # Send POST request with new data
-        # send_post_request(new_data)
-
-        # Process the updated data
-        with st.spinner("Processing data..."):
-            df = process_data(st.session_state.data)
-            if df is None or df.empty:
-                st.warning("No data available to display.")
-                continue  # Skip the rest if there's no data
-
-        # Update DataFrame
-        with data_placeholder.container():
-            st.subheader("Emergency Call Data")
-            st.dataframe(df)
-
-        # Update Insights
-        with insights_placeholder.container():
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.subheader("Open Status Distribution")
-                open_status_counts = df['open_status'].value_counts()
-                
-                # Pie chart for open status
-                fig, ax = plt.subplots()
-                ax.pie(open_status_counts.values, labels=open_status_counts.index, autopct='%1.1f%%', startangle=90)
-                ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
-                st.pyplot(fig)
-
-            with col2:
-                st.subheader("Task Priority by Category")
-                
-                # Bar chart for stack rank by category
-                chart = alt.Chart(df).mark_bar().encode(
-                    x='category:N',
-                    y='stack_rank:Q',
-                    color='category:N',
-                    tooltip=['category', 'stack_rank', 'situation']
-                ).properties(
-                    width=400,
-                    height=300
-                )
-                
-                st.altair_chart(chart, use_container_width=True)
-
-            # Keep the existing category distribution chart
-            category_counts = df['category'].value_counts()
-            st.subheader("Emergency Category Distribution")
-            st.bar_chart(category_counts)
-
-        # Geocode locations
-        with st.spinner("Geocoding locations..."):
-            coords = geocode_locations(df['location'].tolist())
-            df['latitude'] = [coord[0] for coord in coords]
-            df['longitude'] = [coord[1] for coord in coords]
-
-        # Prepare map data with colors
-        map_data = df[['latitude', 'longitude', 'category', 'situation', 'case_number']].dropna()
-        map_data['color'] = map_data['category'].apply(get_color)
-
-        # Update Map
-        with map_placeholder.container():
-            st.subheader("Locations on Map")
-            if not map_data.empty:
-                with st.spinner("Generating map..."):
-                    # Create a map centered around the mean location of all valid coordinates
-                    m = folium.Map(location=[map_data['latitude'].mean(), map_data['longitude'].mean()], zoom_start=12)
-                    marker_cluster = MarkerCluster().add_to(m)
-
-                    # Add markers for each location
-                    for _, row in map_data.iterrows():
-                        folium.Marker(
-                            location=(row['latitude'], row['longitude']),
-                            popup=f"Case: {row['case_number']}\nCategory: {row['category']}\nSituation: {row['situation']}",
-                            icon=folium.Icon(color=get_color(row['category']), icon='info-sign')
-                        ).add_to(marker_cluster)
-
-                    folium_static(m)
-            else:
-                st.write("No valid locations to display on the map.")
+def main():
+    # Streamlit app
+    st.title("Emergency Call Insights")
+
+    # Path to the JSON file
+    json_file_path = "data.json"
+
+    # Metrics endpoint of the voice server
+    metrics_url = os.getenv('METRICS_URL', 'http://localhost:8000/metrics?format=json')
+    # Search endpoint of the voice server
+    search_url = os.getenv('SEARCH_URL', 'http://localhost:8000/search')
+
+    arrow_file_path = columnar_path(json_file_path)
+    stats_file_path = stats_path(json_file_path)
+
+    # Read-only view of the case store, only needed without a columnar snapshot
+    store = None
+
+    # Initialize session state to track the last snapshot seen
+    if 'data_mtime' not in st.session_state:
+        st.session_state.data_mtime = None
+
+    # Words, prefixes (burg*) and "quoted phrases" over locations, situations and transcripts
+    query = st.text_input("Search calls", placeholder='oak st, "red pickup", burg*').strip()
+
+    # Create placeholders for components
+    search_placeholder = st.empty()
+    data_placeholder = st.empty()
+    insights_placeholder = st.empty()
+    map_placeholder = st.empty()
+    metrics_placeholder = st.empty()
+
+    # The pie chart figure is drawn into again on each refresh instead of leaking a new one;
+    # it is kept in the session, as every rerun (a search keystroke) runs main() again
+    if 'status_fig' not in st.session_state:
+        st.session_state.status_fig = plt.subplots()
+    status_fig, status_ax = st.session_state.status_fig
+
+    # Streamlit loop to check for file updates
+    while True:
+        # Metrics change independently of the case data, so refresh them every pass
+        with metrics_placeholder.container():
+            render_metrics_panel(fetch_metrics(metrics_url))
+
+        # New calls can match the search at any time, so it is refreshed with the metrics
+        if query:
+            with search_placeholder.container():
+                render_search_results(query, fetch_search(search_url, query))
+
+        # Check if the snapshot has changed since the last refresh
+        use_columnar = pa is not None and os.path.exists(arrow_file_path)
+        new_mtime = os.stat(arrow_file_path if use_columnar else json_file_path).st_mtime_ns
+        if new_mtime != st.session_state.data_mtime:
+            st.session_state.data_mtime = new_mtime  # Update data if the file has changed
+
+            # Send POST request with new data
+            # send_post_request(store.snapshot())
+
+            # Process the updated data
+            with st.spinner("Processing data..."):
+                if use_columnar:
+                    df = load_columnar_snapshot(arrow_file_path)
+                else:
+                    if store is None:
+                        store = CaseStore(json_file_path, read_only=True)
+                    else:
+                        store.reload()
+                    df = process_data(store)
+                if df is None or df.empty:
+                    st.warning("No data available to display.")
+                    continue  # Skip the rest if there's no data
+
+                # Charts render from the store's small aggregates, not the full DataFrame
+                if os.path.exists(stats_file_path):
+                    stats = read_stats(stats_file_path)
+                else:
+                    stats = store.aggregates.to_dict()
+
+            # Update DataFrame
+            with data_placeholder.container():
+                st.subheader("Emergency Call Data")
+                st.dataframe(df)
+
+            # Update Insights
+            with insights_placeholder.container():
+                col1, col2 = st.columns(2)
+
+                with col1:
+                    st.subheader("Open Status Distribution")
+                    open_status_counts = stats['by_status']
+
+                    # Pie chart for open status
+                    status_ax.clear()
+                    status_ax.pie(list(open_status_counts.values()), labels=list(open_status_counts.keys()), autopct='%1.1f%%', startangle=90)
+                    status_ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
+                    st.pyplot(status_fig)
+
+                with col2:
+                    st.subheader("Task Priority by Category")
+
+                    # Bar chart of case counts per priority, stacked by category
+                    chart = alt.Chart(pd.DataFrame(stats['by_category_priority'])).mark_bar().encode(
+                        x='category:N',
+                        y='count:Q',
+                        color='priority:N',
+                        tooltip=['category', 'priority', 'count']
+                    ).properties(
+                        width=400,
+                        height=300
+                    )
+
+                    st.altair_chart(chart, use_container_width=True)
+
+                # Keep the existing category distribution chart
+                category_counts = pd.Series(stats['by_category'], dtype='int64')
+                st.subheader("Emergency Category Distribution")
+                st.bar_chart(category_counts)
+
+                # New cases per time bucket over the last hour
+                if stats['arrivals']:
+                    arrivals = pd.DataFrame(stats['arrivals'])
+                    arrivals['time'] = pd.to_datetime(arrivals['bucket'], unit='s')
+                    st.subheader("New Cases per Minute")
+                    st.line_chart(arrivals.set_index('time')['count'])
+
+            # Geocode locations
+            with st.spinner("Geocoding locations..."):
+                coords = geocode_locations(df['location'].tolist())
+                df['latitude'] = [coord[0] for coord in coords]
+                df['longitude'] = [coord[1] for coord in coords]
+
+            # Prepare map data with colors
+            map_data = df[['latitude', 'longitude', 'category', 'situation', 'case_number', 'caller_count']].dropna()
+            map_data['color'] = map_data['category'].apply(get_color)
+
+            # Update Map
+            with map_placeholder.container():
+                st.subheader("Locations on Map")
+                if not map_data.empty:
+                    with st.spinner("Generating map..."):
+                        folium_static(build_map(map_data))
+                else:
+                    st.write("No valid locations to display on the map.")
+
+        # Wait for a while before checking for updates
+        time.sleep(5)  # Adjust the sleep duration as needed
 
-    # Wait for a while before checking for updates
-    time.sleep(5)  # Adjust the sleep duration as needed
+if __name__ == "__main__":
+    main()
@@ -1,319 +1,915 @@
-from flask import Flask, request, jsonify
-import json
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+from starlette.routing import Route, WebSocketRoute
+from contextlib import asynccontextmanager
 import os
 import logging
 import asyncio
-from twilio.twiml.voice_response import VoiceResponse, Gather
+import datetime
+import hmac
+import time
+import zlib
+import uvicorn
+from twilio.twiml.voice_response import VoiceResponse, Gather, Connect
 from agents.transcript_agent_minimax.twilio_handler import TwilioHandler
-from agents.fetch_agent import emergency_protocol, emergency_agent, EmergencyData
+from agents.transcript_agent_minimax.minimax_tts import scheduler as tts_scheduler
+from agents.fetch_agent import emergency_queue, runtime, agent_port, EmergencyData, case_store, turn_journal
+from agents.case_store import CATEGORIES, case_from_analysis
+from agents.bulk_ingest import read_lines, parse_record
+from agents.metrics import registry, timed
+from agents.tracing import tracer
+from agents.log_config import setup_logging, log_payload
+from agents.sharding import Cluster, FORWARDED_HEADER, node_id
+from agents.admission import AdmissionController, DEFERRED_ANALYSIS
+from agents.speculation import Speculator
+from agents.request_dedup import RequestDeduplicator, IDEMPOTENCY_HEADER
+from agents.media_stream import MediaStreamSession, StreamBackends
+from agents.scheduler import for_call, set_priority, forget_priority
 from twilio.request_validator import RequestValidator
 from dotenv import load_dotenv
-from functools import wraps
-import threading
-import urllib.parse
-from agents.gpt_processor import EmergencyProcessor
-from collections import defaultdict
+from functools import wraps, lru_cache
+from agents.gpt_processor import EmergencyProcessor, scheduler as llm_scheduler
+from collections import defaultdict, deque
 
 # Load environment variables
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Set up logging: queued, written by a background thread, caller numbers redacted
+setup_logging()
 
-app = Flask(__name__)
 twilio_handler = TwilioHandler()
 emergency_processor = EmergencyProcessor()  # Initialize emergency processor
 
-# Twilio request validator
-validator = RequestValidator(os.getenv('TWILIO_AUTH_TOKEN'))
+# Twilio request validator; without a token every request fails validation instead of the import
+validator = RequestValidator(os.getenv('TWILIO_AUTH_TOKEN', ''))
 
-# Path to the JSON file
-json_file_path = "data.json"
+# Public base URL Twilio is configured with (e.g. the ngrok URL); when set, the
+# signing URL of each route no longer depends on proxy headers
+public_base_url = os.getenv('PUBLIC_BASE_URL', '').rstrip('/')
+
+# Token the routes serving case data require in X-Admin-Token; unset, they are refused.
+# The server is reachable from the internet so Twilio can call it, and case
+# data holds callers' words and whereabouts
+admin_token = os.getenv('ADMIN_TOKEN', '')
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
 
 # Add this after other global variables
 conversation_history = defaultdict(list)
 
+# Nodes sharing the live calls; each call's state lives on the node owning its CallSid
+cluster = Cluster()
+shard_forwards = registry.counter('shard_forwards_total')
+shard_forward_errors = registry.counter('shard_forward_errors_total')
+
+# Follow-up questions from each call's latest analysis, asked while analysis is deferred
+follow_ups = {}
+
+# Steps down to cached prompts, a smaller model and deferred analysis under surge load
+admission = AdmissionController(emergency_queue)
+
+# Turns answered without analysis, as (call_sid, turn, transcript, history_text); analysed once the surge passes
+deferred_turns = deque()
+deferred_replay_batch = int(os.getenv('DEFERRED_REPLAY_BATCH', '8'))
+
+# Seconds a turn may spend on analysis and speech before the caller hears a holding prompt
+reply_timeout = float(os.getenv('REPLY_TIMEOUT_SECONDS', '10'))
+
+# Longest a call can last (Twilio's default time limit); journaled calls older than this ended unseen
+max_call_seconds = float(os.getenv('MAX_CALL_SECONDS', '14400'))
+
+# 'gather' answers each turn over HTTP with Gather and Play; 'stream' holds a Media Stream open for the call
+voice_mode = os.getenv('VOICE_MODE', 'gather')
+stream_backends = StreamBackends()
+
+# Fixed operator lines
+GREETING_LINE = "911, what's your emergency?"
+HOLDING_LINE = "Can you tell me more about your emergency?"
+ERROR_LINE = "I'm having trouble processing your emergency. Please hold while I get a human operator."
+FINAL_LINE = "Thank you for providing all the information. Help is on the way. Please stay on the line."
+
+# Tasks that outlive their request (slow turns, call teardown); referenced here so they are not collected
+background_tasks = set()
+
+# Gauges sampled into the metrics rollups: active calls and open backlog per category
+registry.gauge('active_calls', fn=lambda: len(conversation_history))
+for category in CATEGORIES:
+    registry.gauge('open_cases', fn=lambda category=category: case_store.aggregates.open_count(category), category=category)
+
+@lru_cache(maxsize=256)
+def signing_url(proto, host, path):
+    """Canonical URL Twilio signed for a route, computed once per route and host"""
+    if public_base_url:
+        return f"{public_base_url}{path}"
+    return f"{proto}://{host}{path}"
+
 def validate_twilio_request(f):
     """Validates that incoming requests genuinely originated from Twilio"""
     @wraps(f)
-    def decorated_function(*args, **kwargs):
+    async def decorated_function(request):
         # Get the full URL from the request
-        forwarded_proto = request.headers.get('X-Forwarded-Proto', 'http')
-        host = request.headers.get('X-Forwarded-Host', request.host)
-        url = f"{forwarded_proto}://{host}{request.path}"
+        url = signing_url(
+            request.headers.get('X-Forwarded-Proto', 'http'),
+            request.headers.get('X-Forwarded-Host', request.headers.get('host', request.url.netloc)),
+            request.url.path
+        )
+        form = await request.form()
         
-        # Log validation details for debugging
-        logging.debug(f"Validating Twilio request for URL: {url}")
-        logging.debug(f"Headers: {request.headers}")
-        logging.debug(f"Form data: {request.form}")
+        # Sampled, redacted payload dump for debugging
+        log_payload("Validating Twilio request form: %s", form)
         
         # X-Twilio-Signature header
         signature = request.headers.get('X-TWILIO-SIGNATURE', '')
-        logging.debug(f"Twilio signature: {signature}")
 
         # Validate request
-        if not validator.validate(url, request.form, signature):
-            logging.error("Twilio request validation failed")
-            return 'Invalid request', 403
+        with tracer.span("validate_twilio_request"):
+            valid = validator.validate(url, form, signature)
+        if not valid:
+            logging.error("Twilio request validation failed for %s", url)
+            return PlainTextResponse('Invalid request', status_code=403)
+
+        return await f(request)
+    return decorated_function
+
+def trace_request(f):
+    """Opens a latency trace for the request, keyed by the Twilio CallSid
 
-        return f(*args, **kwargs)
+    The LLM and TTS requests it makes are scheduled at the call's priority.
+    """
+    @wraps(f)
+    async def decorated_function(request):
+        form = await request.form()
+        with tracer.request(form.get('CallSid', ''), turn=0), for_call(form.get('CallSid', '')):
+            with tracer.span(f.__name__):
+                return await f(request)
+    return decorated_function
+
+def route_to_owner(f):
+    """Replays a Twilio callback on the node that owns its call"""
+    @wraps(f)
+    async def decorated_function(request):
+        forwarded = FORWARDED_HEADER in request.headers and cluster.authorized(request.headers)
+        if cluster.enabled and not forwarded:
+            # Read the raw body first; the form is parsed from the cached copy
+            body = await request.body()
+            owner = cluster.owner((await request.form()).get('CallSid', ''))
+            if owner != cluster.node_url:
+                return await forward_to_owner(request, owner, body, f)
+        return await f(request)
     return decorated_function
 
-# Initialize data file if it doesn't exist
-if not os.path.exists(json_file_path):
-    initial_data = {
-        "wildlife": [],
-        "police": [],
-        "water": [],
-        "fire": [],
-        "medical": []
+async def forward_to_owner(request, owner, body, handler):
+    # Keep what the owner needs to recompute the URL Twilio signed
+    headers = {
+        'Content-Type': request.headers.get('content-type', 'application/x-www-form-urlencoded'),
+        'X-Twilio-Signature': request.headers.get('X-Twilio-Signature', ''),
+        'X-Forwarded-Proto': request.headers.get('X-Forwarded-Proto', 'http'),
+        'X-Forwarded-Host': request.headers.get('X-Forwarded-Host', request.headers.get('host', request.url.netloc)),
     }
-    with open(json_file_path, 'w') as f:
-        json.dump(initial_data, f)
-    logging.info(f"Initialized data file at {json_file_path} with empty categories.")
+    # Retries of a forwarded request are recognized on the owner too
+    if IDEMPOTENCY_HEADER in request.headers:
+        headers[IDEMPOTENCY_HEADER] = request.headers[IDEMPOTENCY_HEADER]
+    shard_forwards.inc()
+    try:
+        with tracer.span("forward_to_owner"):
+            response = await cluster.forward(owner, request.url.path, body, headers)
+    except Exception as e:
+        # An unreachable owner must not leave the caller without an answer
+        shard_forward_errors.inc()
+        logging.warning("Could not forward %s to %s (%s); handling it here", request.url.path, owner, e)
+        return await handler(request)
+    return Response(response.content, status_code=response.status_code,
+                    media_type=response.headers.get('content-type'))
+
+def spawn(coro):
+    """Run a coroutine on the server loop without awaiting it"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def twiml(body):
+    return Response(body, media_type='text/xml')
+
+def stream_url(headers, url):
+    """wss:// URL of the media stream route, as Twilio connects to it and signs it"""
+    signed = signing_url(
+        headers.get('X-Forwarded-Proto', 'http'),
+        headers.get('X-Forwarded-Host', headers.get('host', url.netloc)),
+        '/voice/stream'
+    )
+    return 'ws' + signed[len('http'):] if signed.startswith('http') else signed
+
+def stream_twiml(request):
+    """TwiML connecting the call to the media stream route for its whole duration"""
+    response = VoiceResponse()
+    connect = Connect()
+    connect.stream(url=stream_url(request.headers, request.url))
+    response.append(connect)
+    return str(response)
+
+def partial_result_callback():
+    """Route Twilio posts interim transcripts to, or None when speculation is off"""
+    return '/voice/partial' if speculator.enabled else None
+
+def new_gather():
+    """Gather verb that posts the caller's next utterance back to /voice/transcribe"""
+    partial_results = {}
+    if partial_result_callback():
+        partial_results = {'partialResultCallback': partial_result_callback(), 'partialResultCallbackMethod': 'POST'}
+    return Gather(
+        input='speech dtmf',
+        action='/voice/transcribe',
+        method='POST',
+        timeout=10,
+        language='en-US',
+        speechTimeout='auto',
+        enhanced=True,
+        hints='emergency, help, fire, medical, police',
+        speechModel='phone_call',
+        **partial_results
+    )
+
+async def speak(text, prompt=False):
+    """TwiML speaking one line; `prompt` marks fixed text whose audio can be cached"""
+    if admission.static_prompts:
+        admission.record('static_prompts')
+        return twilio_handler.tts.static_twiml(text, voice_id="female_01", speed=1.0)
+    return await twilio_handler.tts.generate_twiml_response(text, voice_id="female_01", speed=1.0, prompt=prompt)
+
+async def error_reply():
+    response = VoiceResponse()
+    error_response = await speak(ERROR_LINE, prompt=True)
+    response.append(error_response)
+    return str(response)
+
+def reply_line(groq_analysis):
+    """The operator's next line from the AI analysis, and whether the conversation continues"""
+    conversation = groq_analysis.get('conversation', {})
+    if conversation.get('should_continue', True):
+        # Get the next question from AI
+        return conversation.get('response_to_caller', "Can you provide more details about your emergency?"), True
+    # Final response when all information is gathered
+    return FINAL_LINE, False
+
+async def build_reply(groq_analysis):
+    """TwiML for the operator's next line, based on the AI analysis"""
+    response = VoiceResponse()
+    line, more = reply_line(groq_analysis)
+    
+    if more:
+        # Add the response and gather more input using Minimax TTS
+        gather = new_gather()
+        tts_response = await speak(line)
+        gather.append(tts_response)
+        response.append(gather)
+    else:
+        final_response = await speak(line, prompt=True)
+        response.append(final_response)
+    
+    return str(response)
+
+def format_history(history):
+    """Conversation history as the transcript the AI sees"""
+    return "\n".join([
+        f"Caller: {item['transcript']}"
+        for item in history
+    ])
+
+def enqueue_dispatch(emergency_data):
+    """Hand an analysed turn to the emergency agent"""
+    # When its queue is full the turn waits for room off the reply path
+    # rather than holding up the caller
+    if not emergency_queue.offer(emergency_data):
+        logging.warning("Emergency queue full; call %s turn %d waits for room", emergency_data.call_sid, emergency_data.turn)
+        spawn(emergency_queue.put(emergency_data))
+
+async def speculate(text, call_sid, turn):
+    """Analysis of an unfinished turn from its interim transcript; journals and dispatches nothing"""
+    history = conversation_history.get(call_sid, [])[:turn - 1] + [{'transcript': text}]
+    with for_call(call_sid):
+        return await emergency_processor.process_emergency_call(text, format_history(history))
+
+# Analyses started on partial speech results, before the caller has finished the turn
+speculator = Speculator(speculate)
+
+# Replies to recent utterances, for Twilio's retries and repeated deliveries
+deduplicator = RequestDeduplicator()
+
+async def analyse_turn(transcript, history_text, call_sid, turn, speculation=None):
+    """Analyze one caller turn, journal the result and queue it for dispatch
+
+    `speculation` is a speculative analysis of the same turn to use instead of a new one.
+    """
+    groq_analysis = None
+    if speculation is not None:
+        try:
+            groq_analysis = await speculation
+        except (asyncio.CancelledError, Exception) as e:
+            logging.warning("Speculative analysis of call %s turn %d failed (%r); analysing again", call_sid, turn, e)
+    if groq_analysis is None:
+        # Process transcript through Groq with conversation history
+        small_model = admission.small_model
+        if small_model:
+            admission.record('small_model')
+        # Deferred and recovered turns run outside the call's requests but at its priority
+        with for_call(call_sid):
+            groq_analysis = await emergency_processor.process_emergency_call(transcript, history_text, small_model=small_model)
+    logging.debug("Groq analysis completed: %s", groq_analysis)
+
+    # The call's later LLM and TTS requests are scheduled by its latest priority
+    if turn == len(conversation_history.get(call_sid, ())):
+        set_priority(call_sid, groq_analysis['analysis'].get('priority'))
+
+    # Keep the latest turn's follow-ups for when analysis has to be deferred
+    if turn == len(conversation_history.get(call_sid, ())) and groq_analysis['analysis']['category'] != 'unknown':
+        questions = groq_analysis.get('conversation', {}).get('follow_up_questions', [])
+        follow_ups[call_sid] = [question for question in questions if isinstance(question, str)] if isinstance(questions, list) else []
+    
+    # Process emergency with the Groq analysis
+    emergency_data = EmergencyData(
+        category=groq_analysis['analysis']['category'],
+        cases=[case_from_analysis(transcript, groq_analysis)],
+        call_sid=call_sid,
+        turn=turn
+    )
+    turn_journal.record_analysis(call_sid, turn, emergency_data.model_dump_json())
+    enqueue_dispatch(emergency_data)
+    return groq_analysis
+
+async def respond_to_turn(transcript, history_text, call_sid, turn, speculation=None):
+    """Analyze one caller turn, queue it for dispatch and speak the reply"""
+    try:
+        groq_analysis = await analyse_turn(transcript, history_text, call_sid, turn, speculation)
+        return await build_reply(groq_analysis)
+    except Exception as e:
+        logging.error("Error in async processing: %s", e)
+        return await error_reply()
 
-@app.route('/voice', methods=['POST'])
+async def reanalyse_turn(transcript, history_text, call_sid, turn):
+    try:
+        await analyse_turn(transcript, history_text, call_sid, turn)
+    except Exception as e:
+        logging.error("Error re-analysing call %s turn %d: %s", call_sid, turn, e)
+
+def recover_turns():
+    """Rebuild live conversations and replay turns a previous process never dispatched"""
+    # Calls that ended while no node was up to take the status callback
+    expired = turn_journal.expire_calls(max_call_seconds)
+    for call_sid in expired:
+        case_store.close_case(call_sid)
+    if expired:
+        logging.info("Closed %d calls that ended without a status callback", len(expired))
+    conversation_history.update(turn_journal.conversations())
+    unfinished = turn_journal.unfinished()
+    for call_sid, turn, transcript, analysis in unfinished:
+        if analysis:
+            enqueue_dispatch(EmergencyData.model_validate_json(analysis))
+        else:
+            # The caller was never answered for this turn; analyse it again for dispatch only
+            history_text = format_history(conversation_history.get(call_sid, [])[:turn])
+            spawn(reanalyse_turn(transcript, history_text or f"Caller: {transcript}", call_sid, turn))
+    if unfinished or conversation_history:
+        logging.info("Recovered %d live calls and %d undispatched turns from %s",
+                     len(conversation_history), len(unfinished), turn_journal.path)
+
+async def holding_reply(question=None):
+    """Default reply when a turn's analysis overruns the reply deadline, or `question` instead"""
+    response = VoiceResponse()
+    gather = new_gather()
+    default_response = await speak(question or HOLDING_LINE, prompt=question is None)
+    gather.append(default_response)
+    response.append(gather)
+    return str(response)
+
+def defer_analysis(call_sid, turn, transcript, history_text):
+    """Queue a classified call's turn for later analysis; returns its next follow-up question, if any"""
+    admission.record('deferred_analysis')
+    deferred_turns.append((call_sid, turn, transcript, history_text))
+    questions = follow_ups.get(call_sid)
+    return questions.pop(0) if questions else None
+
+async def defer_turn(call_sid, turn, transcript, history_text):
+    """Answer a classified call's turn with its next follow-up and analyse the turn later"""
+    return await holding_reply(defer_analysis(call_sid, turn, transcript, history_text))
+
+@admission.on_change
+def resume_deferred_turns(level, previous):
+    if previous >= DEFERRED_ANALYSIS > level and deferred_turns:
+        spawn(replay_deferred_turns())
+
+async def replay_deferred_turns():
+    """Analyse deferred turns a batch at a time, pausing if the surge comes back"""
+    logging.info("Analysing %d deferred turns", len(deferred_turns))
+    while deferred_turns and not admission.deferred_analysis:
+        batch = [deferred_turns.popleft() for _ in range(min(deferred_replay_batch, len(deferred_turns)))]
+        await asyncio.gather(*(reanalyse_turn(*turn) for turn in batch))
+
+@timed("handle_call")
+@route_to_owner
+@trace_request
 @validate_twilio_request
-def handle_call():
+async def handle_call(request):
     """Handle incoming voice calls"""
     try:
-        response = twilio_handler.handle_incoming_call()
-        return response, 200
+        if voice_mode == 'stream':
+            return twiml(stream_twiml(request))
+        static_prompts = admission.static_prompts
+        if static_prompts:
+            admission.record('static_prompts')
+        response = await twilio_handler.handle_incoming_call(
+            static_prompts=static_prompts,
+            partial_result_callback=partial_result_callback()
+        )
+        return twiml(response)
     except Exception as e:
-        logging.error(f"Error handling call: {e}")
-        return str(e), 500
+        logging.error("Error handling call: %s", e)
+        return PlainTextResponse(str(e), status_code=500)
+
+async def answer_utterance(form, speech_result):
+    """Add a caller's utterance to the conversation as its next turn; returns the TwiML reply"""
+    call_sid = speech_result['CallSid']
+
+    # Add this transcript to conversation history
+    conversation_history[call_sid].append({
+        'transcript': speech_result['SpeechResult'],
+        'timestamp': form.get('Timestamp', '')
+    })
+    turn = len(conversation_history[call_sid])
+    tracer.set_turn(turn)
+    logging.info("Speech result for call %s turn %d (confidence %s)", call_sid, turn, speech_result['Confidence'])
+
+    # Journal the turn before any work starts so a restart can pick it up
+    if not turn_journal.record_utterance(call_sid, turn, speech_result['SpeechResult'], form.get('Timestamp', '')):
+        logging.debug("Call %s turn %d was already journaled", call_sid, turn)
+    
+    # Format conversation history for the AI
+    history_text = format_history(conversation_history[call_sid])
+    
+    processed_data = twilio_handler.process_speech(speech_result)
+
+    # An analysis already started on the caller's partial speech is kept if it ran on nearly the same words
+    speculation = speculator.claim(call_sid, turn, processed_data['transcript'])
 
-@app.route('/voice/transcribe', methods=['POST'])
+    # Under surge load, calls that are already classified skip the LLM on this turn
+    if speculation is None and admission.deferred_analysis and call_sid in follow_ups:
+        return await defer_turn(call_sid, turn, processed_data['transcript'], history_text)
+    
+    # The turn runs as its own task; if it overruns the deadline the caller
+    # hears a holding prompt while the task still finishes and dispatches
+    task = spawn(respond_to_turn(processed_data['transcript'], history_text, call_sid, turn, speculation))
+    try:
+        reply = await asyncio.wait_for(asyncio.shield(task), timeout=reply_timeout)
+    except asyncio.TimeoutError:
+        logging.warning("Turn %d of call %s overran %.1fs; sending holding prompt", turn, call_sid, reply_timeout)
+        reply = await holding_reply()
+    return reply
+
+@timed("handle_transcription")
+@route_to_owner
+@trace_request
 @validate_twilio_request
-def handle_transcription():
+async def handle_transcription(request):
     """Handle speech transcription results"""
     try:
-        # Log all incoming data
-        logging.info("Received speech recognition data:")
-        logging.info("-" * 50)
-        for key, value in request.form.items():
-            logging.info(f"{key}: {value}")
-        logging.info("-" * 50)
+        form = await request.form()
+
+        # Sampled, redacted dump of the incoming data
+        log_payload("Received speech recognition data: %s", form)
         
         # Get the speech recognition results
         speech_result = {
-            'SpeechResult': request.form.get('SpeechResult', request.form.get('Speech', '')),
-            'Confidence': request.form.get('Confidence', ''),
-            'CallSid': request.form.get('CallSid', ''),
-            'From': request.form.get('From', ''),
+            'SpeechResult': form.get('SpeechResult', form.get('Speech', '')),
+            'Confidence': form.get('Confidence', ''),
+            'CallSid': form.get('CallSid', ''),
+            'From': form.get('From', ''),
         }
         
         call_sid = speech_result['CallSid']
         
-        # Add this transcript to conversation history
-        conversation_history[call_sid].append({
-            'transcript': speech_result['SpeechResult'],
-            'timestamp': request.form.get('Timestamp', '')
-        })
-        
-        # Format conversation history for the AI
-        history_text = "\n".join([
-            f"Caller: {item['transcript']}"
-            for item in conversation_history[call_sid]
-        ])
-        
-        # Log the processed speech result
-        logging.info("Processed speech recognition data:")
-        logging.info("-" * 50)
-        for key, value in speech_result.items():
-            logging.info(f"{key}: {value}")
-        logging.info("-" * 50)
-        
-        processed_data = twilio_handler.process_speech(speech_result)
-        
-        # Process through Groq in a separate thread
-        def process_emergency_async():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                # Process transcript through Groq with conversation history
-                groq_analysis = loop.run_until_complete(
-                    emergency_processor.process_emergency_call(
-                        processed_data['transcript'],
-                        history_text
-                    )
-                )
-                logging.info(f"Groq Analysis completed: {groq_analysis}")
-                
-                # Create response based on AI analysis
-                response = VoiceResponse()
-                
-                if groq_analysis.get('conversation', {}).get('should_continue', True):
-                    # Get the next question from AI
-                    next_response = groq_analysis.get('conversation', {}).get(
-                        'response_to_caller',
-                        "Can you provide more details about your emergency?"
-                    )
-                    
-                    # Add the response and gather more input using Minimax TTS
-                    gather = Gather(
-                        input='speech dtmf',
-                        action='/voice/transcribe',
-                        method='POST',
-                        timeout=10,
-                        language='en-US',
-                        speechTimeout='auto',
-                        enhanced=True,
-                        hints='emergency, help, fire, medical, police',
-                        speechModel='phone_call'
-                    )
-                    
-                    # Use Minimax TTS for the response
-                    tts_response = twilio_handler.tts.generate_twiml_response(
-                        next_response,
-                        voice_id="female_01",
-                        speed=1.0
-                    )
-                    gather.append(tts_response)
-                    response.append(gather)
-                else:
-                    # Final response when all information is gathered
-                    final_response = twilio_handler.tts.generate_twiml_response(
-                        "Thank you for providing all the information. Help is on the way. Please stay on the line.",
-                        voice_id="female_01",
-                        speed=1.0
-                    )
-                    response.append(final_response)
-                
-                # Process emergency with the Groq analysis
-                emergency_data = EmergencyData(
-                    category=groq_analysis['analysis']['category'],
-                    cases=[{
-                        'transcript': processed_data['transcript'],
-                        'analysis': groq_analysis
-                    }]
-                )
-                loop.run_until_complete(emergency_protocol.process_emergency(emergency_data))
-                
-                return str(response)
-            except Exception as e:
-                logging.error(f"Error in async processing: {e}")
-                response = VoiceResponse()
-                error_response = twilio_handler.tts.generate_twiml_response(
-                    "I'm having trouble processing your emergency. Please hold while I get a human operator.",
-                    voice_id="female_01",
-                    speed=1.0
-                )
-                response.append(error_response)
-                return str(response)
-            finally:
-                loop.close()
-        
-        # Start processing in a background thread and wait for response
-        thread = threading.Thread(target=process_emergency_async)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout=10)  # Wait up to 10 seconds for processing
-        
-        # Create a default response if processing takes too long
-        response = VoiceResponse()
-        gather = Gather(
-            input='speech dtmf',
-            action='/voice/transcribe',
-            method='POST',
-            timeout=10,
-            language='en-US',
-            speechTimeout='auto',
-            enhanced=True,
-            hints='emergency, help, fire, medical, police',
-            speechModel='phone_call'
-        )
+        # A retried or repeated delivery of an utterance gets the reply to the first one
+        utterance, repeat = deduplicator.claim(call_sid, speech_result['SpeechResult'],
+                                               request.headers.get(IDEMPOTENCY_HEADER), form.get('Timestamp'))
+        if repeat:
+            logging.info("Repeated delivery of an utterance of call %s; answering with its first reply", call_sid)
+            return twiml(await utterance.wait())
+        try:
+            reply = await answer_utterance(form, speech_result)
+            utterance.resolve(reply)
+        finally:
+            # Repeats waiting on a delivery that failed get the error reply too
+            utterance.fail(RuntimeError(f"Answering an utterance of call {call_sid} failed"))
         
-        default_response = twilio_handler.tts.generate_twiml_response(
-            "Can you tell me more about your emergency?",
-            voice_id="female_01",
-            speed=1.0
-        )
-        gather.append(default_response)
-        response.append(gather)
-        
-        return str(response), 200
+        return twiml(reply)
     except Exception as e:
-        logging.error(f"Error processing transcription: {e}")
-        response = VoiceResponse()
-        error_response = twilio_handler.tts.generate_twiml_response(
-            "I'm having trouble processing your emergency. Please hold while I get a human operator.",
-            voice_id="female_01",
-            speed=1.0
-        )
-        response.append(error_response)
-        return str(response), 200
+        logging.error("Error processing transcription: %s", e)
+        return twiml(await error_reply())
 
-@app.route('/status/callback', methods=['POST'])
+@timed("handle_partial")
+@route_to_owner
 @validate_twilio_request
-def handle_status_callback():
+async def handle_partial_result(request):
+    """Start or refresh a speculative analysis from an interim transcript of the caller's turn"""
+    form = await request.form()
+    call_sid = form.get('CallSid', '')
+    # Speculation costs an extra model call per turn; none while the server is shedding load
+    if call_sid and speculator.enabled and not admission.small_model:
+        stable = form.get('StableSpeechResult', '')
+        text = f"{stable} {form.get('UnstableSpeechResult', '')}".strip()
+        try:
+            sequence = int(form.get('SequenceNumber', 0))
+        except ValueError:
+            sequence = 0
+        turn = len(conversation_history.get(call_sid, ())) + 1
+        speculator.feed(call_sid, turn, stable, text, sequence)
+    return Response('', status_code=200)
+
+async def stream_turn(call_sid, transcript):
+    """Analyse one utterance of a media stream call; returns the reply line and whether the call continues"""
+    conversation_history[call_sid].append({'transcript': transcript, 'timestamp': ''})
+    turn = len(conversation_history[call_sid])
+    with tracer.request(call_sid, turn=turn):
+        logging.info("Stream utterance for call %s turn %d", call_sid, turn)
+        turn_journal.record_utterance(call_sid, turn, transcript, '')
+        history_text = format_history(conversation_history[call_sid])
+
+        if admission.deferred_analysis and call_sid in follow_ups:
+            return defer_analysis(call_sid, turn, transcript, history_text) or HOLDING_LINE, True
+
+        # As in /voice/transcribe, an overrunning analysis still finishes and dispatches
+        task = spawn(analyse_turn(transcript, history_text, call_sid, turn))
+        try:
+            return reply_line(await asyncio.wait_for(asyncio.shield(task), timeout=reply_timeout))
+        except asyncio.TimeoutError:
+            logging.warning("Turn %d of call %s overran %.1fs; sending holding prompt", turn, call_sid, reply_timeout)
+            return HOLDING_LINE, True
+        except Exception as e:
+            logging.error("Error processing stream utterance: %s", e)
+            return ERROR_LINE, False
+
+def stream_static_prompts():
+    """Whether stream replies are spoken from cached audio only, as speak() falls back to static prompts"""
+    if admission.static_prompts:
+        admission.record('static_prompts')
+        return True
+    return False
+
+async def media_stream(websocket):
+    """Twilio Media Stream of a call in stream mode: caller audio in, operator speech out"""
+    # Twilio signs the WebSocket handshake URL with no parameters
+    url = stream_url(websocket.headers, websocket.url)
+    if not validator.validate(url, {}, websocket.headers.get('X-Twilio-Signature', '')):
+        logging.error("Twilio request validation failed for %s", url)
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    # The fixed lines stay cached, so a stream can still speak them while synthesis is shed
+    for line in (GREETING_LINE, HOLDING_LINE, ERROR_LINE, FINAL_LINE):
+        stream_backends.tts.pin(line)
+    session = MediaStreamSession(websocket, stream_backends.stt, stream_backends.tts, stream_turn, GREETING_LINE,
+                                 static_prompts=stream_static_prompts, fallback=HOLDING_LINE)
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        logging.info("Media stream for call %s disconnected", session.call_sid)
+    finally:
+        # The call's state lives on the node holding its stream; the call ends with it
+        if session.call_sid:
+            forget_call(session.call_sid)
+    if websocket.client_state == WebSocketState.CONNECTED:
+        await websocket.close()
+
+def forget_call(call_sid):
+    """Drop an ended call's live state and close its case"""
+    conversation_history.pop(call_sid, None)
+    follow_ups.pop(call_sid, None)
+    forget_priority(call_sid)
+    speculator.discard(call_sid)
+    case_store.close_case(call_sid)
+    turn_journal.end_call(call_sid)
+
+@route_to_owner
+@validate_twilio_request
+async def handle_status_callback(request):
     """Handle call status callbacks"""
     try:
-        call_status = request.form.get('CallStatus')
-        call_sid = request.form.get('CallSid')
+        form = await request.form()
+        call_status = form.get('CallStatus')
+        call_sid = form.get('CallSid')
         
-        logging.info(f"Call {call_sid} status: {call_status}")
+        logging.info("Call %s status: %s", call_sid, call_status)
         
         if call_status in ['completed', 'failed', 'busy', 'no-answer']:
-            # Clean up conversation history
-            if call_sid in conversation_history:
-                del conversation_history[call_sid]
-            twilio_handler.end_call(call_sid)
+            forget_call(call_sid)
+            # Twilio does not wait on the hang-up request
+            spawn(twilio_handler.end_call(call_sid))
         
-        return '', 200
+        return Response('', status_code=200)
     except Exception as e:
-        logging.error(f"Error handling status callback: {e}")
-        return str(e), 500
+        logging.error("Error handling status callback: %s", e)
+        return PlainTextResponse(str(e), status_code=500)
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
+@timed("webhook")
+async def webhook(request):
     try:
-        # Log HTTP request details
-        logging.info(f"Received {request.method} request at {request.url}")
-        logging.debug(f"Request headers: {request.headers}")
-        logging.debug(f"Request data: {request.data}")
-
-        data = request.json
-        logging.debug(f"Parsed JSON data: {data}")
-
-        # Read existing data
-        with open(json_file_path, 'r') as f:
-            existing_data = json.load(f)
-
-        # Append new data to the appropriate categories
-        for category, cases in data.items():
-            if category in existing_data:
-                for case in cases:
-                    # Check if the case_number already exists in the category
-                    if case['case_number'] not in [existing_case['case_number'] for existing_case in existing_data[category]]:
-                        existing_data[category].append(case)
-                        logging.debug(f"Added new case to category '{category}': {case}")
-                    else:
-                        logging.debug(f"Duplicate case number '{case['case_number']}' found in category '{category}', not adding.")
-
-        # Write updated data back to the file
-        with open(json_file_path, 'w') as f:
-            json.dump(existing_data, f)
-        logging.info("Data updated successfully.")
-
-        response = jsonify({"status": "success", "message": "Data received and updated."})
-        logging.info(f"Response: {response.get_json()}")
-        return response, 200
+        # Shed bulk reports while the emergency agent is backed up with live calls
+        if emergency_queue.saturated:
+            logging.warning("Emergency queue saturated (%d queued); deferring webhook report", emergency_queue.depth())
+            return JSONResponse({"status": "busy", "message": "Dispatcher is backed up, retry shortly."},
+                                status_code=503, headers={'Retry-After': '1'})
+
+        data = await request.json()
+
+        # Add new cases to the case store, keyed by case number; off the loop, like bulk uploads
+        added = await asyncio.to_thread(case_store.ingest, data)
+        logging.info("Webhook data updated successfully (%d new cases).", added)
+
+        return JSONResponse({"status": "success", "message": "Data received and updated."}, status_code=200)
 
     except Exception as e:
         logging.exception("An error occurred while processing the webhook.")
-        response = jsonify({"status": "error", "message": "An error occurred while processing the request."})
-        logging.info(f"Response: {response.get_json()}")
-        return response, 500
+        return JSONResponse({"status": "error", "message": "An error occurred while processing the request."}, status_code=500)
+
+# Records of a bulk upload filed per hold of the case store, and rejected records listed in its response
+BULK_BATCH = 500
+MAX_REPORTED_ERRORS = 100
+
+@timed("bulk_webhook")
+async def bulk_webhook(request):
+    """Cases uploaded as newline-delimited JSON, optionally gzipped; filed a batch at a time as the body streams in"""
+    if emergency_queue.saturated:
+        logging.warning("Emergency queue saturated (%d queued); deferring bulk upload", emergency_queue.depth())
+        return JSONResponse({"status": "busy", "message": "Dispatcher is backed up, retry shortly."},
+                            status_code=503, headers={'Retry-After': '1'})
+
+    counts = {'records': 0, 'added': 0, 'duplicate': 0, 'archived': 0, 'rejected': 0}
+    errors = []
+    batch = []
 
-def run_agent():
-    emergency_agent.run()
+    def reject(line, error):
+        counts['rejected'] += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line, 'error': error})
+
+    async def file_batch():
+        # Filed off the loop; live calls keep being served between batches
+        for status in await asyncio.to_thread(case_store.ingest_records, batch):
+            counts[status] += 1
+        batch.clear()
+
+    compressed = 'gzip' in request.headers.get('content-encoding', '').lower()
+    try:
+        async for line_number, line in read_lines(request.stream(), compressed):
+            counts['records'] += 1
+            try:
+                batch.append(parse_record(line))
+            except ValueError as e:
+                reject(line_number, str(e))
+                continue
+            if len(batch) >= BULK_BATCH:
+                await file_batch()
+        await file_batch()
+    except (zlib.error, ValueError) as e:
+        # Records before the corrupt part are already filed
+        await file_batch()
+        logging.warning("Bulk upload cut short: %s", e)
+        return JSONResponse(dict(counts, status="error", message=f"Invalid body: {e}", errors=errors), status_code=400)
+    except Exception:
+        logging.exception("An error occurred while processing a bulk upload.")
+        return JSONResponse({"status": "error", "message": "An error occurred while processing the request."}, status_code=500)
+
+    logging.info("Bulk upload of %d records: %d added, %d duplicate, %d archived, %d rejected",
+                 counts['records'], counts['added'], counts['duplicate'], counts['archived'], counts['rejected'])
+    return JSONResponse(dict(counts, status="success", errors=errors))
+
+@timed("sentence_audio")
+async def sentence_audio(request):
+    """Audio of one reply sentence, fetched by Twilio's <Play> as it reaches it"""
+    digest = request.path_params['digest']
+    speech = twilio_handler.tts.speech
+    key = speech.sentence(digest)
+    if key is None:
+        # Issued by another node, which knows the sentence
+        node = cluster.member(request.query_params.get('node', ''))
+        forwarded = FORWARDED_HEADER in request.headers and cluster.authorized(request.headers)
+        if node is None or node == cluster.node_url or forwarded:
+            return PlainTextResponse('Not found', status_code=404)
+        try:
+            response = await cluster.fetch(node, request.url.path)
+        except Exception as e:
+            logging.warning("Could not fetch sentence audio from %s: %s", node, e)
+            return PlainTextResponse('Speech synthesis failed', status_code=502)
+        return Response(response.content, status_code=response.status_code,
+                        media_type=response.headers.get('content-type'),
+                        headers={'Cache-Control': response.headers.get('cache-control', 'no-store')})
+    if admission.static_prompts and not speech.ready(*key):
+        # Synthesis is shed; only sentences already rendered, or on their way, are played
+        admission.record('static_prompts')
+        return PlainTextResponse('Speech synthesis is shed under load', status_code=503)
+    # Usually already rendered; a later sentence may still be on its way
+    audio = await speech.get(*key)
+    if audio is None:
+        return PlainTextResponse('Speech synthesis failed', status_code=502)
+    return Response(audio, media_type='audio/mpeg', headers={'Cache-Control': 'public, max-age=3600'})
+
+def admin_request(f):
+    """Rejects requests for case data without the admin token"""
+    @wraps(f)
+    async def decorated_function(request):
+        if not admin_token or not hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ''), admin_token):
+            return PlainTextResponse('Invalid admin token', status_code=403)
+        return await f(request)
+    return decorated_function
+
+@timed("search")
+@admin_request
+async def search(request):
+    """Cases matching a full-text query over locations, situations and transcripts"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return JSONResponse({"status": "error", "message": "Missing query parameter 'q'."}, status_code=400)
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), 100)
+    except ValueError:
+        limit = 20
+    category = request.query_params.get('category') or None
+    return JSONResponse({"query": query, "results": case_store.search(query, limit, category)})
+
+def parse_time(value, default):
+    """Epoch seconds from a query parameter given as epoch seconds or an ISO date or datetime (UTC)"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(value)
+        return (moment if moment.tzinfo else moment.replace(tzinfo=datetime.timezone.utc)).timestamp()
+
+@admin_request
+async def archived_case(request):
+    """One archived case by case number"""
+    case = await asyncio.to_thread(case_store.archive.get, request.path_params['case_number'])
+    if case is None:
+        return JSONResponse({"status": "error", "message": "Case not found in the archive."}, status_code=404)
+    return JSONResponse(case)
+
+@admin_request
+async def archived_cases(request):
+    """Archived cases that came in between ?from= (inclusive) and ?to= (exclusive), oldest first"""
+    params = request.query_params
+    try:
+        end = parse_time(params.get('to'), time.time())
+        start = parse_time(params.get('from'), end - 86400)
+        limit = min(int(params.get('limit', 1000)), 10000)
+    except ValueError:
+        return JSONResponse({"status": "error", "message": "Invalid from, to or limit."}, status_code=400)
+    cases = await asyncio.to_thread(case_store.archive.between, start, end, params.get('category') or None, limit)
+    return JSONResponse({"from": start, "to": end, "cases": cases})
+
+async def metrics(request):
+    """Expose metrics as Prometheus text, or as JSON rollups with ?format=json"""
+    if request.query_params.get('format') == 'json':
+        return JSONResponse(registry.to_dict(request.query_params.get('resolution', '1m')))
+    return PlainTextResponse(registry.to_prometheus(), media_type='text/plain; version=0.0.4')
+
+async def traces(request):
+    """Slowest traced turns and a per-stage latency breakdown"""
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        limit = 10
+    return JSONResponse({"slowest": tracer.slowest(limit), "stages": tracer.breakdown()})
+
+async def admission_status(request):
+    """Current degraded mode and the signals that put the server there"""
+    return JSONResponse(dict(admission.to_dict(), deferred_turns=len(deferred_turns),
+                             scheduling={'llm': llm_scheduler.to_dict(), 'tts': tts_scheduler.to_dict()}))
+
+async def call_traces(request):
+    """All buffered turn traces of one call"""
+    call_sid = request.path_params['call_sid']
+    return JSONResponse({"call_sid": call_sid, "turns": tracer.for_call(call_sid)})
+
+async def rebalance():
+    """Hand every live call this node no longer owns to its new owner"""
+    moved = 0
+    for call_sid in list(conversation_history):
+        owner = cluster.owner(call_sid)
+        if owner == cluster.node_url:
+            continue
+        try:
+            await cluster.handoff(owner, {'call_sid': call_sid, 'history': conversation_history[call_sid]})
+        except Exception as e:
+            logging.error("Handoff of call %s to %s failed: %s", call_sid, owner, e)
+            continue
+        # The new owner journals the conversation from here; turns accepted
+        # here are still dispatched from here
+        del conversation_history[call_sid]
+        follow_ups.pop(call_sid, None)
+        forget_priority(call_sid)
+        speculator.discard(call_sid)
+        turn_journal.end_call(call_sid)
+        moved += 1
+    if moved:
+        logging.info("Handed %d calls to their new owners", moved)
+    return moved
+
+def cluster_request(f):
+    """Rejects node-to-node requests without the cluster token"""
+    @wraps(f)
+    async def decorated_function(request):
+        if not cluster.authorized(request.headers):
+            return PlainTextResponse('Invalid cluster token', status_code=403)
+        return await f(request)
+    return decorated_function
+
+@cluster_request
+async def cluster_members(request):
+    """Install a new membership and hand off the calls that moved"""
+    data = await request.json()
+    cluster.set_members(data['nodes'])
+    moved = await rebalance()
+    return JSONResponse({"members": cluster.members, "moved": moved})
+
+@cluster_request
+async def cluster_handoff(request):
+    """Take over a live call from another node"""
+    data = await request.json()
+    conversation_history[data['call_sid']] = data['history']
+    turn_journal.adopt(data['call_sid'], data['history'])
+    return JSONResponse({"status": "success"})
+
+async def cluster_status(request):
+    """This node's view of the cluster and the calls it holds"""
+    return JSONResponse({
+        "node": cluster.node_url,
+        "members": cluster.members,
+        "calls": {call_sid: len(history) for call_sid, history in conversation_history.items()},
+    })
+
+async def leave_cluster():
+    """Take this node out of the ring and hand its calls to the remaining members"""
+    remaining = [node for node in cluster.members if node != cluster.node_url]
+    if not remaining:
+        return
+    # Hand the sessions over before the others stop routing calls here
+    cluster.set_members(remaining)
+    await rebalance()
+    await cluster.announce(remaining)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Sample gauges such as the open-case backlog into the metrics rollups
+    registry.start_sampler()
+    # Load the cases and rebuild live calls before the first callback is served
+    case_store.open()
+    recover_turns()
+    # Host the emergency and dispatcher agents on this loop. Building them queries
+    # the network, so calls are answered meanwhile; their turns wait on the emergency queue
+    spawn(runtime.start(agent_port))
+    admission.start()
+    if cluster.node_url:
+        # Other nodes may be asked for the /audio URLs this node hands out
+        twilio_handler.tts.speech.origin = node_id(cluster.node_url)
+    if cluster.enabled:
+        # A joining node's list includes itself; the others hand over its share of calls
+        spawn(cluster.announce(cluster.members))
+    yield
+    if cluster.enabled:
+        await leave_cluster()
+    await admission.stop()
+    # Let slow turns and hang-ups finish before their HTTP sessions close
+    if background_tasks:
+        await asyncio.wait(list(background_tasks), timeout=reply_timeout)
+    await twilio_handler.aclose()
+    await stream_backends.aclose()
+    await cluster.aclose()
+    await runtime.stop()
+    case_store.flush()
+    turn_journal.close()
+
+app = Starlette(routes=[
+    Route('/voice', handle_call, methods=['POST']),
+    Route('/voice/transcribe', handle_transcription, methods=['POST']),
+    Route('/voice/partial', handle_partial_result, methods=['POST']),
+    WebSocketRoute('/voice/stream', media_stream),
+    Route('/audio/{digest}', sentence_audio, methods=['GET']),
+    Route('/status/callback', handle_status_callback, methods=['POST']),
+    Route('/webhook', webhook, methods=['POST']),
+    Route('/webhook/bulk', bulk_webhook, methods=['POST']),
+    Route('/search', search, methods=['GET']),
+    Route('/archive/cases', archived_cases, methods=['GET']),
+    Route('/archive/cases/{case_number}', archived_case, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+    Route('/traces', traces, methods=['GET']),
+    Route('/admission', admission_status, methods=['GET']),
+    Route('/traces/{call_sid}', call_traces, methods=['GET']),
+    Route('/cluster', cluster_status, methods=['GET']),
+    Route('/cluster/members', cluster_members, methods=['POST']),
+    Route('/cluster/handoff', cluster_handoff, methods=['POST']),
+], lifespan=lifespan)
 
 if __name__ == '__main__':
-    # Start the Fetch AI agent in a separate thread
-    agent_thread = threading.Thread(target=run_agent)
-    agent_thread.daemon = True
-    agent_thread.start()
-    
-    # Start the Flask server
-    app.run(host='0.0.0.0', port=8000, debug=True, use_reloader=False)
+    # Serve every call from one event loop; log_config=None keeps the queued logging setup
+    uvicorn.run(app, host='0.0.0.0', port=8000, log_config=None)
@@ -0,0 +1,51 @@
+"""Case store behaviour that review found missing"""
+
+import pytest
+
+from agents.case_store import CaseStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CaseStore(str(tmp_path / 'data.json'), flush_interval_ms=0)
+    yield store
+    store.shutdown()
+
+
+def report(situation, location='12 Oak Street'):
+    return {'location': location, 'situation': situation, 'open_status': 'yes', 'stack_rank': 2}
+
+
+def test_caller_leaves_incident_when_their_category_changes(store):
+    store.file('CA1', 'fire', report("kitchen fire"), turn=1)
+    store.file('CA2', 'fire', report("smoke from the kitchen"), turn=1)
+    assert store.incident_of('CA2') == 'CA1'
+
+    store.file('CA2', 'medical', report("my husband collapsed from the smoke"), turn=2)
+
+    assert store.incident_of('CA2') == 'CA2'
+    assert store.category_of('CA2') == 'medical'
+    assert store.get('CA2')['situation'] == "my husband collapsed from the smoke"
+    incident = store.get('CA1')
+    assert incident['callers'] == ['CA1']
+    assert incident['caller_count'] == 1
+    assert store.category_of('CA1') == 'fire'
+
+
+def test_late_turn_of_archived_case_is_dropped(store):
+    store.file('CA1', 'medical', report("chest pain"), turn=1)
+    store.close_case('CA1')
+    # Archive it at once
+    store.retention = 0
+    store._next_archive = 0
+    store.flush()
+    assert store.get('CA1') is None
+    assert 'CA1' in store.archive
+
+    # Replayed from the journal after a restart
+    assert store.file('CA1', 'medical', report("chest pain, still breathing"), turn=2) is None
+    assert store.upsert('CA1', 'medical', report("chest pain, still breathing"), turn=2) is None
+
+    assert store.get('CA1') is None
+    assert store.open_cases() == []
+    assert [case['case_number'] for case in store.archive.between(0, float('inf'))] == ['CA1']
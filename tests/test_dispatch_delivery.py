@@ -0,0 +1,81 @@
+"""At-least-once dispatch: a turn stays journaled until the dispatcher has filed it"""
+
+import asyncio
+import logging
+
+import pytest
+from uagents import Model
+
+from agents import fetch_agent
+from agents.agent_runtime import AgentRuntime
+from agents.fetch_agent import EmergencyData
+from agents.turn_journal import TurnJournal
+
+
+class FakeContext:
+    logger = logging.getLogger('dispatcher')
+    session = None
+
+
+class FakeAgent:
+    """Just what AgentRuntime.send needs of a hosted agent"""
+
+    def __init__(self, name, handlers=None):
+        self.name = name
+        self.address = f"agent-{name}"
+        self._unsigned_message_handlers = handlers or {}
+        self._signed_message_handlers = {}
+
+    def _build_context(self):
+        return FakeContext()
+
+
+class FailingStore:
+    def file(self, *args, **kwargs):
+        raise OSError("disk full")
+
+
+class RecordingStore:
+    def __init__(self):
+        self.filed = []
+
+    def file(self, case_id, category, fields, turn=None):
+        self.filed.append((case_id, category, turn))
+
+
+@pytest.fixture
+def dispatch(tmp_path, monkeypatch):
+    digest = Model.build_schema_digest(EmergencyData)
+    runtime = AgentRuntime([
+        FakeAgent('emergency_processor'),
+        FakeAgent('emergency_dispatcher', {digest: fetch_agent.handle_emergency_message}),
+    ])
+    journal = TurnJournal(str(tmp_path / 'turns.db'))
+    monkeypatch.setattr(fetch_agent, 'runtime', runtime)
+    monkeypatch.setattr(fetch_agent, 'turn_journal', journal)
+    journal.record_utterance('CA1', 1, "my neighbour's house is on fire")
+    journal.record_analysis('CA1', 1, '{}')
+    yield journal
+    journal.close()
+
+
+def turn():
+    return EmergencyData(category='fire', cases=[{'situation': 'house fire'}], call_sid='CA1', turn=1)
+
+
+def test_turn_stays_journaled_when_filing_fails(dispatch, monkeypatch):
+    monkeypatch.setattr(fetch_agent, 'case_store', FailingStore())
+
+    asyncio.run(fetch_agent.process_batch([turn()]))
+
+    assert [row[:2] for row in dispatch.unfinished()] == [('CA1', 1)]
+
+
+def test_turn_completes_once_filed(dispatch, monkeypatch):
+    store = RecordingStore()
+    monkeypatch.setattr(fetch_agent, 'case_store', store)
+
+    asyncio.run(fetch_agent.process_batch([turn()]))
+
+    assert store.filed == [('CA1', 'fire', 1)]
+    assert dispatch.unfinished() == []
@@ -0,0 +1,71 @@
+"""Media stream replies while the admission controller sheds synthesis"""
+
+import asyncio
+import base64
+import json
+
+import pytest
+
+from agents.media_stream import MediaStreamSession, StreamingTTS
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+class CachedTTS(StreamingTTS):
+    """Speaks each line as one frame of its text; only `cached` lines are spoken when shed"""
+
+    def __init__(self, cached=()):
+        self.cached = set(cached)
+        self.synthesized = []
+
+    async def synthesize(self, text, cached_only=False):
+        if cached_only and text not in self.cached:
+            return
+        if not cached_only:
+            self.synthesized.append(text)
+        yield text.encode()
+
+
+def spoken(websocket):
+    return [base64.b64decode(message['media']['payload']).decode()
+            for message in websocket.sent if message['event'] == 'media']
+
+
+def play(tts, text, shed):
+    websocket = FakeWebSocket()
+    session = MediaStreamSession(websocket, None, tts, None, "911, what's your emergency?",
+                                 static_prompts=lambda: shed, fallback="Please hold.")
+    asyncio.run(session._play(text, heard_at=None))
+    return websocket
+
+
+def test_interfaces_are_abstract():
+    with pytest.raises(TypeError):
+        StreamingTTS()
+
+
+def test_reply_is_synthesized_normally():
+    tts = CachedTTS()
+    websocket = play(tts, "Stay on the line.", shed=False)
+    assert spoken(websocket) == ["Stay on the line."]
+    assert tts.synthesized == ["Stay on the line."]
+
+
+def test_shed_reply_falls_back_to_cached_prompt():
+    tts = CachedTTS(cached={"Please hold."})
+    websocket = play(tts, "Is anyone hurt?", shed=True)
+    assert spoken(websocket) == ["Please hold."]
+    assert tts.synthesized == []
+    assert websocket.sent[-1]['event'] == 'mark'
+
+
+def test_shed_reply_speaks_cached_line_itself():
+    tts = CachedTTS(cached={"Is anyone hurt?", "Please hold."})
+    websocket = play(tts, "Is anyone hurt?", shed=True)
+    assert spoken(websocket) == ["Is anyone hurt?"]